@@ -0,0 +1,707 @@
+'''
+Benchmarks for the scorer's per-ball hot paths.
+
+Run from the OpenScore directory so config.cfg is picked up:
+
+    python benchmark.py            (runs everything)
+    python benchmark.py pincount   (runs just the named benchmarks)
+'''
+
+import sys, os, random
+import tempfile
+import timeit
+import numpy
+import pygame
+from scorer.config import Config
+from scorer import detection
+from scorer.calibration import CompiledCalibration
+from scorer.capture import FrameBuffer, CaptureWorker
+from scorer.framesource import SyntheticSource, SharedFrameWriter, SharedMemorySource
+from scorer import autocalibrate
+from scorer.reference import ReferenceModel, REFERENCE_FULL, REFERENCE_EMPTY
+from scorer.pinstats import PinStatistics
+from scorer.player import Player
+from scorer.scoring import ScoreSheet, scoreGames
+from scorer.frame import Frame, GameRolls
+from scorer import progression
+from scorer.progression import getProgression
+
+DECK_SIZE = (320, 240)
+
+'''
+Load the calibration points and sizes from config.cfg
+'''
+def loadCalibration():
+    config = Config()
+    config.load()
+    points = []
+    for i in range(1,11):
+        point = config.gettuple("Calibration", "point_" + str(i))
+        if point == None:
+            point = (-1,-1)
+        points.append(point)
+    point_size = int(config.getvalue("Calibration", "point_size"))
+    min_points_to_trigger = int(config.getvalue("Calibration", "min_points_to_trigger"))
+    return config, points, point_size, min_points_to_trigger
+
+'''
+Build a thresholded deck surface with the given pins standing (filled with
+detect_color) and a sprinkling of noise pixels everywhere else.
+'''
+def makeDeckSurface(points, point_size, standing, detect_color, noise=200):
+    surface = pygame.Surface(DECK_SIZE, 0, 32)
+    surface.fill((0,0,0))
+    for i in range(len(points)):
+        if standing[i]:
+            px, py = points[i]
+            surface.fill(detect_color, (px, py, point_size + 1, point_size + 1))
+    for i in range(noise):
+        surface.set_at((random.randrange(DECK_SIZE[0]), random.randrange(DECK_SIZE[1])), detect_color)
+    return surface
+
+'''
+Time func over the given number of calls. Returns the mean time per call in ms.
+'''
+def timeCall(func, number):
+    return timeit.timeit(func, number=number) * 1000.0 / number
+
+def benchPinCount():
+    config, points, point_size, min_points_to_trigger = loadCalibration()
+    detect_color = config.gettuple("Camera", "detect_color")
+
+    decks = []
+    for i in range(20):
+        standing = [random.random() < 0.5 for p in points]
+        decks.append(makeDeckSurface(points, point_size, standing, detect_color))
+
+    calibration = CompiledCalibration(points, point_size, DECK_SIZE)
+    circles = CompiledCalibration(points, point_size, DECK_SIZE, "circle")
+
+    # Both engines have to agree on every deck before the timings mean anything
+    for deck in decks:
+        expected = detection.countRoiHitsPixelArray(deck, points, point_size, detect_color)
+        actual = detection.countRoiHits(deck, calibration, detect_color)
+        if list(actual) != list(expected):
+            print "MISMATCH: pixelarray %s numpy %s" % (str(expected), str(list(actual)))
+            return
+
+    deck = decks[0]
+    legacy_ms = timeCall(lambda: detection.countRoiHitsPixelArray(deck, points, point_size, detect_color), 20)
+    numpy_ms = timeCall(lambda: detection.countRoiHits(deck, calibration, detect_color), 2000)
+    circle_ms = timeCall(lambda: detection.countRoiHits(deck, circles, detect_color), 2000)
+    compile_ms = timeCall(lambda: CompiledCalibration(points, point_size, DECK_SIZE), 200)
+
+    print "Pin count (%d points, point_size %d)" % (len(points), point_size)
+    print "  pixelarray: %8.3f ms/ball" % legacy_ms
+    print "  numpy:      %8.3f ms/ball" % numpy_ms
+    print "  speedup:    %8.1fx" % (legacy_ms / numpy_ms)
+    print "  circles:    %8.3f ms/ball" % circle_ms
+    print "  compile:    %8.3f ms (once per calibration change)" % compile_ms
+
+'''
+Build a raw (width, height, 3) camera frame with the given pins standing,
+plus some sensor noise.
+'''
+def makeCameraFrame(points, point_size, standing, detect_color):
+    frame = numpy.random.randint(0, 60, DECK_SIZE + (3,)).astype(numpy.uint8)
+    for i in range(len(points)):
+        if standing[i]:
+            px, py = points[i]
+            frame[max(0, px):px + point_size + 1, max(0, py):py + point_size + 1] = detect_color
+    return frame
+
+def benchVote():
+    config, points, point_size, min_points_to_trigger = loadCalibration()
+    detect_color = config.gettuple("Camera", "detect_color")
+    threshold = config.gettuple("Camera", "threshold_detect")
+    calibration = CompiledCalibration(points, point_size, DECK_SIZE)
+
+    standing = [random.random() < 0.5 for p in points]
+    frames = numpy.array([makeCameraFrame(points, point_size, standing, detect_color) for i in range(9)])
+
+    # The stacked pass has to agree with reading the frames one at a time
+    stacked = detection.countFrameHits(frames, calibration, detect_color, threshold)
+    for i in range(len(frames)):
+        single = detection.countFrameHits(frames[i], calibration, detect_color, threshold)
+        if list(single[0]) != list(stacked[i]):
+            print "MISMATCH on frame %d: %s vs %s" % (i, str(list(single[0])), str(list(stacked[i])))
+            return
+
+    print "Multi-frame vote (%d points, point_size %d)" % (len(points), point_size)
+    for n in (1, 3, 5, 9):
+        ms = timeCall(lambda: detection.votePinStates(detection.countFrameHits(frames[:n], calibration, detect_color, threshold) >= min_points_to_trigger), 500)
+        print "  %d frames:   %8.3f ms/ball" % (n, ms)
+
+def benchRoi():
+    config, points, point_size, min_points_to_trigger = loadCalibration()
+    detect_color = config.gettuple("Camera", "detect_color")
+    threshold = config.gettuple("Camera", "threshold_detect")
+    other_colors = config.gettuple("Camera", "other_colors_nondetect")
+    calibration = CompiledCalibration(points, point_size, DECK_SIZE)
+    standing = [random.random() < 0.5 for p in points]
+
+    # Pixels exactly at the threshold are hits in both modes, one step further in neither
+    boundary = tuple(max(0, c - t) for c, t in zip(detect_color, threshold))
+    outside = tuple(max(0, c - t - 1) for c, t in zip(detect_color, threshold))
+
+    print "Per-ball processing, whole snapshot vs calibration regions only"
+    for scale in (1, 2, 4):
+        cam_size = (DECK_SIZE[0] * scale, DECK_SIZE[1] * scale)
+        frame = makeCameraFrame(points, point_size, standing, detect_color)
+        for px, py in points:
+            if px < 0 or py < 0: continue
+            frame[px:px + point_size + 1, py] = boundary
+            frame[px:px + point_size + 1, py + 1] = outside
+        frame = frame.repeat(scale, axis=0).repeat(scale, axis=1)
+        buffer = FrameBuffer(cam_size)
+        buffer.write(frame, 0)
+
+        snapshot = pygame.Surface(cam_size, 0, 32)
+        thresholded = pygame.Surface(cam_size, 0, 32)
+        latest = numpy.empty(frame.shape, dtype=numpy.uint8)
+
+        # What getDeckSnapshot + getPinCount do in "surface" mode
+        def surfaceMode():
+            buffer.latest(latest)
+            pygame.surfarray.blit_array(snapshot, latest)
+            thresholded.fill(detect_color)
+            pygame.transform.threshold(thresholded, snapshot, detect_color, threshold, other_colors, 1)
+            resized = pygame.Surface(DECK_SIZE, 0, 32)
+            pygame.transform.scale(thresholded, DECK_SIZE, resized)
+            return detection.countRoiHits(resized, calibration, detect_color)
+
+        def roiMode():
+            xs, ys = calibration.sampleCoordinates(cam_size)
+            return detection.countSampleHits(buffer.sampleLatest(xs, ys)[0], calibration, detect_color, threshold)
+
+        # Both modes have to find the same hits in the same frame
+        if list(surfaceMode()) != list(roiMode()[0]):
+            print "MISMATCH at %dx%d: surface %s roi %s" % (cam_size[0], cam_size[1], str(list(surfaceMode())), str(list(roiMode()[0])))
+            return
+
+        surface_ms = timeCall(surfaceMode, 200)
+        roi_ms = timeCall(roiMode, 2000)
+        print "  %4dx%-4d  surface: %8.3f ms/ball   roi: %8.3f ms/ball   (%.1fx)" % (cam_size[0], cam_size[1], surface_ms, roi_ms, surface_ms / roi_ms)
+
+def benchSource():
+    config, points, point_size, min_points_to_trigger = loadCalibration()
+    detect_color = config.gettuple("Camera", "detect_color")
+    threshold = config.gettuple("Camera", "threshold_detect")
+    calibration = CompiledCalibration(points, point_size, DECK_SIZE)
+
+    # Unpaced synthetic racks: every rack read back has to match what was drawn
+    source = SyntheticSource(DECK_SIZE, points, point_size, detect_color, 0, 1, 0)
+    surface = pygame.Surface(DECK_SIZE, 0, 32)
+    for i in range(50):
+        source.get_image(surface)
+        hits = detection.countFrameHits(pygame.surfarray.array3d(surface), calibration, detect_color, threshold)
+        if list(hits[0] >= min_points_to_trigger) != source.standing:
+            print "MISMATCH on rack %d" % i
+            return
+
+    print "Synthetic source through the capture worker, roi reads from the buffer"
+    worker = CaptureWorker(SyntheticSource(DECK_SIZE, points, point_size, detect_color, 0, 30, 0))
+    worker.start()
+    worker.buffer.waitForFrame(0, 2.0)
+    xs, ys = calibration.sampleCoordinates(DECK_SIZE)
+    reads = 0
+    captured = worker.buffer.frames_captured
+    start = timeit.default_timer()
+    while timeit.default_timer() - start < 2.0:
+        detection.countSampleHits(worker.buffer.sampleLatest(xs, ys)[0], calibration, detect_color, threshold)
+        reads += 1
+    elapsed = timeit.default_timer() - start
+    worker.stop()
+    print "  captured: %8.0f frames/s" % ((worker.buffer.frames_captured - captured) / elapsed)
+    print "  scored:   %8.0f reads/s alongside capture" % (reads / elapsed)
+
+def benchAutoCalibrate():
+    config, points, point_size, min_points_to_trigger = loadCalibration()
+    detect_color = config.gettuple("Camera", "detect_color")
+
+    # A full rack with noise: every point has to come back on its own pin
+    deck = makeDeckSurface(points, point_size, [True] * len(points), detect_color)
+    mask = pygame.surfarray.array2d(deck) == deck.map_rgb(detect_color)
+    result = autocalibrate.calibrateFromMask(mask, 10)
+    for i in range(len(points)):
+        found = result["points"][i]
+        if abs(found[0] - points[i][0]) > 1 or abs(found[1] - points[i][1]) > 1:
+            print "MISMATCH on pin %d: configured %s, found %s" % (i + 1, str(points[i]), str(found))
+            return
+
+    print "Automatic calibration (%dx%d mask)" % DECK_SIZE
+    print "  label:      %8.3f ms" % timeCall(lambda: autocalibrate.labelComponents(mask), 20)
+    print "  calibrate:  %8.3f ms" % timeCall(lambda: autocalibrate.calibrateFromMask(mask, 10), 20)
+
+def benchReference():
+    config, points, point_size, min_points_to_trigger = loadCalibration()
+    detect_color = config.gettuple("Camera", "detect_color")
+    threshold = config.gettuple("Camera", "threshold_detect")
+    calibration = CompiledCalibration(points, point_size, DECK_SIZE)
+    xs, ys = calibration.sampleCoordinates(DECK_SIZE)
+
+    def samples(standing, brightness):
+        frame = makeCameraFrame(points, point_size, standing, detect_color)
+        return (frame[xs, ys] * brightness).astype(numpy.uint8)[numpy.newaxis]
+
+    model = ReferenceModel(calibration, DECK_SIZE)
+    model.setReference("normal", REFERENCE_FULL, samples([True] * len(points), 1.0))
+    model.setReference("normal", REFERENCE_EMPTY, samples([False] * len(points), 1.0))
+
+    # The lights slowly dim to a third over the evening
+    color_errors = 0
+    reference_errors = 0
+    balls = 300
+    for i in range(balls):
+        brightness = 1.0 - 0.65 * i / (balls - 1)
+        standing = numpy.random.rand(len(points)) < 0.5
+        sampled = samples(standing, brightness)
+        by_color = detection.countSampleHits(sampled, calibration, detect_color, threshold)[0] >= min_points_to_trigger
+        by_reference, scores = model.classify(sampled, "normal")
+        model.update(sampled, scores, "normal")
+        color_errors += (by_color != standing).sum()
+        reference_errors += (by_reference[0] != standing).sum()
+
+    print "Reference engine, %d balls with the lighting dimming to 35%%" % balls
+    print "  detect color: %5d wrong pins" % color_errors
+    print "  reference:    %5d wrong pins" % reference_errors
+    print "  classify:     %8.3f ms/ball" % timeCall(lambda: model.classify(sampled, "normal"), 2000)
+    print "  update:       %8.3f ms/ball" % timeCall(lambda: model.update(sampled, scores, "normal"), 2000)
+
+def benchLuma():
+    config, points, point_size, min_points_to_trigger = loadCalibration()
+    detect_color = config.gettuple("Camera", "detect_color")
+    threshold = config.gettuple("Camera", "threshold_detect")
+    calibration = CompiledCalibration(points, point_size, DECK_SIZE)
+    standing = [random.random() < 0.5 for p in points]
+
+    print "Region reads, all three channels vs the Y plane only"
+    for scale in (1, 2, 4):
+        cam_size = (DECK_SIZE[0] * scale, DECK_SIZE[1] * scale)
+        frame = makeCameraFrame(points, point_size, standing, detect_color)
+        frame = frame.repeat(scale, axis=0).repeat(scale, axis=1)
+        buffer = FrameBuffer(cam_size)
+        buffer.write(frame, 0)
+        xs, ys = calibration.sampleCoordinates(cam_size)
+
+        def rgbMode():
+            return detection.countSampleHits(buffer.sampleLatest(xs, ys)[0], calibration, detect_color, threshold)
+
+        def lumaMode():
+            return detection.countChannelHits(buffer.sampleLatest(xs, ys, 0)[0], calibration, detect_color[0], threshold[0])
+
+        if list(rgbMode()[0]) != list(lumaMode()[0]):
+            print "MISMATCH: rgb %s luma %s" % (str(list(rgbMode()[0])), str(list(lumaMode()[0])))
+            return
+
+        rgb_ms = timeCall(rgbMode, 2000)
+        luma_ms = timeCall(lumaMode, 2000)
+        print "  %4dx%-4d  rgb: %8.3f ms/ball (%d bytes)   luma: %8.3f ms/ball (%d bytes)   (%.1fx)" % (cam_size[0], cam_size[1],
+            rgb_ms, len(xs) * 3, luma_ms, len(xs), rgb_ms / luma_ms)
+
+def benchPinStats():
+    stats = PinStatistics()
+    standing = numpy.random.rand(10) < 0.5
+    ratios = numpy.where(standing, 0.8, 0.1)
+    for i in range(100):
+        stats.add(ratios, standing)
+        standing = ~standing
+        ratios = numpy.where(standing, 0.8, 0.1)
+
+    print "Per pin statistics"
+    print "  add:        %8.3f ms/ball" % timeCall(lambda: stats.add(ratios, standing), 5000)
+    print "  thresholds: %8.3f ms" % timeCall(lambda: stats.thresholds(), 1000)
+
+def benchBurst():
+    config, points, point_size, min_points_to_trigger = loadCalibration()
+    detect_color = config.gettuple("Camera", "detect_color")
+    threshold = config.gettuple("Camera", "threshold_detect")
+    calibration = CompiledCalibration(points, point_size, DECK_SIZE)
+    standing = [random.random() < 0.5 for p in points]
+
+    buffer = FrameBuffer(DECK_SIZE)
+    buffer.write(makeCameraFrame(points, point_size, standing, detect_color), 0)
+    xs, ys = calibration.sampleCoordinates(DECK_SIZE)
+    flat = xs * DECK_SIZE[1] + ys
+    samples = numpy.empty((1, len(xs), 3), dtype=numpy.uint8)
+
+    def sampleLatest():
+        return detection.countSampleHits(buffer.sampleLatest(xs, ys)[0], calibration, detect_color, threshold)
+
+    def sampleInto():
+        buffer.sampleInto(flat, samples[0])
+        return detection.countSampleHits(samples, calibration, detect_color, threshold)
+
+    if list(sampleLatest()[0]) != list(sampleInto()[0]):
+        print "MISMATCH: sampleLatest %s sampleInto %s" % (str(list(sampleLatest()[0])), str(list(sampleInto()[0])))
+        return
+
+    print "Burst mode, per frame region read"
+    print "  sampleLatest: %8.3f ms/frame" % timeCall(sampleLatest, 2000)
+    print "  sampleInto:   %8.3f ms/frame" % timeCall(sampleInto, 2000)
+
+def benchLanes():
+    config, points, point_size, min_points_to_trigger = loadCalibration()
+    detect_color = config.gettuple("Camera", "detect_color")
+    calibration = CompiledCalibration(points, point_size, DECK_SIZE)
+    standing = [random.random() < 0.5 for p in points]
+
+    # Two lanes side by side in a frame twice as wide as the deck
+    pair_size = (DECK_SIZE[0] * 2, DECK_SIZE[1])
+    frame = numpy.zeros(pair_size + (3,), dtype=numpy.uint8)
+    frame[:DECK_SIZE[0]] = makeCameraFrame(points, point_size, standing, detect_color)
+    frame[DECK_SIZE[0]:] = frame[:DECK_SIZE[0]]
+    xs, ys = calibration.sampleCoordinates(DECK_SIZE)
+    right_xs = xs + DECK_SIZE[0]
+
+    # The left lane's scorer owns the camera, the right one reads what it shares
+    path = os.path.join(tempfile.gettempdir(), "openscore_bench")
+    writer = SharedFrameWriter(path, pair_size)
+    source = SharedMemorySource(path)
+    surface = pygame.Surface(pair_size, 0, 32)
+
+    def publish():
+        writer.write(frame)
+
+    def shared():
+        writer.write(frame)
+        source.get_image(surface)
+        return pygame.surfarray.pixels3d(surface)[right_xs, ys]
+
+    try:
+        if (shared() != frame[right_xs, ys]).any():
+            print "MISMATCH: the shared frame differs from the captured one"
+            return
+
+        print "Lane pair under one camera, the other lane through the shared frame"
+        print "  publish:  %8.3f ms/frame" % timeCall(publish, 2000)
+        print "  read:     %8.3f ms/frame" % timeCall(shared, 2000)
+    finally:
+        os.remove(path)
+
+def benchBlob():
+    config, points, point_size, min_points_to_trigger = loadCalibration()
+    detect_color = config.gettuple("Camera", "detect_color")
+    threshold = config.gettuple("Camera", "threshold_detect")
+    min_blob = int(config.getvalue_default("Camera", "blob_min_size", 10))
+    calibration = CompiledCalibration(points, point_size, DECK_SIZE)
+
+    # Every pin down, with noise pixels scattered over the deck
+    deck = makeDeckSurface(points, point_size, [False] * len(points), detect_color, 2000)
+    standing = [random.random() < 0.5 for p in points]
+    frames = numpy.array([makeCameraFrame(points, point_size, standing, detect_color) for i in range(3)])
+    xs, ys = calibration.sampleCoordinates(DECK_SIZE)
+
+    counted = detection.countRoiHits(deck, calibration, detect_color)
+    blobs = detection.countBlobHits(deck, calibration, detect_color, min_blob)
+    print "Blob detection (min_blob %d)" % min_blob
+    print "  noise hits, point count: %s" % str(list(counted))
+    print "  noise hits, blobs:       %s" % str(list(blobs))
+
+    expected = detection.countSampleHits(frames[:, xs, ys], calibration, detect_color, threshold)
+    actual = detection.countSampleHits(frames[:, xs, ys], calibration, detect_color, threshold, min_blob)
+    for i in range(len(points)):
+        if standing[i] and (actual[:, i] != expected[:, i]).any():
+            print "MISMATCH on standing pin %d: %s vs %s" % (i + 1, str(actual[:, i]), str(expected[:, i]))
+            return
+
+    print "  surface, point count: %8.3f ms/ball" % timeCall(lambda: detection.countRoiHits(deck, calibration, detect_color), 500)
+    print "  surface, blobs:       %8.3f ms/ball" % timeCall(lambda: detection.countBlobHits(deck, calibration, detect_color, min_blob), 100)
+    for n in (1, 3):
+        print "  %d frame regions, point count: %8.3f ms/ball" % (n, timeCall(lambda: detection.countSampleHits(frames[:n, xs, ys], calibration, detect_color, threshold), 500))
+        print "  %d frame regions, blobs:       %8.3f ms/ball" % (n, timeCall(lambda: detection.countSampleHits(frames[:n, xs, ys], calibration, detect_color, threshold, min_blob), 100))
+
+# Every legal frame as the balls it is made of
+FRAMES = [(10,)] + [(first, second) for first in range(10) for second in range(11 - first)]
+TENTH_FRAMES = [(first, second) for first in range(10) for second in range(10 - first)] + \
+    [(first, 10 - first, fill) for first in range(10) for fill in range(11)] + \
+    [(10, second, fill) for second in range(11) for fill in range(11 - second if second < 10 else 11)]
+
+'''
+Stands in for the BowlingScorer a Player reads its game settings from.
+'''
+class SinglePlayerGame(object):
+    frames_per_turn = 1
+    min_pincount_strike = 10
+
+'''
+Textbook scoring of a finished game's balls, as cumulative frame scores.
+'''
+def referenceFrameScores(rolls):
+    scores = []
+    total = 0
+    ball = 0
+    for frame in range(10):
+        if rolls[ball] == 10:
+            total += 10 + rolls[ball + 1] + rolls[ball + 2]
+            ball += 1
+        elif rolls[ball] + rolls[ball + 1] == 10:
+            total += 10 + rolls[ball + 2]
+            ball += 2
+        else:
+            total += rolls[ball] + rolls[ball + 1]
+            ball += 2
+        scores.append(total)
+    return scores
+
+'''
+Play a game through Player.addShot, checking the score sheet against the
+string and calculate() scoring every time a frame completes. Returns an error
+message, or None if everything agreed.
+'''
+def checkGame(player, frames):
+    player.reset()
+    rolls = []
+    for frame in frames:
+        for pins in frame:
+            rolls.append(pins)
+            completed = player.current_frame
+            player.addShot(pins, 0)
+            if not player.frames[completed].hasBowled():
+                continue
+
+            sheet = player.sheet
+            if int(player.current_score) != player.score(player.getGameString()):
+                return "total %s, string scoring %d" % (player.current_score, player.score(player.getGameString()))
+            player.calculate()
+            for i in range(10):
+                if player.frames[i].shouldDisplay and (not sheet.final[i] or sheet.cumulative[i] != player.frames[i].score):
+                    return "frame %d: %d (final %s), calculate() %d" % (i + 1, sheet.cumulative[i], sheet.final[i], player.frames[i].score)
+
+    expected = referenceFrameScores(rolls)
+    if not all(player.sheet.final) or player.sheet.cumulative != expected:
+        return "frames %s, expected %s" % (str(player.sheet.cumulative), str(expected))
+    return None
+
+def benchScoring():
+    pygame.font.init()
+    player = Player("bench", 0, SinglePlayerGame(), False)
+
+    # There are far too many games to try them all, but a frame's score only
+    # depends on the next two balls: try every pair of neighbouring frames
+    # anywhere in the game and every way of finishing one, with random frames
+    # around them
+    games = []
+    for position in range(8):
+        for first in FRAMES:
+            for second in FRAMES:
+                game = [random.choice(FRAMES) for i in range(9)] + [random.choice(TENTH_FRAMES)]
+                game[position] = first
+                game[position + 1] = second
+                games.append(game)
+    for ninth in FRAMES:
+        for tenth in TENTH_FRAMES:
+            games.append([random.choice(FRAMES) for i in range(8)] + [ninth, tenth])
+
+    shown_before = 0
+    shown_now = 0
+    for game in games:
+        error = checkGame(player, game)
+        if error != None:
+            print "MISMATCH in %s: %s" % (str(game), error)
+            return
+        shown_now += sum(player.sheet.final)
+        shown_before += sum(f.shouldDisplay for f in player.frames)
+
+    game = [(10,), (9, 1), (10,), (10,), (7, 2), (8, 2), (10,), (0, 9), (10,), (10, 10, 8)]
+    checkGame(player, game)
+    rolls = [pins for frame in game for pins in frame]
+    sheet = ScoreSheet()
+
+    def sheetGame():
+        sheet.reset()
+        sheet.addRolls(rolls)
+
+    print "Scoring (%d games checked)" % len(games)
+    print "  frames with a score after the game: calculate() %d, sheet %d of %d" % (shown_before, shown_now, len(games) * 10)
+    print "  string + calculate(): %8.4f ms/frame" % timeCall(lambda: (player.score(player.getGameString()), player.calculate()), 2000)
+    print "  sheet:                %8.4f ms/ball" % (timeCall(sheetGame, 2000) / len(rolls))
+
+'''
+The ball and turn progression Player.addShot used to work out from the frames
+on every ball, plus the no-tap rule ScoreReady applied to first balls. Kept to
+check the progression tables against.
+
+Returns (pins counted, frame complete, turn over, game over, next ball is a
+first ball, current frame, frames completed this turn) after the ball.
+'''
+def legacyShot(frames, current_frame, frames_completed, is_first_ball, frames_per_turn, no_tap, pinCount):
+    if is_first_ball and pinCount >= no_tap:
+        pinCount = 10
+    f = frames[current_frame]
+    if (current_frame == 9):
+        if f.shots[0] == -1:
+            f.shots[0] = pinCount
+        elif f.shots[1] == -1:
+            if pinCount == 10 and f.shots[0] != 10:
+                pinCount = 10 - f.shots[0]
+            f.shots[1] = pinCount
+        elif f.shots[2] == -1:
+            if pinCount == 10 and f.shots[1] != 10 and f.shots[0] + f.shots[1] != 10 and f.shots[0] != 0:
+                pinCount = 10 - f.shots[1]
+            f.shots[2] = pinCount
+    else:
+        if (f.shots[0] != -1 and f.shots[0] != 10 and pinCount == 10):
+            pinCount = 10 - f.shots[0]
+            f.shots[1] = pinCount
+        elif (f.shots[0] == -1):
+            f.shots[0] = pinCount
+        elif (f.shots[1] == -1):
+            f.shots[1] = pinCount
+
+    complete = f.hasBowled()
+    turn_over = False
+    game_over = False
+    if complete:
+        is_first_ball = True
+        frames_completed += 1
+        if (frames_completed == frames_per_turn or current_frame == 9):
+            turn_over = True
+            frames_completed = 0
+        game_over = current_frame == 9
+    elif current_frame == 9 and f.shots[0] == 10 and f.shots[1] == -1:
+        is_first_ball = True
+    elif current_frame == 9 and f.shots[0] == 10 and f.shots[1] == 10 and f.shots[2] == -1:
+        is_first_ball = True
+    elif current_frame == 9 and f.shots[0] + f.shots[1] == 10 and f.shots[2] == -1:
+        is_first_ball = True
+    else:
+        is_first_ball = False
+
+    if (current_frame < 9 and complete):
+        current_frame += 1
+    return pinCount, complete, turn_over, game_over, is_first_ball, current_frame, frames_completed
+
+def benchProgression():
+    # Random legal balls (and 10 for "the rest") through the old cascade and the tables
+    balls = 0
+    for game in range(20000):
+        frames_per_turn = random.choice((1, 2, 3))
+        no_tap = random.choice((10, 9, 8, 7))
+        machine = getProgression(frames_per_turn, no_tap)
+        game_rolls = GameRolls()
+        frames = [Frame(i + 1, game_rolls) for i in range(10)]
+        current_frame, frames_completed, is_first_ball = 0, 0, True
+        state = progression.START
+        standing = 10
+        while not progression.isFinished(state):
+            pins = random.choice((random.randint(0, standing), 10))
+            expected = legacyShot(frames, current_frame, frames_completed, is_first_ball, frames_per_turn, no_tap, pins)
+            state, counted, slot, events = machine.step(state, pins)
+            actual = (counted, events & progression.EVENT_FRAME_COMPLETE != 0, events & progression.EVENT_TURN_OVER != 0,
+                      events & progression.EVENT_GAME_OVER != 0, events & progression.EVENT_NEW_RACK != 0,
+                      machine.frame[state], progression.stateTurn(state))
+            if actual != expected:
+                print "MISMATCH after %s (frames per turn %d, no-tap %d): tables %s, addShot %s" % (str(list(game_rolls.rolls)),
+                    frames_per_turn, no_tap, str(actual), str(expected))
+                return
+            current_frame, frames_completed, is_first_ball = expected[5], expected[6], expected[4]
+            standing = 10 if is_first_ball else standing - counted
+            balls += 1
+        if progression.replay(game_rolls.rolls) != progression.makeState(progression.FINISHED, 0):
+            print "MISMATCH: replaying %s doesn't finish the game" % str(list(game_rolls.rolls))
+            return
+
+    # Fuzz at full speed: random pin counts, a new game whenever one finishes
+    machine = getProgression(1)
+    inputs = [random.randint(0, 10) for i in range(200000)]
+
+    def fuzz():
+        next_state = machine.next_state
+        state = progression.START
+        finished = progression.FINISHED
+        for pins in inputs:
+            state = next_state[state * progression.PIN_INPUTS + pins]
+            if state == finished:
+                state = progression.START
+
+    print "Progression (%d balls checked against the addShot cascade)" % balls
+    print "  tables built: %8.3f ms" % timeCall(lambda: progression.Progression(3, 9), 20)
+    print "  fuzz:         %8.2f M balls/s" % (len(inputs) / timeCall(fuzz, 5) / 1000.0)
+
+'''
+A random legal game as GameRolls, stopped after the given number of balls.
+'''
+def randomGame(balls=21):
+    machine = getProgression(1)
+    game = GameRolls()
+    state = progression.START
+    standing = 10
+    for ball in range(balls):
+        if progression.isFinished(state):
+            break
+        if machine.new_rack[state]:
+            standing = 10
+        state, counted, slot, events = machine.step(state, random.randint(0, standing))
+        game.rolls[slot] = counted
+        standing -= counted
+    return game
+
+def benchBatchScoring():
+    games = [randomGame(random.choice((21, random.randint(0, 20)))) for i in range(20000)]
+    rolls = numpy.array([list(game.rolls) for game in games], dtype=numpy.int8)
+
+    # The batch has to match the per game score sheet exactly, finished or not
+    cumulative, final, totals = scoreGames(rolls)
+    sheet = ScoreSheet()
+    for i in range(len(games)):
+        sheet.reset()
+        sheet.addFrames([Frame(number, games[i]) for number in range(1, 11)])
+        if sheet.cumulative != list(cumulative[i]) or sheet.final != list(final[i]) or sheet.total != totals[i]:
+            print "MISMATCH in %s: batch %s %s %d, sheet %s %s %d" % (str(list(games[i].rolls)), str(list(cumulative[i])), str(list(final[i])),
+                totals[i], str(sheet.cumulative), str(sheet.final), sheet.total)
+            return
+
+    pygame.font.init()
+    player = Player("bench", 0, SinglePlayerGame(), False)
+    finished_index = [i for i in range(len(games)) if progression.isFinished(progression.replay(games[i].rolls))][:2000]
+    finished = [games[i] for i in finished_index]
+    for i in finished_index:
+        player.game = games[i]
+        player.makeFrames()
+        if player.score(player.getGameString()) != totals[i]:
+            print "MISMATCH in %s: batch %d, string scoring %d" % (str(list(games[i].rolls)), totals[i], player.score(player.getGameString()))
+            return
+
+    def perGameString():
+        for game in finished:
+            player.game = game
+            player.makeFrames()
+            player.score(player.getGameString())
+
+    def perGameSheet():
+        for game in finished:
+            sheet.reset()
+            sheet.addFrames([Frame(number, game) for number in range(1, 11)])
+
+    batch = rolls[finished_index]
+    print "Batch scoring (%d games checked, timed on %d finished games)" % (len(games), len(finished))
+    print "  string per game: %10.0f games/s" % (len(finished) / (timeCall(perGameString, 3) / 1000.0))
+    print "  sheet per game:  %10.0f games/s" % (len(finished) / (timeCall(perGameSheet, 3) / 1000.0))
+    print "  numpy batch:     %10.0f games/s" % (len(finished) / (timeCall(lambda: scoreGames(batch), 50) / 1000.0))
+    print "  numpy batch:     %10.0f games/s (%d games)" % (len(games) / (timeCall(lambda: scoreGames(rolls), 10) / 1000.0), len(games))
+
+BENCHMARKS = [
+    ("pincount", benchPinCount),
+    ("vote", benchVote),
+    ("roi", benchRoi),
+    ("source", benchSource),
+    ("autocal", benchAutoCalibrate),
+    ("reference", benchReference),
+    ("luma", benchLuma),
+    ("pinstats", benchPinStats),
+    ("burst", benchBurst),
+    ("lanes", benchLanes),
+    ("blob", benchBlob),
+    ("scoring", benchScoring),
+    ("progression", benchProgression),
+    ("batch", benchBatchScoring),
+]
+
+if __name__ == '__main__':
+    random.seed(0)
+    selected = sys.argv[1:]
+    for name, bench in BENCHMARKS:
+        if len(selected) == 0 or name in selected:
+            bench()
+            print
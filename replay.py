@@ -0,0 +1,217 @@
+'''
+Replays a recording made with [Recording] enabled back through the pin
+counter, using the calibration and detection settings in config.cfg, and
+reports every ball where the result differs from what was recorded or from
+a later manual score correction.
+
+With --thresholds the per pin thresholds are relearned from the recordings
+instead (labelled by the score corrections, and where they are clear by the
+readings of balls that weren't corrected; see trainingLabels) and written to
+config.cfg as min_points_to_trigger_1 .. min_points_to_trigger_10.
+
+Run from the OpenScore directory so config.cfg is picked up:
+
+    python replay.py recordings/20121006-193000.osr
+    python replay.py --thresholds recordings/*.osr
+'''
+
+import sys, time, math
+import numpy
+import pygame
+from scorer.log import *
+from scorer.config import Config
+from scorer.bowlingscorer import BowlingScorer, PinCounter
+from scorer.recording import Recording
+from scorer.pinstats import PinStatistics
+from scorer.pinmask import FULL_RACK, maskFromStates, statesFromMask, standingAfterCount
+
+'''
+Build a PinCounter that reads from the recording instead of the camera, with
+playback stepped ball by ball by the caller.
+'''
+def createPinCounter(path):
+    scorer = BowlingScorer()
+    scorer.config = Config()
+    scorer.config.load()
+    scorer.config.setvalue("Camera", "source", "replay")
+    scorer.config.setvalue("Camera", "source_path", path)
+    scorer.config.setvalue("Recording", "enabled", "False")
+    scorer.config.setvalue("AutoScore", "enabled", "False")
+
+    pin_counter = PinCounter(pygame.Surface((800, 600), 0, 32))
+    # A paused replay looks like a stalled camera; don't let it be reopened
+    pin_counter.supervisor.stop()
+    # Replayed balls shouldn't end up in the lane's own statistics
+    pin_counter.pin_stats = None
+    pin_counter.camera.loop = False
+    pin_counter.camera.realtime = False
+    pin_counter.camera.play(0, 0)
+    pin_counter.camera.waitUntilPaused()
+    return pin_counter
+
+'''
+Work out the pin count each ball should have been given: the count the
+scorer read, unless the frame/shot it was scored to was corrected afterwards.
+Corrections are resolved like the correction screen does: X is 10, / is
+whatever the ball before it in the frame left, - is 0.
+Returns a dict of ball number to (pin_count, corrected).
+'''
+def expectedCounts(recording):
+    corrections = {}
+    for c in recording.getEvents("correction"):
+        corrections[(c["player"], c["frame"], c["shot"])] = c["value"]
+
+    scored = {}
+    for s in recording.getEvents("scored"):
+        scored[s["ball"]] = (s["player"], s["frame"], s["shot"])
+
+    expected = {}
+    shots = {}
+    for ball in recording.getEvents("ball"):
+        count = ball["pin_count"]
+        corrected = False
+        position = scored.get(ball["ball"])
+        value = corrections.get(position)
+        if value != None and value.isdigit():
+            count = int(value)
+            corrected = True
+        elif value in ("x", "X"):
+            count = 10
+            corrected = True
+        elif value == "/" and position[2] > 0:
+            # A spare is whatever the ball before it in the frame left
+            previous = shots.get((position[0], position[1], position[2] - 1))
+            if previous != None:
+                count = 10 - previous
+                corrected = True
+        elif value == "-":
+            count = 0
+            corrected = True
+        if position != None:
+            shots[position] = count
+        expected[ball["ball"]] = (count, corrected)
+    return expected
+
+'''
+What a replayed ball can teach the per pin thresholds, as (standing, known)
+for PinStatistics.add, or None if nothing.
+
+A corrected ball is labelled by its corrected count, when that alone settles
+which pins fell (see standingAfterCount). Otherwise the recorded pin states
+were decided by thresholds like the ones being learned, so only the pins the
+replay read the same way, well clear of their thresholds, are used.
+
+previous - Mask standing before the ball, None if not known
+standing - Pin states the replay read
+'''
+def trainingLabels(ball, count, corrected, previous, standing, pin_counter):
+    if corrected:
+        if previous == None:
+            return None
+        after = standingAfterCount(previous, count)
+        if after == None:
+            return None
+        return statesFromMask(after), None
+
+    if pin_counter.pin_confidence is None:
+        return None
+    recorded = numpy.asarray(ball["standing"], dtype=bool)
+    known = (recorded == numpy.asarray(standing, dtype=bool)) & \
+            (numpy.abs(pin_counter.pin_confidence) >= pin_counter.confidence_margin)
+    return recorded, known
+
+'''
+Replay every ball of a recording. With stats given, the hit ratios of every
+ball are added to it, labelled as trainingLabels decides.
+
+Returns (number of balls that differ, region area of every pin).
+'''
+def replay(path, stats=None):
+    recording = Recording(path)
+    balls = recording.getEvents("ball")
+    expected = expectedCounts(recording)
+    print "%s: %d frames, %d balls, %d corrections" % (path, recording.frame_count, len(balls), len(recording.getEvents("correction")))
+
+    pin_counter = createPinCounter(path)
+    mismatches = 0
+    elapsed = 0.0
+    leave = FULL_RACK
+    try:
+        for ball in balls:
+            count, corrected = expected[ball["ball"]]
+            previous = leave
+            if ball["first_ball"]:
+                previous = FULL_RACK
+                # The leave the next ball is thrown at
+                if corrected:
+                    leave = standingAfterCount(FULL_RACK, count)
+                else:
+                    leave = maskFromStates(ball["standing"])
+
+            pin_counter.use_blacklight = ball["blacklight"]
+            pin_counter.camera.play(ball["frame"], ball["frames"])
+            if not pin_counter.camera.waitUntilPaused():
+                print "Ball %d: replay stalled" % ball["ball"]
+                mismatches += 1
+                continue
+
+            start = time.time()
+            pin_count = pin_counter.getPinCount(not ball["first_ball"])
+            elapsed += time.time() - start
+            standing = statesFromMask(pin_counter.pin_mask)
+
+            if stats != None and pin_counter.last_hits is not None:
+                labels = trainingLabels(ball, count, corrected, previous, standing, pin_counter)
+                if labels != None:
+                    ratios = numpy.asarray(pin_counter.last_hits, dtype=numpy.float64).mean(axis=0) / pin_counter.calibration.areas
+                    stats.add(ratios, labels[0], labels[1])
+
+            if pin_count != count or (not corrected and standing != ball["standing"]):
+                mismatches += 1
+                print "Ball %d: read %d %s, recorded %d %s%s" % (ball["ball"], pin_count, str([int(p) for p in standing]),
+                                                                ball["pin_count"], str([int(p) for p in ball["standing"]]),
+                                                                " (corrected to %d)" % count if corrected else "")
+    finally:
+        pin_counter.cleanup()
+
+    print "%d of %d balls differ" % (mismatches, len(balls))
+    if len(balls) > 0 and elapsed > 0:
+        print "%.3f ms/ball, %.0f balls/s" % (elapsed * 1000.0 / len(balls), len(balls) / elapsed)
+    return mismatches, pin_counter.calibration.areas
+
+'''
+Relearn the per pin thresholds from the given recordings and save them.
+'''
+def learnThresholds(paths):
+    stats = PinStatistics()
+    for path in paths:
+        mismatches, areas = replay(path, stats)
+
+    config = Config()
+    config.load()
+    min_samples = int(config.getvalue_default("Calibration", "adaptive_min_samples", 20))
+    ratios = stats.thresholds(min_samples)
+    standing_count, down_count = stats.counts()
+
+    print "Pin  standing  down  threshold"
+    for i in range(len(ratios)):
+        if numpy.isnan(ratios[i]):
+            print "%3d  %8d  %4d  (not enough readings)" % (i + 1, standing_count[i], down_count[i])
+            continue
+        hits = max(1, int(math.ceil(ratios[i] * areas[i])))
+        config.setvalue("Calibration", "min_points_to_trigger_" + str(i + 1), hits)
+        print "%3d  %8d  %4d  %4d pixels (%.0f%%)" % (i + 1, standing_count[i], down_count[i], hits, ratios[i] * 100)
+    config.save()
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if len(args) == 0 or args == ["--thresholds"]:
+        print "Usage: python replay.py [--thresholds] <recording.osr> [...]"
+        sys.exit(2)
+    if args[0] == "--thresholds":
+        learnThresholds(args[1:])
+        sys.exit(0)
+    failed = 0
+    for path in args:
+        failed += replay(path)[0]
+    sys.exit(1 if failed > 0 else 0)
@@ -0,0 +1,146 @@
+'''
+Automatic calibration from a full rack.
+
+With all ten pins standing, the thresholded deck snapshot shows ten bright
+blobs. Labeling the connected components, keeping the ten biggest and sorting
+them into the rows of the triangle gives the ten calibration points without
+anyone clicking on the screen.
+
+The labeling works on whole arrays: every pixel starts with its own label and
+repeatedly takes the smallest label among its neighbours (plus a
+pointer-jumping step so long blobs converge in a few passes instead of one
+pass per pixel), so it is quick enough to run before every game.
+'''
+
+import numpy
+
+# Rows of the rack from the back of the deck (smallest y) to the head pin
+RACK_ROWS = ((7, 8, 9, 10), (4, 5, 6), (2, 3), (1,))
+
+'''
+Label the 4-connected components of a boolean (x, y) mask.
+
+Returns (labels, count): labels is an int array the shape of mask with 0 for
+background and 1..count for the components.
+'''
+def labelComponents(mask):
+    mask = numpy.asarray(mask, dtype=bool)
+    if not mask.any():
+        return numpy.zeros(mask.shape, dtype=numpy.intp), 0
+
+    # Each set pixel starts out as its own label (flat index + 1); background is
+    # a label bigger than any real one so it never wins a minimum
+    background = mask.size + 1
+    labels = numpy.where(mask, numpy.arange(1, mask.size + 1).reshape(mask.shape), background)
+    padded = numpy.empty((mask.shape[0] + 2, mask.shape[1] + 2), dtype=labels.dtype)
+
+    while True:
+        padded.fill(background)
+        padded[1:-1, 1:-1] = labels
+        neighbours = numpy.minimum(numpy.minimum(padded[:-2, 1:-1], padded[2:, 1:-1]),
+                                   numpy.minimum(padded[1:-1, :-2], padded[1:-1, 2:]))
+        updated = numpy.where(mask, numpy.minimum(labels, neighbours), background)
+
+        # Pointer jumping: follow each label to the label its own pixel has
+        flat = updated.ravel()
+        pointed = numpy.where(flat < background, flat, 1)
+        jumped = numpy.where(flat < background, flat[pointed - 1], background)
+        updated = numpy.minimum(flat, jumped).reshape(mask.shape)
+
+        if numpy.array_equal(updated, labels):
+            break
+        labels = updated
+
+    # Renumber the surviving labels 1..count
+    unique, inverse = numpy.unique(labels.ravel(), return_inverse=True)
+    count = len(unique) - 1
+    return numpy.where(mask, inverse.reshape(mask.shape) + 1, 0), count
+
+'''
+Measure the connected components of a boolean (x, y) mask.
+
+min_area - Components with fewer pixels than this are dropped
+
+Returns a list of dicts with the area, centroid (x, y) and bounding box
+(x0, y0, x1, y1, x1/y1 exclusive) of each component, biggest first.
+'''
+def findBlobs(mask, min_area=1):
+    labels, count = labelComponents(mask)
+    if count == 0:
+        return []
+
+    xs, ys = numpy.nonzero(labels)
+    ids = labels[xs, ys]
+    areas = numpy.bincount(ids, minlength=count + 1)
+    cx = numpy.bincount(ids, weights=xs, minlength=count + 1)
+    cy = numpy.bincount(ids, weights=ys, minlength=count + 1)
+
+    x0 = numpy.full(count + 1, mask.shape[0], dtype=numpy.intp)
+    y0 = numpy.full(count + 1, mask.shape[1], dtype=numpy.intp)
+    x1 = numpy.zeros(count + 1, dtype=numpy.intp)
+    y1 = numpy.zeros(count + 1, dtype=numpy.intp)
+    numpy.minimum.at(x0, ids, xs)
+    numpy.minimum.at(y0, ids, ys)
+    numpy.maximum.at(x1, ids, xs + 1)
+    numpy.maximum.at(y1, ids, ys + 1)
+
+    blobs = []
+    for i in range(1, count + 1):
+        if areas[i] < min_area:
+            continue
+        blobs.append({"area": int(areas[i]),
+                      "centroid": (cx[i] / areas[i], cy[i] / areas[i]),
+                      "bounds": (int(x0[i]), int(y0[i]), int(x1[i]), int(y1[i]))})
+    blobs.sort(key=lambda b: -b["area"])
+    return blobs
+
+'''
+Put ten pin blobs in pin number order: split them into the rows of the
+triangle by y (back row first) and number each row left to right.
+'''
+def orderRack(blobs):
+    if len(blobs) != 10:
+        raise ValueError("Need 10 pins to order a rack, found %d" % len(blobs))
+
+    by_y = sorted(blobs, key=lambda b: b["centroid"][1])
+    ordered = [None] * 10
+    start = 0
+    for row in RACK_ROWS:
+        row_blobs = sorted(by_y[start:start + len(row)], key=lambda b: b["centroid"][0])
+        for pin, blob in zip(row, row_blobs):
+            ordered[pin - 1] = blob
+        start += len(row)
+    return ordered
+
+'''
+Work out calibration settings from a thresholded snapshot of a full rack.
+
+mask - Boolean (x, y) array, True where the snapshot matched the detect color
+min_area - Smallest blob that can be a pin
+
+Returns a dict with points (ten (x, y) tuples, pin 1 first), point_size,
+min_points_to_trigger and the ten blobs used. Raises ValueError if fewer than
+ten pins can be found.
+'''
+def calibrateFromMask(mask, min_area):
+    mask = numpy.asarray(mask, dtype=bool)
+    blobs = findBlobs(mask, min_area)
+    if len(blobs) < 10:
+        raise ValueError("Only found %d pins, need a full rack" % len(blobs))
+    rack = orderRack(blobs[:10])
+
+    # A square that fits inside the smallest pin, placed on each pin's centre
+    smallest = min(min(b["bounds"][2] - b["bounds"][0], b["bounds"][3] - b["bounds"][1]) for b in rack)
+    point_size = max(2, int(smallest * 0.7) - 1)
+    points = []
+    hits = []
+    for blob in rack:
+        px = int(round(blob["centroid"][0] - point_size / 2.0))
+        py = int(round(blob["centroid"][1] - point_size / 2.0))
+        points.append((px, py))
+        hits.append(int(mask[max(0, px):px + point_size + 1, max(0, py):py + point_size + 1].sum()))
+
+    # Half of what the weakest pin shows when standing
+    min_points_to_trigger = max(1, min(hits) // 2)
+    return {"points": points, "point_size": point_size,
+            "min_points_to_trigger": min_points_to_trigger, "blobs": rack}
@@ -1,17 +1,36 @@
 
-import os, sys, platform, traceback
+import os, sys, platform, traceback, math
 import pygame
 import pygame.camera
+import pygame.surfarray
 import random
 import hardware
 import pickle
 import time
+import threading
+import numpy
 from pygame.locals import *
 from screens import *
 from player import *
 from frame import *
 from config import *
 from log import *
+import detection
+import autocalibrate
+import progression
+from calibration import CompiledCalibration
+from reference import ReferenceModel, REFERENCE_FULL, REFERENCE_EMPTY, scoreSamples
+from pinstats import PinStatistics
+from pinmask import *
+from capture import CaptureWorker
+from scoreworker import ScoringWorker
+from events import *
+from motion import BallDetector
+from deckcheck import DeckValidator, DeckBlocked
+from recording import FrameRecorder
+from framesource import createFrameSource, SharedFrameWriter
+from supervisor import CameraSupervisor, CameraUnavailable
+from lanes import LaneConfig, configuredLanes, laneFileName
 from hardware import arduino
 from hardware import decklight
 
@@ -30,6 +49,8 @@ class BowlingScorer(object):
     current_ball = 0    # 0: first 1: second 2: third (tenth frame only)
     instance = None
     debug = False
+    pinCounter = None
+    lane = None
     
     def __init__(self):
         logger.info("Created BowlingScorer object")
@@ -42,7 +63,9 @@ class BowlingScorer(object):
     def cleanup(self):
         logger.info("BowlingScorer.cleanup()")
         self.screenManager.Cleanup()
+        self.scoringWorker.stop()
         self.pinCounter.cleanup()
+        self.pinCounter.stopRecording()
         self.hw.Close()
         print "Cleanup finished"
         
@@ -104,6 +127,10 @@ class BowlingScorer(object):
             return
         #pygame.display.toggle_fullscreen()
         
+        # The lane this scorer shows, when one camera covers several (see lanes.py)
+        self.lane = self.config.getvalue_default("Camera", "lane", configuredLanes(self.config)[0])
+        self.lane_config = LaneConfig(self.config, self.lane)
+        
         try:
             logger.info("Creating screen manager...")
             self.screenManager = ScreenManager(self, self.screen)
@@ -117,7 +144,9 @@ class BowlingScorer(object):
         
         try:
             logger.info("Creating pinCounter...")
-            self.pinCounter = PinCounter(self.screen)
+            # Only the lane this scorer shows is scored, so it is the only one
+            # read, with that lane's calibration
+            self.pinCounter = PinCounter(self.screen, self.lane)
             self.pinCounter.getPinCount(False)
         except:
             logger.critical("Could not create pincounter")
@@ -126,6 +155,10 @@ class BowlingScorer(object):
             self.showErrorScreen()
             return        
         
+        # Balls are scored off the main loop; results come back as SCORE_READY events
+        self.scoringWorker = ScoringWorker(self.pinCounter)
+        self.scoringWorker.start()
+        
         # Main game loop
         while not self.doExit:
             self.clock.tick(40)
@@ -140,6 +173,14 @@ class BowlingScorer(object):
             for e in pygame.event.get():
                 if (e.type == QUIT):
                     self.doExit = True
+                elif (e.type == SCORE_READY):
+                    # Delivered here rather than through the screen stack so the result
+                    # isn't lost while the score screen is hidden behind a menu
+                    self.screenManager.score.ScoreReady(e)
+                    continue
+                elif (e.type == BALL_DETECTED):
+                    self.screenManager.score.BallDetected(e)
+                    continue
                 self.screenManager.HandleEvent(e)
     
             # Update screen
@@ -174,14 +215,26 @@ class BowlingScorer(object):
             self.decklight.Whitelight()
             self.pinCounter.use_blacklight = False
             
+    '''
+    Move the game along after a ball was added to the current player (events
+    are the progression.EVENT_* flags Player.addShot returned).
+    '''
+    def ball_scored(self, events):
+        self.is_first_ball = (events & progression.EVENT_NEW_RACK) != 0
+        if events & progression.EVENT_TURN_OVER:
+            self.next_player()
+        if events & progression.EVENT_GAME_OVER:
+            self.end_game_if_over()
+        
+        if self.current_player != -1:
+            self.dump_current_state()
+            
     def end_game_if_over(self):
         is_game_over = True
         for p in self.players:
-            if (p.current_frame < 9):
+            if not p.isFinished():
                 is_game_over = False
                 break
-            if (p.current_frame == 9 and not p.frames[p.current_frame].hasBowled()):
-                is_game_over = False
         
         if (is_game_over):
             self.current_player = -1
@@ -205,6 +258,19 @@ class BowlingScorer(object):
         self.screenManager.score.show_help_text = True
         
         self.pinCounter.use_blacklight = self.players[self.current_player].blacklight
+        if self.pinCounter.ball_detector != None:
+            self.pinCounter.ball_detector.reset()
+        if self.pinCounter.deck_validator != None:
+            self.pinCounter.deck_validator.clearRack()
+        self.pinCounter.clearReadings()
+        
+        # The rack is full before the first ball, so the points can be found again
+        if (self.config.getboolean("Calibration", "auto_each_game")):
+            try:
+                self.pinCounter.autoCalibrate(False)
+            except Exception:
+                logger.warning("Automatic calibration failed, keeping the current points")
+                logger.exception('')
         
     def dump_current_state(self):
         try:
@@ -236,160 +302,1053 @@ class BowlingScorer(object):
             self.remove_state()
 
 class PinCounter:
+    DECK_SIZE = (320, 240) # Size of the snapshot the calibration points are placed on
+    FIRST_FRAME_TIMEOUT = 2.0 # Seconds to wait for the capture worker's first frame
+    STALE_FRAME_AGE = 2.0 # A newest frame older than this (in seconds) means the camera stalled
+    READ_TIMEOUT = 0.5 # Seconds a read waits for a fresh frame before giving up
+    REFERENCE_FRAMES = 3 # Frames averaged into a captured reference
+    
     camera = None
+    capture = None
+    frame_buffer = None
+    supervisor = None
+    references = None
+    pin_stats = None
+    lock = None
+    recorder = None
+    last_recorded_ball = None
+    pin_mask = 0
+    leave_mask = None
+    deck_validator = None
+    burst_samples = None
+    lane = None
+    frame_writer = None
     snapshot = None
     thresholded = None
+    deck_snapshot = None
+    read_state = None
     isStreaming = False
     screen = None
-    def __init__(self, screen):
+    '''
+    screen - Display surface the snapshots are made compatible with
+    lane - Name of the lane to score when one camera covers several (see
+           lanes.py); its calibration comes from [Calibration.<lane>]
+    '''
+    def __init__(self, screen, lane = None):
         self.screen = screen
+        self.lane = lane
+        self.lane_config = LaneConfig(BowlingScorer.instance.config, lane)
+        
+        # Scoring runs on the ScoringWorker while the screens may grab snapshots
+        # and the supervisor may reopen the camera, so the camera, capture and
+        # snapshot surfaces are only touched while holding this lock
+        self.lock = threading.RLock()
+        # Last deck snapshot made, shown while scoring holds the lock
+        self.deck_snapshot = pygame.Surface(self.DECK_SIZE, 0, screen)
         
         try:
             logger.info("Initializing camera...")
-            pygame.camera.init()
             
             self.last_ball_score = 0
+            self.leave_mask = FULL_RACK
             
-            cam_size = BowlingScorer.instance.config.gettuple("Camera", "size")
-            self.detect_color = BowlingScorer.instance.config.gettuple("Camera", "detect_color")
-            self.other_colors_nondetect = BowlingScorer.instance.config.gettuple("Camera", "other_colors_nondetect")
-            self.threshold_detect = BowlingScorer.instance.config.gettuple("Camera", "threshold_detect")
+            # How many more reads a second ball gets when pins seem to stand up again
+            self.recapture_attempts = int(self.lane_config.getvalue_default("Camera", "recapture_attempts", 2))
             
-            self.bl_detect_color = BowlingScorer.instance.config.gettuple("Camera", "bl_detect_color")
-            self.bl_other_colors_nondetect = BowlingScorer.instance.config.gettuple("Camera", "bl_other_colors_nondetect")
-            self.bl_threshold_detect = BowlingScorer.instance.config.gettuple("Camera", "bl_threshold_detect")
-            self.camera_idx = int(BowlingScorer.instance.config.getvalue_default("Camera", "camera_number", 0))
+            # Pins read closer than confidence_margin to their threshold get up to confidence_frames more frames
+            self.confidence_margin = float(self.lane_config.getvalue_default("Camera", "confidence_margin", 0.05))
+            self.confidence_frames = int(self.lane_config.getvalue_default("Camera", "confidence_frames", 2))
             
-            # Initialize the camera, using the 0 (first) device
-            # Also specify the size as 320x240
-            # On linux, instead of '0' we should use /dev/video0
+            self.detect_color = self.lane_config.gettuple("Camera", "detect_color")
+            self.other_colors_nondetect = self.lane_config.gettuple("Camera", "other_colors_nondetect")
+            self.threshold_detect = self.lane_config.gettuple("Camera", "threshold_detect")
             
-            self.camera_list = pygame.camera.list_cameras()
+            self.bl_detect_color = self.lane_config.gettuple("Camera", "bl_detect_color")
+            self.bl_other_colors_nondetect = self.lane_config.gettuple("Camera", "bl_other_colors_nondetect")
+            self.bl_threshold_detect = self.lane_config.gettuple("Camera", "bl_threshold_detect")
             
-            logging.info("Creating camera at size %s" % str(cam_size))
-            if (platform.system() == "Windows"):
-                self.camera = pygame.camera.Camera(device=self.camera_list[self.camera_idx], size=cam_size, mode = "YUV")
-            else:
-                self.camera = pygame.camera.Camera(self.camera_list[self.camera_idx], cam_size, "YUV")
-            self.camera.start()
-                
-            self.snapshot = pygame.Surface(cam_size, 0, screen)
-            self.thresholded = pygame.Surface(cam_size, 0, screen)
+            # Frames are pulled continuously in the background, scoring just takes the newest one
+            self.capture_fps = int(self.lane_config.getvalue_default("Camera", "fps", 30))
+            
+            # Multi-frame voting: how many frames, gathered within how many seconds
+            self.vote_frames = int(self.lane_config.getvalue_default("Camera", "vote_frames", 1))
+            self.vote_budget = float(self.lane_config.getvalue_default("Camera", "vote_budget", 0.1))
+            self.vote_mode = self.lane_config.getvalue_default("Camera", "vote_mode", "majority")
+            self.vote_low = float(self.lane_config.getvalue_default("Camera", "vote_low", 0.3))
+            self.vote_high = float(self.lane_config.getvalue_default("Camera", "vote_high", 0.7))
+            
+            # Burst mode: follow the deck frame by frame and score once burst_stable frames agree
+            self.burst_mode = self.lane_config.getboolean("Camera", "burst_mode")
+            self.burst_stable = max(1, int(self.lane_config.getvalue_default("Camera", "burst_stable", 3)))
+            self.burst_timeout = float(self.lane_config.getvalue_default("Camera", "burst_timeout", 2.0))
+            
+            self.latest_frame = None
+            self.latest_frame_time = 0
+            self.read_frames = None
+            self.calibration = None
+            self.ball_detector = None
+            self.deck_validator = None
+            self.openCamera()
+            
+            if (self.lane_config.getboolean("Recording", "enabled")):
+                self.startRecording()
             
             self.use_blacklight = False
             
             self.points = []
             self.point_size = 0
             self.min_points_to_trigger = 0
+            self.last_hits = None
+            self.last_confidence = None
+            self.pin_confidence = None
             self.reloadCalibration()
             
+            # Per pin hit ratio histograms, used to learn a threshold for each pin
+            self.pin_stats_file = self.lane_config.getfilename("Calibration", "pin_stats_file", "pinstats.npz")
+            self.pin_stats = PinStatistics(len(self.points))
+            self.pin_stats.load(self.pin_stats_file)
+            self.balls_since_learning = 0
+            self.last_reading = None
+            self.scored_readings = {}       # (player, frame, shot) to the last_reading scored there
+            self.corrected_readings = []    # (ratios, standing) labelled by score corrections, not added yet
+            
+            # Optionally watch the deck for balls so nobody has to press 'S'
+            if (self.lane_config.getboolean("AutoScore", "enabled")):
+                config = self.lane_config
+                self.ball_detector = BallDetector(self.getCameraRegion(), self.onBallDetected,
+                                                  int(config.getvalue_default("AutoScore", "sample_step", 4)),
+                                                  float(config.getvalue_default("AutoScore", "impact_level", 12)),
+                                                  float(config.getvalue_default("AutoScore", "still_level", 3)),
+                                                  float(config.getvalue_default("AutoScore", "settle_time", 0.5)),
+                                                  float(config.getvalue_default("AutoScore", "cooldown", 8)),
+                                                  self.burst_mode)
+                self.capture.addFrameListener(self.ball_detector.processFrame)
+            
+            # Optionally check the rack is full (and nothing covers the deck) before first balls
+            if (self.lane_config.getboolean("DeckCheck", "enabled")):
+                config = self.lane_config
+                self.deck_validator = DeckValidator(self.readFramePins, self.getCameraRegion(),
+                                                    int(config.getvalue_default("DeckCheck", "sample_step", 4)),
+                                                    float(config.getvalue_default("DeckCheck", "change_level", 40)),
+                                                    float(config.getvalue_default("DeckCheck", "occluded_fraction", 0.3)),
+                                                    int(config.getvalue_default("DeckCheck", "full_frames", 3)))
+                self.occlusion_wait = float(config.getvalue_default("DeckCheck", "occlusion_wait", 3))
+                self.capture.addFrameListener(self.deck_validator.processFrame)
+            
             
         except:
             logging.critical("Camera initialization failed. Make sure the scoring camera is plugged in.")
             logging.exception('')
             raise Exception("Camera init failed")
     
-        self.pin_display = []
         self.resetPinDisplay()
+        
+        # From here on a failing camera is reopened in the background
+        self.supervisor = CameraSupervisor(self, 0.5,
+                                           float(self.lane_config.getvalue_default("Camera", "reconnect_min", 1)),
+                                           float(self.lane_config.getvalue_default("Camera", "reconnect_max", 30)))
+        self.supervisor.start()
+    
+    '''
+    Opens the frame source selected in config.cfg and starts a capture worker
+    on it. The frame buffer (and with it the last good frames) is kept from one
+    open to the next as long as the frame size doesn't change.
+    
+    With [Camera] share_path set every captured frame is also published there
+    (see SharedFrameWriter), so the scorer of the other lane under this camera
+    can read it with source = shm instead of opening a camera of its own.
+    '''
+    def openCamera(self):
+        config = self.lane_config
+        logging.info("Creating %s frame source at size %s" % (config.getvalue_default("Camera", "source", "camera"), str(config.gettuple("Camera", "size"))))
+        camera = createFrameSource(config, self.DECK_SIZE)
+        camera.start()
+        share_path = config.getvalue_default("Camera", "share_path", "")
+        
+        with self.lock:
+            self.camera = camera
+            self.capture = CaptureWorker(camera, self.capture_fps, max(4, self.vote_frames + 1), self.frame_buffer)
+            self.frame_buffer = self.capture.buffer
+            self.open_sequence = self.frame_buffer.frames_captured
+            
+            if share_path != "":
+                if self.frame_writer == None or self.frame_writer.size != self.frame_buffer.size:
+                    logger.info("Sharing frames in %s" % share_path)
+                    self.frame_writer = SharedFrameWriter(share_path, self.frame_buffer.size)
+                self.capture.addFrameListener(self.shareFrame)
+            
+            if self.snapshot == None or self.snapshot.get_size() != self.frame_buffer.size:
+                self.snapshot = pygame.Surface(self.frame_buffer.size, 0, self.screen)
+                self.thresholded = pygame.Surface(self.frame_buffer.size, 0, self.screen)
+                self.vote_buffer = numpy.empty((self.vote_frames,) + self.frame_buffer.frames.shape[1:], dtype=numpy.uint8)
+                self.latest_frame = None
+                if self.ball_detector != None:
+                    self.ball_detector.setRegion(self.getCameraRegion())
+                if self.deck_validator != None:
+                    self.deck_validator.setRegion(self.getCameraRegion())
+                if self.references != None:
+                    self.references.setCalibration(self.calibration, self.frame_buffer.size)
+                    self.read_state = self.makeReadState()
+            
+            if self.ball_detector != None:
+                self.ball_detector.reset()
+                self.capture.addFrameListener(self.ball_detector.processFrame)
+            if self.deck_validator != None:
+                self.capture.addFrameListener(self.deck_validator.processFrame)
+            self.capture.start()
+    
+    '''
+    Capture listener publishing each frame for the other lane's scorer.
+    '''
+    def shareFrame(self, pixels, timestamp):
+        self.frame_writer.write(pixels)
+    
+    '''
+    Stops the capture worker and the frame source. The frame buffer and the
+    snapshot surfaces are left alone, so the last good frame can still be shown.
+    '''
+    def closeCamera(self):
+        with self.lock:
+            capture = self.capture
+            camera = self.camera
+            self.capture = None
+        
+        if capture != None:
+            logger.info("Capture stats: %s" % str(capture.buffer.stats()))
+            capture.stop()
+        if camera != None:
+            try:
+                camera.stop()
+            except Exception:
+                logger.exception('')
+    
+    '''
+    Waits for the first frame captured since the camera was last opened.
+    Returns False if none arrived within FIRST_FRAME_TIMEOUT.
+    '''
+    def waitForFirstFrame(self):
+        return self.frame_buffer.waitForFrame(self.open_sequence, self.FIRST_FRAME_TIMEOUT)
+    
+    '''
+    True while the capture worker is running and delivering fresh frames.
+    '''
+    def captureHealthy(self):
+        capture = self.capture
+        if capture == None or not capture.is_alive():
+            return False
+        if self.frame_buffer.frames_captured <= self.open_sequence:
+            return time.time() - capture.started_at <= self.FIRST_FRAME_TIMEOUT
+        return self.frame_buffer.age() <= self.STALE_FRAME_AGE
+    
+    '''
+    Returns a message describing a camera problem for the status banner, or
+    None while the camera is working.
+    '''
+    def getCameraStatus(self):
+        if self.supervisor == None:
+            return None
+        return self.supervisor.status
             
     def resetPinDisplay(self):
-        del self.pin_display[:]
-        for i in range(10):
-            self.pin_display.append(False)
+        self.pin_mask = 0
+    
+    '''
+    Sets the first ball count by hand (a score correction). The leave the
+    camera saw no longer matches it, so the next second ball is scored by
+    count alone.
+    '''
+    def setLastBallScore(self, score):
+        self.last_ball_score = score
+        self.leave_mask = None
+    
+    '''
+    Reads which pins are standing, as a mask (see pinmask). Pins read too
+    close to their threshold get a second look (see confirmPinStates), and
+    the confidence of every pin is left in pin_confidence.
+    '''
+    def readPinMask(self, use_last_ball_score):
+        previous = self.previousPinStates(use_last_ball_score)
+        if (self.burst_mode):
+            standing = self.getBurstPinStates()
+        elif (self.vote_frames > 1):
+            standing = self.getVotedPinStates(previous)
+        else:
+            standing = self.getSnapshotPinStates()
+        
+        # Extra frames are read the way the first read was: the surface engine
+        # again, or the regions of a frame kept for the recording
+        if (not self.burst_mode and self.vote_frames <= 1 and self.readsSurface()):
+            reread = self.getSnapshotPinStates
+        else:
+            reread = self.getFramePinStates
+        standing = self.confirmPinStates(standing, reread, previous)
+        return maskFromStates(standing)
+    
+    '''
+    The pins standing before this ball, as an array of 10 booleans: the whole
+    rack before the first ball, the first ball's leave before the second.
+    '''
+    def previousPinStates(self, use_last_ball_score):
+        if use_last_ball_score:
+            return numpy.array(statesFromMask(self.pin_mask if self.leave_mask == None else self.leave_mask), dtype=bool)
+        return numpy.ones(len(self.points), dtype=bool)
+    
+    '''
+    Takes up to confidence_frames more frames when any pin's confidence (see
+    detection.pinConfidence, or the reference score's distance from its
+    level) is within confidence_margin of the threshold, and decides those
+    pins again by letting every frame read vote (vote_mode, so hysteresis
+    still favours the pins' previous states). Clear reads return straight
+    away, so most balls still only cost one frame.
+    
+    reread - Reads one more frame the same way the first read did
+    previous - Pin states before this ball (see previousPinStates)
+    
+    The extra frames are added to read_frames, so the recording holds every
+    frame the ball was decided on.
+    
+    Returns the list of 10 booleans with the doubtful pins decided again.
+    '''
+    def confirmPinStates(self, standing, reread, previous):
+        if self.last_confidence is None:
+            self.pin_confidence = None
+            return standing
+        
+        confidence = self.last_confidence.mean(axis=0)
+        doubtful = numpy.abs(confidence) < self.confidence_margin
+        recheck = doubtful.copy()
+        extra = 0
+        read_frames = None
+        while doubtful.any() and extra < self.confidence_frames:
+            logger.info("Pins %s are close to their thresholds, reading another frame" % str(list(numpy.nonzero(doubtful)[0] + 1)))
+            if read_frames == None:
+                if self.read_frames == None:
+                    # The region-only read never copies the whole frame, so take the newest one now
+                    latest = self.frame_buffer.latest()
+                    self.read_frames = (latest[0][numpy.newaxis], [latest[1]])
+                # Copied, the next read may reuse the buffers
+                read_frames = (numpy.array(self.read_frames[0]), list(self.read_frames[1]))
+            previous_hits = self.last_hits
+            previous_confidence = self.last_confidence
+            
+            self.frame_buffer.waitForFrame(self.frame_buffer.frames_captured, self.READ_TIMEOUT)
+            self.read_frames = None
+            reread()
+            if previous_hits is not None and self.last_hits is not None:
+                self.last_hits = numpy.vstack((previous_hits, self.last_hits))
+            self.last_confidence = numpy.vstack((previous_confidence, self.last_confidence))
+            if self.read_frames != None:
+                read_frames = (numpy.concatenate((read_frames[0], self.read_frames[0])), read_frames[1] + list(self.read_frames[1]))
+            
+            extra += 1
+            confidence = self.last_confidence.mean(axis=0)
+            doubtful = doubtful & (numpy.abs(confidence) < self.confidence_margin)
+        
+        self.pin_confidence = confidence
+        if extra == 0:
+            return standing
+        self.read_frames = read_frames
+        
+        # Only the pins that were in doubt are decided again
+        voted, ratios = detection.votePinStates(self.last_confidence >= 0, self.vote_mode, previous, self.vote_low, self.vote_high)
+        logger.info("Voted over %d frames, standing ratios: %s" % (len(self.last_confidence), str(ratios)))
+        return list(numpy.where(recheck, voted, standing))
     
     '''
     Gets the pin count of the current pindeck by taking a threshold image
     and counting objects. Returns 0-10 (number of pins hit)
+    
+    How sure the read was about each pin is left in pin_confidence (see
+    confirmPinStates).
+    
+    The first ball's leave is kept as a mask and the second ball is scored as
+    the pins missing from it. A second ball read showing a pin standing that
+    was down after the first ball can't be right, so the deck is read again
+    from newer frames (up to recapture_attempts times) before giving up and
+    ignoring the pins that came back.
     '''
     def getPinCount(self, use_last_ball_score = False):
-        deck_surface = self.getDeckSnapshot()
-        retry_count = 0
-        while deck_surface == None and retry_count < 3:
-            self.cleanup()
-            time.sleep(5)
-            self.__init__(self.screen)
-            deck_surface = self.getDeckSnapshot()
-            retry_count += 1
+        # Waited out before taking the lock so the screens keep their snapshots meanwhile
+        self.waitForClearDeck()
+        with self.lock:
+            self.read_frames = None
+            self.last_hits = None
+            self.last_confidence = None
+            if (self.detect_engine == "reference" and not self.usingReferences()):
+                logger.warning("No reference frames for %s lighting, using the detect colors" % self.getLightingMode())
             
-        self.resetPinDisplay()
-        # Always assume there are 0 pins standing
-        num_pins_standing = 0
+            standing_mask = self.readPinMask(use_last_ball_score)
+            
+            if use_last_ball_score and self.leave_mask != None:
+                attempts = 0
+                while standing_mask & ~self.leave_mask and attempts < self.recapture_attempts:
+                    attempts += 1
+                    logger.warning("Pins %s read standing after being knocked down, reading again" % str(pinsFromMask(standing_mask & ~self.leave_mask)))
+                    self.frame_buffer.waitForFrame(self.frame_buffer.frames_captured, self.READ_TIMEOUT)
+                    self.read_frames = None
+                    self.last_hits = None
+                    self.last_confidence = None
+                    standing_mask = self.readPinMask(use_last_ball_score)
+                if standing_mask & ~self.leave_mask:
+                    logger.warning("Pins %s still read standing, counting them as down" % str(pinsFromMask(standing_mask & ~self.leave_mask)))
+                    standing_mask &= self.leave_mask
+            
+            self.pin_mask = standing_mask
+            num_pins_standing = countPins(standing_mask)
+            previous_mask = self.leave_mask if use_last_ball_score else FULL_RACK
         
-        #self.screen.blit(self.thresholded, (0,0))
-        deck_px_array = pygame.PixelArray(deck_surface)
-        counter = 0
+            # If we're not using the last ball score, set the last ball score as the current score
+            # (This happens on first ball)
+            if not use_last_ball_score:
+                self.last_ball_score = 10 - num_pins_standing
+                self.leave_mask = standing_mask
+                logger.info("num_pins_standing: %d       last_ball_score: %d" % (num_pins_standing, self.last_ball_score))
+                pin_count = 10 - num_pins_standing
+            elif self.leave_mask != None:
+                pin_count = countPins(self.leave_mask & ~standing_mask)
+            else:
+                # The first ball was corrected by hand, all we have is its count
+                pin_count = max(0, min(10 - self.last_ball_score, (10 - num_pins_standing) - self.last_ball_score))
+            
+            standing = statesFromMask(standing_mask)
+            self.recordBall(standing, pin_count, not use_last_ball_score)
+            self.updatePinStatistics(standing, previous_mask)
+            if self.deck_validator != None:
+                self.deck_validator.clearRack()
+            return pin_count
+    
+    '''
+    Waits up to occlusion_wait seconds for whatever the deck validator sees
+    covering the deck (the sweep, a mechanic) to go away. Raises DeckBlocked
+    if it doesn't.
+    '''
+    def waitForClearDeck(self):
+        if self.deck_validator == None or not self.deck_validator.occluded():
+            return
+        logger.warning("Something is covering the deck, waiting for it to clear")
+        deadline = time.time() + self.occlusion_wait
+        while self.deck_validator.occluded():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise DeckBlocked("Something is covering the pins")
+            self.frame_buffer.waitForFrame(self.frame_buffer.frames_captured, min(remaining, self.READ_TIMEOUT))
+    
+    '''
+    True if a full rack has been seen since the last ball was read, or if
+    the rack isn't being checked. A first ball read without one would count
+    pins the pinsetter never set as knocked down.
+    '''
+    def rackReady(self):
+        return self.deck_validator == None or self.deck_validator.rackReady()
+    
+    '''
+    Which pins stand in a captured frame, for the deck validator. Called on
+    the capture thread for every frame, so it reads with one read state (see
+    makeReadState) and changes nothing: reference frames are compared but not
+    updated and the last read's hits are left alone.
+    
+    pixels - (width, height, 3) camera frame
+    '''
+    def readFramePins(self, pixels):
+        state = self.read_state
+        xs, ys = state[0].sampleCoordinates(pixels.shape[:2])
+        channel = self.getDetectChannel(state)
+        if channel != None:
+            samples = pixels[xs, ys, channel[0]]
+        else:
+            samples = pixels[xs, ys]
+        return self.detectSamples(samples[numpy.newaxis], state)[0][0]
+    
+    '''
+    Adds the hit ratios of the ball just read to the per pin statistics. The
+    pins were labelled by this read, so only those read well clear of their
+    threshold (pin_confidence at least confidence_margin away) count; a later
+    score correction can label the rest (see learnFromCorrection). The ball
+    is kept in last_reading for that, as (ratios, previous) with previous the
+    mask standing before the ball (None if not known).
+    '''
+    def updatePinStatistics(self, standing, previous):
+        self.last_reading = None
+        if self.pin_stats == None or self.last_hits is None:
+            return
+        
+        ratios = numpy.asarray(self.last_hits, dtype=numpy.float64).mean(axis=0) / self.calibration.areas
+        self.last_reading = (ratios, previous)
+        while len(self.corrected_readings) > 0:
+            self.addPinStatistics(*self.corrected_readings.pop(0))
+        if self.pin_confidence is not None:
+            self.addPinStatistics(ratios, standing, numpy.abs(self.pin_confidence) >= self.confidence_margin)
+    
+    '''
+    Adds one ball's readings to the per pin statistics, and with
+    [Calibration] adaptive_thresholds on, relearns the per pin thresholds
+    every adaptive_every balls.
+    '''
+    def addPinStatistics(self, ratios, standing, known = None):
+        self.pin_stats.add(ratios, standing, known)
+        
+        config = self.lane_config
+        if (config.getboolean("Calibration", "adaptive_thresholds")):
+            self.balls_since_learning += 1
+            if (self.balls_since_learning >= int(config.getvalue_default("Calibration", "adaptive_every", 50))):
+                self.balls_since_learning = 0
+                self.applyLearnedThresholds()
+    
+    '''
+    Labels every pin of the ball scored to (player, frame, shot) from a score
+    correction, when the corrected count alone settles which pins fell (see
+    pinmask.standingAfterCount). Called on the UI thread, so the labels are
+    only queued; the scoring thread adds them with the next ball it reads.
+    '''
+    def learnFromCorrection(self, player, frame, shot, value):
+        reading = self.scored_readings.get((player, frame, shot))
+        if reading == None or reading[1] == None:
+            return
+        
+        ratios, previous = reading
+        if value in ("x", "X"):
+            standing = standingAfterCount(previous, 10)
+        elif value == "/":
+            standing = 0
+        elif value == "-":
+            standing = previous
+        elif value.isdigit():
+            standing = standingAfterCount(previous, int(value))
+        else:
+            return
+        if standing != None:
+            self.corrected_readings.append((ratios, statesFromMask(standing)))
+    
+    '''
+    Forgets which ball was scored to which frame, eg. for a new game.
+    '''
+    def clearReadings(self):
+        self.scored_readings = {}
+    
+    '''
+    Works out a threshold for every pin with enough history and writes them
+    to config.cfg as min_points_to_trigger_1 .. min_points_to_trigger_10
+    (hit pixels, like min_points_to_trigger). Pins without enough readings
+    keep what they have.
+    
+    stats - PinStatistics to learn from, the running ones if not given
+    
+    Returns the list of per pin thresholds now in use.
+    '''
+    def applyLearnedThresholds(self, stats = None, save = True):
+        if stats == None:
+            stats = self.pin_stats
+        config = self.lane_config
+        min_samples = int(config.getvalue_default("Calibration", "adaptive_min_samples", 20))
+        ratios = stats.thresholds(min_samples)
+        
+        for i in range(len(ratios)):
+            if not numpy.isnan(ratios[i]):
+                hits = max(1, int(math.ceil(ratios[i] * self.calibration.areas[i])))
+                config.setvalue("Calibration", "min_points_to_trigger_" + str(i + 1), hits)
+        if save:
+            config.save()
+            if stats is self.pin_stats:
+                stats.save(self.pin_stats_file)
+        self.reloadCalibration()
+        logger.info("Per pin thresholds: %s" % str(list(self.pin_thresholds)))
+        return list(self.pin_thresholds)
+        
+    '''
+    Starts a new recording of the frames each ball is read from, named after
+    the current time and placed in the [Recording] directory.
+    '''
+    def startRecording(self):
+        config = self.lane_config
+        directory = config.getvalue_default("Recording", "directory", "recordings")
+        capacity = int(config.getvalue_default("Recording", "capacity", 2000))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
         
+        path = laneFileName(os.path.join(directory, time.strftime("%Y%m%d-%H%M%S") + ".osr"), self.lane)
+        logger.info("Recording scored frames to %s" % path)
+        self.recorder = FrameRecorder(path, self.camera.get_size(), capacity)
+    
+    '''
+    Writes the frames the last read used and what was detected to the
+    recording, if one is running. Returns the ball's number in the recording
+    (None when not recording).
+    '''
+    def recordBall(self, standing, pin_count, first_ball):
+        self.last_recorded_ball = None
+        if self.recorder == None:
+            return None
+        
+        try:
+            if self.read_frames == None:
+                # The region-only read never copies the whole frame, so take the newest one now
+                latest = self.frame_buffer.latest()
+                self.read_frames = (latest[0][numpy.newaxis], [latest[1]])
+            frames, timestamps = self.read_frames
+            self.last_recorded_ball = self.recorder.recordBall(frames, timestamps, standing, pin_count, first_ball, self.use_blacklight)
+            if self.last_recorded_ball == None:
+                logger.warning("Recording is full, ball not recorded")
+        except:
+            logger.error("Could not record ball")
+            logger.exception('')
+        return self.last_recorded_ball
+    
+    '''
+    Notes in the recording which game frame a recorded ball was scored to, and
+    remembers the ball's reading (last_reading when it was read) for score
+    corrections to label.
+    '''
+    def recordScored(self, ball, player, frame, shot, reading = None):
+        if reading != None:
+            self.scored_readings[(player, frame, shot)] = reading
+        if self.recorder == None or ball == None:
+            return
+        self.recorder.recordEvent({"type": "scored", "ball": ball, "player": player, "frame": frame, "shot": shot})
+    
+    '''
+    Notes a manual score correction in the recording, and lets it label the
+    corrected ball for the statistics (see learnFromCorrection).
+    '''
+    def recordCorrection(self, player, frame, shot, value):
+        self.learnFromCorrection(player, frame, shot, value)
+        if self.recorder == None:
+            return
+        self.recorder.recordEvent({"type": "correction", "player": player, "frame": frame, "shot": shot, "value": value})
+    
+    '''
+    Calls read() and returns its result. If there was no fresh frame (read()
+    returned None) and the camera is believed to be working, waits up to
+    READ_TIMEOUT for the next frame and tries once more. Raises
+    CameraUnavailable rather than waiting any longer; recovering the camera is
+    left to the supervisor.
+    '''
+    def readOrFail(self, read):
+        result = read()
+        if result is None and (self.supervisor == None or self.supervisor.healthy()):
+            self.frame_buffer.waitForFrame(self.frame_buffer.frames_captured, self.READ_TIMEOUT)
+            result = read()
+        if result is None:
+            raise CameraUnavailable("No fresh frame from the camera")
+        return result
+    
+    '''
+    Reads which pins are standing from a single deck snapshot. Returns a list
+    of 10 booleans.
+    '''
+    def getSnapshotPinStates(self):
+        if not self.readsSurface():
+            return self.getRegionPinStates()
+        
+        deck_surface = self.readOrFail(lambda: self.getDeckSnapshot(True))
+        if self.latest_frame is not None:
+            self.read_frames = (self.latest_frame[numpy.newaxis], [self.latest_frame_time])
+        
+        #self.screen.blit(self.thresholded, (0,0))
         if (self.use_blacklight):
             detect_color = self.bl_detect_color
         else:
             detect_color = self.detect_color
-            
-        for px,py in self.points:
-            num_points_triggered = 0
-            for x in range(px, px + self.point_size + 1):
-                for y in range(py, py + self.point_size + 1):
-                    if (deck_px_array[x][y] == deck_surface.map_rgb(detect_color)):
-                        # This pixel is white, so count that as a triggered pixel
-                        num_points_triggered += 1
-            
-            # If we're over the threshold, count it as a pin standing
-            if num_points_triggered >= self.min_points_to_trigger:
-                num_pins_standing += 1
-                self.pin_display[counter] = True
-                
-            counter += 1
-        
-        # If we're not using the last ball score, set the last ball score as the current score
-        # (This happens on first ball)
-        if not use_last_ball_score:
-            self.last_ball_score = 10 - num_pins_standing
-            logger.info("num_pins_standing: %d       last_ball_score: %d" % (num_pins_standing, self.last_ball_score))
-            return (10 - num_pins_standing)
+        
+        if (self.detect_engine == "pixelarray"):
+            hits = detection.countRoiHitsPixelArray(deck_surface, self.points, self.point_size, detect_color)
+        elif (self.detect_engine == "blob"):
+            hits = detection.countBlobHits(deck_surface, self.calibration, detect_color, self.blob_min_size)
         else:
-            current_ball_score = 10 - num_pins_standing
-            if (current_ball_score == 10):
-                return 10 - self.last_ball_score
-            elif (current_ball_score == self.last_ball_score):
-                return 0
-            elif (current_ball_score > self.last_ball_score):
-                return current_ball_score - self.last_ball_score
-            else:
-                return self.last_ball_score - current_ball_score
-            #print "using last ball score: %d   current_ball_score: %d" % (self.last_ball_score, current_ball_score)
-            #return (self.last_ball_score + (10 - current_ball_score))
-        
-    def getDeckSnapshot(self):
-        #logger.info("Getting deck snapshot")
-        if self.camera == None: return
-        #logger.info("Capturing image from camera...")
-        try:
-            self.camera.get_image(self.snapshot)
-        except Exception, e:
-            self.snapshot = None
-            
-        if self.snapshot == None:
-            retry_count = 0
-            while self.snapshot == None and retry_count < 3:
-                self.cleanup()
-                time.sleep(5)
-                self.__init__(self.screen)
-                self.snapshot = self.camera.get_image(self.snapshot)
-                retry_count += 1
-            
-        #logger.info("Thresholding image...")
-        if (self.use_blacklight):
-            pygame.transform.threshold(self.thresholded, self.snapshot, self.bl_detect_color, self.bl_threshold_detect, self.bl_other_colors_nondetect, 1)
+            hits = detection.countRoiHits(deck_surface, self.calibration, detect_color)
+        
+        self.last_hits = numpy.array([hits])
+        self.last_confidence = detection.pinConfidence(self.last_hits, self.pin_thresholds, self.calibration.areas)
+        
+        # If we're over the threshold, count it as a pin standing
+        return [hits[i] >= self.pin_thresholds[i] for i in range(len(self.points))]
+    
+    '''
+    True if single frame reads threshold and scale the whole snapshot (see
+    getSnapshotPinStates). The reference and single channel engines compare
+    raw camera pixels, so they always read just the regions.
+    '''
+    def readsSurface(self):
+        return not (self.process_mode == "roi" or self.usingReferences() or self.getDetectChannel() != None)
+    
+    '''
+    Reads which pins are standing by looking only at the calibration region
+    pixels of the newest camera frame. Nothing else in the frame is copied,
+    thresholded or scaled; the region coordinates are scaled to the camera
+    resolution instead, so the cost only depends on the size of the regions.
+    Returns a list of 10 booleans.
+    '''
+    def getRegionPinStates(self):
+        state = self.read_state
+        xs, ys = state[0].sampleCoordinates(self.frame_buffer.size)
+        channel = self.getDetectChannel(state)
+        if channel != None:
+            sampled = self.readOrFail(lambda: self.sampleLatestFrame(xs, ys, channel[0]))
         else:
-            pygame.transform.threshold(self.thresholded, self.snapshot, self.detect_color, self.threshold_detect, self.other_colors_nondetect, 1)
+            sampled = self.readOrFail(lambda: self.sampleLatestFrame(xs, ys))
+        return list(self.classifySamples(sampled[0], state)[0])
+    
+    '''
+    Decides which pins are standing in each of a stack of frames, and keeps
+    the hits and confidences for the statistics and the confidence check. With
+    the reference engine the references follow the frames.
+    
+    samples - (num_frames, num_pixels, 3) calibration region pixels sampled
+    from camera frames (see CompiledCalibration.sampleCoordinates), or
+    (num_frames, num_pixels) when sampled from the getDetectChannel() channel
+    state - The read state the samples were taken with (see makeReadState)
+    
+    Returns a (num_frames, 10) boolean array.
+    '''
+    def classifySamples(self, samples, state = None):
+        state = state or self.read_state
+        standing, hits, scores = self.detectSamples(samples, state)
+        if scores is not None:
+            mode = self.getLightingMode()
+            self.references.update(samples, scores, mode)
+            self.last_confidence = scores - state[4]
+            logger.info("Reference scores: %s" % str(scores[-1]))
+            return standing
+        
+        self.last_hits = hits
+        self.last_confidence = detection.pinConfidence(hits, state[1], state[0].areas)
+        return standing
+    
+    '''
+    Decides which pins are standing in each of a stack of frames (samples as
+    for classifySamples) without changing anything, so it is safe to call from
+    any thread.
+    
+    Returns (standing, hits, scores): hits for the color engines and scores for
+    the reference engine, None for the other.
+    '''
+    def detectSamples(self, samples, state):
+        calibration, pin_thresholds, min_blob, references, reference_level, detect = state
+        mode = self.getLightingMode()
+        if samples.ndim == 2:
+            channel, value, threshold = self.getDetectChannel(state)
+            hits = detection.countChannelHits(samples, calibration, value, threshold, min_blob)
+            return hits >= pin_thresholds, hits, None
+        
+        if self.usingReferences(state):
+            scores = scoreSamples(samples, references[(mode, REFERENCE_FULL)], references[(mode, REFERENCE_EMPTY)],
+                                  calibration, calibration.areas)
+            return scores >= reference_level, None, scores
+        
+        color, threshold = detect[mode][:2]
+        hits = detection.countSampleHits(samples, calibration, color, threshold, min_blob)
+        return hits >= pin_thresholds, hits, None
+    
+    '''
+    The smallest connected blob whose pixels count as hits with the "blob"
+    engine, 0 (every hit pixel counts) with the others.
+    '''
+    def getMinBlob(self):
+        return self.read_state[2]
+    
+    '''
+    "blacklight" or "normal", whichever lighting the current bowler uses
+    '''
+    def getLightingMode(self):
+        if (self.use_blacklight):
+            return "blacklight"
+        return "normal"
+    
+    '''
+    True if the reference engine is selected and has both references for the
+    current lighting mode. Without them the detect colors are used instead.
+    '''
+    def usingReferences(self, state = None):
+        references = (state or self.read_state)[3]
+        mode = self.getLightingMode()
+        return references != None and (mode, REFERENCE_FULL) in references and (mode, REFERENCE_EMPTY) in references
+    
+    '''
+    The single channel to detect on for the current lighting mode, as
+    (channel, value, threshold), or None when all three channels are compared
+    with the detect color (or the reference engine is in use).
+    '''
+    def getDetectChannel(self, state = None):
+        state = state or self.read_state
+        if self.usingReferences(state):
+            return None
+        return state[5][self.getLightingMode()][2]
+    
+    '''
+    Stores the newest few frames as the full rack (REFERENCE_FULL) or empty
+    deck (REFERENCE_EMPTY) reference for the current lighting mode and saves
+    the references.
+    '''
+    def captureReference(self, kind):
+        xs, ys = self.calibration.sampleCoordinates(self.frame_buffer.size)
+        collected = self.readOrFail(lambda: self.frame_buffer.collect(self.REFERENCE_FRAMES, self.READ_TIMEOUT))
+        self.references.setReference(self.getLightingMode(), kind, collected[0][:, xs, ys])
+        self.references.save(self.reference_file)
+        logger.info("Captured %s reference for %s lighting" % (kind, self.getLightingMode()))
+    
+    '''
+    Reads which pins are standing in the newest frame from its calibration
+    regions, like getRegionPinStates, but copies the whole frame into
+    read_frames so it can be recorded. Returns a list of 10 booleans.
+    '''
+    def getFramePinStates(self):
+        collected = self.readOrFail(lambda: self.frame_buffer.collect(1, self.STALE_FRAME_AGE))
+        self.read_frames = collected
+        return list(self.classifyFrames(collected[0])[0])
+    
+    '''
+    Samples the calibration regions of whole camera frames and decides
+    which pins are standing in each (see classifySamples).
+    
+    frames - (num_frames, width, height, 3) array
+    '''
+    def classifyFrames(self, frames):
+        state = self.read_state
+        xs, ys = state[0].sampleCoordinates(self.frame_buffer.size)
+        channel = self.getDetectChannel(state)
+        if channel != None:
+            return self.classifySamples(frames[:, xs, ys, channel[0]], state)
+        return self.classifySamples(frames[:, xs, ys], state)
+    
+    '''
+    Reads which pins are standing from a short burst of frames (vote_frames of
+    them, gathered within vote_budget seconds) and lets the frames vote, so a
+    wobbling pin or something passing through one frame doesn't decide the ball.
+    
+    previous - Pin states before this ball, for hysteresis voting (see
+    previousPinStates)
+    
+    Returns a list of 10 booleans.
+    '''
+    def getVotedPinStates(self, previous):
+        collected = self.readOrFail(lambda: self.frame_buffer.collect(self.vote_frames, self.vote_budget, self.vote_buffer))
+        frames = collected[0]
+        self.read_frames = collected
+        frame_standing = self.classifyFrames(frames)
+        
+        standing, ratios = detection.votePinStates(frame_standing, self.vote_mode, previous, self.vote_low, self.vote_high)
+        logger.info("Voted over %d frames, standing ratios: %s" % (len(frames), str(ratios)))
+        return list(standing)
+    
+    '''
+    Reads which pins are standing by following the deck from the newest frame
+    on, classifying every frame the camera delivers until the last
+    burst_stable frames all agree. Called right after a ball hits, this scores
+    as soon as the pins have physically stopped falling instead of after a
+    fixed wait. If the deck hasn't settled within burst_timeout seconds, or
+    the camera stops delivering fresh frames part way, the frames read so far
+    vote.
+    
+    The per frame samples, states, hits and confidences go into buffers
+    allocated once for the calibration regions, so a burst doesn't allocate
+    per frame.
+    
+    Returns a list of 10 booleans.
+    '''
+    def getBurstPinStates(self):
+        buffer = self.frame_buffer
+        state = self.read_state
+        xs, ys = state[0].sampleCoordinates(buffer.size)
+        channel = self.getDetectChannel(state)
+        stable = self.burst_stable
+        sample_shape = (1, len(xs)) if channel != None else (1, len(xs), 3)
+        if self.burst_samples is None or self.burst_samples.shape != sample_shape or len(self.burst_states) != stable:
+            self.burst_samples = numpy.empty(sample_shape, dtype=numpy.uint8)
+            self.burst_states = numpy.empty((stable, len(self.points)), dtype=bool)
+            self.burst_hits = numpy.empty((stable, len(self.points)))
+            self.burst_confidence = numpy.empty((stable, len(self.points)))
+        flat = xs * buffer.size[1] + ys
+        channel_index = channel[0] if channel != None else None
+        
+        def sample():
+            sampled = buffer.sampleInto(flat, self.burst_samples[0], channel_index)
+            if sampled == None or time.time() - sampled[0] > self.STALE_FRAME_AGE:
+                return None
+            return sampled
         
-        #logger.info("Creating resized surface for processing")
-        resized = pygame.Surface((320,240), 0, self.screen)
+        deadline = time.time() + self.burst_timeout
+        sequence = self.readOrFail(sample)[1]
+        count = 0
+        while True:
+            row = count % stable
+            self.burst_states[row] = self.classifySamples(self.burst_samples, state)[0]
+            if self.last_hits is not None:
+                self.burst_hits[row] = self.last_hits[0]
+            self.burst_confidence[row] = self.last_confidence[0]
+            count += 1
             
-        if self.thresholded != None:
-            pygame.transform.scale(self.thresholded, (320,240), resized)
+            if count >= stable and (self.burst_states == self.burst_states[row]).all():
+                standing = self.burst_states[row]
+                logger.info("Deck stable after %d frames" % count)
+                break
             
-        return resized
+            remaining = deadline - time.time()
+            sampled = None
+            if remaining > 0 and buffer.waitForFrame(sequence, remaining):
+                sampled = sample()
+            if sampled == None:
+                frames = min(count, stable)
+                standing = detection.votePinStates(self.burst_states[:frames])[0]
+                logger.warning("Deck not stable after %d frames, voting over the last %d" % (count, frames))
+                break
+            sequence = sampled[1]
+        
+        # Leave what the committed frames read for the statistics and confidence check
+        frames = min(count, stable)
+        if self.last_hits is not None:
+            self.last_hits = self.burst_hits[:frames].copy()
+        self.last_confidence = self.burst_confidence[:frames].copy()
+        return list(standing)
+    
+    '''
+    Thresholds the newest frame and scales it to DECK_SIZE.
+    
+    fresh_only - Return None instead of the last good frame when there is no
+    fresh one (scoring wants this, the screens would rather show the last frame)
+    
+    The screens call this on the UI thread, so without fresh_only it never
+    waits: if scoring holds the lock, or the capture worker hasn't delivered a
+    frame yet, the last snapshot made is returned instead.
+    '''
+    def getDeckSnapshot(self, fresh_only = False):
+        if not self.lock.acquire(fresh_only):
+            return self.deck_snapshot
+        try:
+            #logger.info("Getting deck snapshot")
+            #logger.info("Taking newest frame from the capture worker...")
+            if not self.loadLatestFrame(fresh_only):
+                if fresh_only:
+                    return None
+                if self.latest_frame is None:
+                    return self.deck_snapshot
+            
+            #logger.info("Thresholding image...")
+            # Newer pygame versions leave the pixels within the threshold as
+            # they were in the destination, so it starts out as the detect color
+            if (self.use_blacklight):
+                self.thresholded.fill(self.bl_detect_color)
+                pygame.transform.threshold(self.thresholded, self.snapshot, self.bl_detect_color, self.bl_threshold_detect, self.bl_other_colors_nondetect, 1)
+            else:
+                self.thresholded.fill(self.detect_color)
+                pygame.transform.threshold(self.thresholded, self.snapshot, self.detect_color, self.threshold_detect, self.other_colors_nondetect, 1)
+        
+            #logger.info("Creating resized surface for processing")
+            resized = pygame.Surface(self.DECK_SIZE, 0, self.screen)
+            
+            if self.thresholded != None:
+                pygame.transform.scale(self.thresholded, self.DECK_SIZE, resized)
+            
+            self.deck_snapshot = resized
+            return resized
+        finally:
+            self.lock.release()
+        
+    '''
+    Copies the newest frame from the capture worker into self.snapshot.
+    
+    wait - Wait briefly if the worker hasn't delivered its first frame yet
+    
+    Returns False if there is no frame or the newest one is stale.
+    '''
+    def loadLatestFrame(self, wait = True):
+        if self.frame_buffer == None: return False
+        
+        buffer = self.frame_buffer
+        if wait and buffer.frames_captured == 0:
+            buffer.waitForFrame(0, self.FIRST_FRAME_TIMEOUT)
+        
+        latest = buffer.latest(self.latest_frame)
+        if latest == None or time.time() - latest[1] > self.STALE_FRAME_AGE:
+            return False
+        
+        self.latest_frame = latest[0]
+        self.latest_frame_time = latest[1]
+        pygame.surfarray.blit_array(self.snapshot, self.latest_frame)
+        return True
+    
+    '''
+    The box around all calibration regions in camera frame coordinates, padded
+    by a point size on each side so pins wobbling out of their region still
+    count as deck motion.
+    '''
+    def getCameraRegion(self):
+        x0, y0, x1, y1 = self.calibration.bounds()
+        cam_w, cam_h = self.frame_buffer.size
+        scale_x = float(cam_w) / self.DECK_SIZE[0]
+        scale_y = float(cam_h) / self.DECK_SIZE[1]
+        pad = self.point_size
+        return (max(0, int((x0 - pad) * scale_x)), max(0, int((y0 - pad) * scale_y)),
+                min(cam_w, int(math.ceil((x1 + pad) * scale_x))), min(cam_h, int(math.ceil((y1 + pad) * scale_y))))
+    
+    '''
+    Called on the capture thread by the BallDetector once a ball has hit and the
+    deck has settled. Hands the news to the main loop as a BALL_DETECTED event.
+    '''
+    def onBallDetected(self, impact_time, settle_time):
+        pygame.event.post(pygame.event.Event(BALL_DETECTED, lane=self.lane, impact_time=impact_time, settle_time=settle_time))
+    
+    '''
+    Picks the given pixels out of the newest captured frame, waiting briefly for
+    the worker's first frame. Returns (samples, timestamp) or None if there is
+    no frame or the newest one is stale.
+    '''
+    def sampleLatestFrame(self, xs, ys, channel = None):
+        if self.frame_buffer == None: return None
+        
+        buffer = self.frame_buffer
+        if buffer.frames_captured == 0:
+            buffer.waitForFrame(0, self.FIRST_FRAME_TIMEOUT)
+        
+        sampled = buffer.sampleLatest(xs, ys, channel)
+        if sampled == None or time.time() - sampled[1] > self.STALE_FRAME_AGE:
+            return None
+        return sampled
+    
+    '''
+    Returns the capture worker's frame counters (frames_captured, frames_dropped,
+    capture_errors and frame_age in seconds), or None if there's no worker.
+    '''
+    def getCaptureStats(self):
+        if self.frame_buffer == None: return None
+        return self.frame_buffer.stats()
         
+    '''
+    Finds the ten pins on a fresh snapshot of a full rack and derives the
+    calibration points, point_size and min_points_to_trigger from them (see
+    autocalibrate.py). With save set the result is written to config.cfg,
+    otherwise it only lasts until the config is loaded again.
+    
+    Returns the result dict. Raises ValueError if ten pins can't be found and
+    CameraUnavailable if there is no fresh frame.
+    '''
+    def autoCalibrate(self, save = True):
+        with self.lock:
+            deck_surface = self.readOrFail(lambda: self.getDeckSnapshot(True))
+            if (self.use_blacklight):
+                detect_color = self.bl_detect_color
+            else:
+                detect_color = self.detect_color
+            mask = detection.surfacePixels(deck_surface) == deck_surface.map_rgb(detect_color)
+        
+        result = autocalibrate.calibrateFromMask(mask, BowlingScorer.PIXEL_DISTANCE_COUNT)
+        logger.info("Automatic calibration: points %s, point_size %d, min_points_to_trigger %d" %
+                    (str(result["points"]), result["point_size"], result["min_points_to_trigger"]))
+        
+        config = self.lane_config
+        for i in range(len(result["points"])):
+            config.setvalue("Calibration", "point_" + str(i + 1), result["points"][i])
+        config.setvalue("Calibration", "point_size", result["point_size"])
+        config.setvalue("Calibration", "min_points_to_trigger", result["min_points_to_trigger"])
+        
+        # Thresholds learned for the old regions don't carry over
+        for i in range(1,11):
+            config.removevalue("Calibration", "min_points_to_trigger_" + str(i))
+        if self.pin_stats != None:
+            self.pin_stats.reset()
+        if save:
+            config.save()
+        self.reloadCalibration()
+        return result
+    
     '''
     Reloads the calibration points from the configuration file as well as
     point sizes and threshold information for each point
@@ -400,21 +1359,117 @@ class PinCounter:
         for i in range(10):
             self.points.append((-1,-1))
         for i in range(1,11):
-            if (BowlingScorer.instance.config.gettuple("Calibration", "point_" + str(i)) != None):
-                self.points[i - 1] = BowlingScorer.instance.config.gettuple("Calibration", "point_" + str(i))
+            if (self.lane_config.gettuple("Calibration", "point_" + str(i)) != None):
+                self.points[i - 1] = self.lane_config.gettuple("Calibration", "point_" + str(i))
         
         logger.info("Reloading calibration point info from file...")
-        self.point_size = int(BowlingScorer.instance.config.getvalue("Calibration", "point_size"))
-        self.min_points_to_trigger = int(BowlingScorer.instance.config.getvalue("Calibration", "min_points_to_trigger"))
+        self.point_size = int(self.lane_config.getvalue("Calibration", "point_size"))
+        self.min_points_to_trigger = int(self.lane_config.getvalue("Calibration", "min_points_to_trigger"))
+        
+        # Pins can have thresholds of their own (min_points_to_trigger_1 .. min_points_to_trigger_10)
+        pin_thresholds = numpy.empty(len(self.points), dtype=numpy.intp)
+        for i in range(1,11):
+            pin_thresholds[i - 1] = int(self.lane_config.getvalue_default("Calibration", "min_points_to_trigger_" + str(i), self.min_points_to_trigger))
+        self.pin_thresholds = pin_thresholds
         
-        self.detect_color = BowlingScorer.instance.config.gettuple("Camera", "detect_color")
-        self.other_colors_nondetect = BowlingScorer.instance.config.gettuple("Camera", "other_colors_nondetect")
-        self.threshold_detect = BowlingScorer.instance.config.gettuple("Camera", "threshold_detect")
+        # Region shape for each point, with optional per-pin polygons (polygon_1 .. polygon_10)
+        point_shape = self.lane_config.getvalue_default("Calibration", "point_shape", "square")
+        polygons = {}
+        for i in range(1,11):
+            polygon = self.lane_config.gettuple("Calibration", "polygon_" + str(i))
+            if (polygon != None):
+                polygons[i] = polygon
         
-        self.bl_detect_color = BowlingScorer.instance.config.gettuple("Camera", "bl_detect_color")
-        self.bl_other_colors_nondetect = BowlingScorer.instance.config.gettuple("Camera", "bl_other_colors_nondetect")
-        self.bl_threshold_detect = BowlingScorer.instance.config.gettuple("Camera", "bl_threshold_detect")
+        # Only rasterize the regions again when something about them actually changed
+        calibration_key = CompiledCalibration.makeKey(self.points, self.point_size, self.DECK_SIZE, point_shape, polygons)
+        if (self.calibration == None or self.calibration.key != calibration_key):
+            logger.info("Compiling calibration regions...")
+            self.calibration = CompiledCalibration(self.points, self.point_size, self.DECK_SIZE, point_shape, polygons)
+            if (self.ball_detector != None):
+                self.ball_detector.setRegion(self.getCameraRegion())
+            if (self.deck_validator != None):
+                self.deck_validator.setRegion(self.getCameraRegion())
         
+        # Reference frames for the "reference" engine, kept in their own file
+        self.reference_file = self.lane_config.getfilename("Camera", "reference_file", "references.npz")
+        if (self.references == None):
+            self.references = ReferenceModel(self.calibration, self.frame_buffer.size)
+            self.references.load(self.reference_file)
+        else:
+            self.references.setCalibration(self.calibration, self.frame_buffer.size)
+        self.references.alpha = float(self.lane_config.getvalue_default("Camera", "reference_alpha", 0.05))
+        self.references.level = float(self.lane_config.getvalue_default("Camera", "reference_level", 0.5))
+        
+        self.detect_color = self.lane_config.gettuple("Camera", "detect_color")
+        self.other_colors_nondetect = self.lane_config.gettuple("Camera", "other_colors_nondetect")
+        self.threshold_detect = self.lane_config.gettuple("Camera", "threshold_detect")
+        
+        self.bl_detect_color = self.lane_config.gettuple("Camera", "bl_detect_color")
+        self.bl_other_colors_nondetect = self.lane_config.gettuple("Camera", "bl_other_colors_nondetect")
+        self.bl_threshold_detect = self.lane_config.gettuple("Camera", "bl_threshold_detect")
+        
+        # Which pixel counting engine to use: "numpy" (surfarray), "pixelarray" (original loop),
+        # "blob" (only hits in connected blobs of blob_min_size pixels count)
+        # or "reference" (compare with full rack / empty deck reference frames)
+        self.detect_engine = self.lane_config.getvalue_default("Camera", "detect_engine", "numpy")
+        self.blob_min_size = int(self.lane_config.getvalue_default("Camera", "blob_min_size", BowlingScorer.PIXEL_DISTANCE_COUNT))
+        # Detect on all three channels ("rgb") or just one: 0 is the Y (luma) plane of a YUV
+        # capture, 1 and 2 the chroma planes. A pixel is a hit when abs(channel - value) <= threshold
+        self.detect_channel = self.lane_config.getvalue_default("Camera", "detect_channel", "rgb")
+        self.channel_value = int(self.lane_config.getvalue_default("Camera", "channel_value", 255))
+        self.channel_threshold = int(self.lane_config.getvalue_default("Camera", "channel_threshold", 60))
+        self.bl_detect_channel = self.lane_config.getvalue_default("Camera", "bl_detect_channel", "rgb")
+        self.bl_channel_value = int(self.lane_config.getvalue_default("Camera", "bl_channel_value", 60))
+        self.bl_channel_threshold = int(self.lane_config.getvalue_default("Camera", "bl_channel_threshold", 40))
+        
+        # "surface" thresholds and scales the whole snapshot, "roi" only looks at the calibration regions
+        self.process_mode = self.lane_config.getvalue_default("Camera", "process_mode", "surface")
+        
+        self.read_state = self.makeReadState()
+    
+    '''
+    Everything reading the pins depends on that reloadCalibration changes, as
+    one tuple: (calibration, pin_thresholds, min_blob, references,
+    reference_level, detect). references is the reference frames dict, or None
+    unless the reference engine is selected. detect maps each lighting mode to
+    its (detect_color, threshold_detect, channel), channel being the
+    getDetectChannel() (channel, value, threshold) or None for all three.
+    
+    The capture thread reads pins without the lock (readFramePins), so the
+    tuple is only ever replaced whole, never changed.
+    '''
+    def makeReadState(self):
+        detect = {}
+        for mode, color, threshold, channel, value, channel_threshold in (
+                ("normal", self.detect_color, self.threshold_detect, self.detect_channel, self.channel_value, self.channel_threshold),
+                ("blacklight", self.bl_detect_color, self.bl_threshold_detect, self.bl_detect_channel, self.bl_channel_value, self.bl_channel_threshold)):
+            if (channel == "rgb"):
+                detect[mode] = (color, threshold, None)
+            else:
+                detect[mode] = (color, threshold, (int(channel), value, channel_threshold))
+        
+        min_blob = 0
+        if (self.detect_engine == "blob"):
+            min_blob = self.blob_min_size
+        references = None
+        if (self.detect_engine == "reference"):
+            references = self.references.references
+        return (self.calibration, self.pin_thresholds, min_blob, references, self.references.level, detect)
+    
     def cleanup(self):
-        if self.camera != None:
-            self.camera.stop()
+        if self.pin_stats != None:
+            while len(self.corrected_readings) > 0:
+                self.pin_stats.add(*self.corrected_readings.pop(0))
+            self.pin_stats.save(self.pin_stats_file)
+        if self.supervisor != None:
+            self.supervisor.stop()
+        self.closeCamera()
+    
+    '''
+    Closes the recording, if one is running. Only done on exit, since cleanup()
+    is also used to restart the camera.
+    '''
+    def stopRecording(self):
+        if self.recorder != None:
+            self.recorder.close()
+            self.recorder = None
@@ -0,0 +1,163 @@
+'''
+Compiled calibration regions.
+
+The calibration points in config.cfg describe where each pin sits on the deck
+snapshot. Rather than re-deriving the sample area around each point on every
+ball, the regions are rasterized once into flat (x, y) index arrays. Counting a
+ball is then a single gather over the snapshot and a single per-pin sum, no
+matter what shape the regions are.
+'''
+
+import numpy
+
+ROI_SHAPES = ("square", "circle")
+
+'''
+The square sampled by the original detector: px..px+point_size by
+py..py+point_size inclusive, walked x first.
+'''
+def squareRoi(point, point_size):
+    px, py = point
+    xs, ys = numpy.mgrid[px:px + point_size + 1, py:py + point_size + 1]
+    return xs.ravel(), ys.ravel()
+
+'''
+The disc inscribed in the point's square.
+'''
+def circleRoi(point, point_size):
+    xs, ys = squareRoi(point, point_size)
+    cx = point[0] + point_size / 2.0
+    cy = point[1] + point_size / 2.0
+    radius = (point_size + 1) / 2.0
+    inside = (xs - cx) ** 2 + (ys - cy) ** 2 <= radius ** 2
+    return xs[inside], ys[inside]
+
+'''
+Every pixel inside the polygon described by the list of (x, y) vertices, using
+the even-odd rule. The loop only runs over the handful of edges; each edge is
+tested against every pixel of the bounding box at once.
+'''
+def polygonRoi(vertices):
+    vertices = numpy.array(vertices, dtype=numpy.float64).reshape(-1, 2)
+    x0, y0 = numpy.floor(vertices.min(axis=0)).astype(int)
+    x1, y1 = numpy.ceil(vertices.max(axis=0)).astype(int)
+    xs, ys = numpy.mgrid[x0:x1 + 1, y0:y1 + 1]
+    xs = xs.ravel()
+    ys = ys.ravel()
+
+    inside = numpy.zeros(xs.shape, dtype=bool)
+    j = len(vertices) - 1
+    for i in range(len(vertices)):
+        xi, yi = vertices[i]
+        xj, yj = vertices[j]
+        j = i
+        if yi == yj:
+            # Horizontal edges never cross a scanline
+            continue
+        crosses = ((yi > ys) != (yj > ys)) & (xs < (xj - xi) * (ys - yi) / (yj - yi) + xi)
+        inside ^= crosses
+
+    return xs[inside], ys[inside]
+
+'''
+The calibration regions for all ten pins, rasterized against a frame of the
+given size.
+
+points - List of (x, y) calibration points, one per pin
+point_size - Size of the square (or circle) sampled at each point
+size - (width, height) of the frames that will be sampled
+shape - One of ROI_SHAPES, used for every pin without a polygon
+polygons - Optional dict of pin number (1-10) to a list of (x, y) vertices
+'''
+class CompiledCalibration(object):
+
+    def __init__(self, points, point_size, size, shape="square", polygons=None):
+        if polygons == None:
+            polygons = {}
+        if shape not in ROI_SHAPES:
+            raise ValueError("Unknown calibration region shape '%s'" % shape)
+
+        self.points = list(points)
+        self.point_size = point_size
+        self.size = tuple(size)
+        self.shape = shape
+        self.polygons = dict(polygons)
+        self.key = CompiledCalibration.makeKey(points, point_size, size, shape, polygons)
+
+        all_xs = []
+        all_ys = []
+        for i in range(len(self.points)):
+            if (i + 1) in self.polygons:
+                xs, ys = polygonRoi(self.polygons[i + 1])
+            elif shape == "circle":
+                xs, ys = circleRoi(self.points[i], point_size)
+            else:
+                xs, ys = squareRoi(self.points[i], point_size)
+
+            # Keep regions on the frame, an unset (-1,-1) point included
+            all_xs.append(numpy.clip(xs, 0, self.size[0] - 1))
+            all_ys.append(numpy.clip(ys, 0, self.size[1] - 1))
+
+        self.areas = numpy.array([len(xs) for xs in all_xs], dtype=numpy.intp)
+        self.xs = numpy.concatenate(all_xs).astype(numpy.intp)
+        self.ys = numpy.concatenate(all_ys).astype(numpy.intp)
+        self.roi_index = numpy.repeat(numpy.arange(len(self.points)), self.areas)
+
+        # One-hot (pixel, pin) matrix so per-pin sums over a stack of frames are one dot product
+        self.membership = numpy.zeros((len(self.xs), len(self.points)), dtype=numpy.int32)
+        self.membership[numpy.arange(len(self.xs)), self.roi_index] = 1
+
+        self.sample_size = self.size
+        self.sample_xs = self.xs
+        self.sample_ys = self.ys
+
+    '''
+    Build the value used to tell whether a calibration needs to be recompiled.
+    '''
+    @staticmethod
+    def makeKey(points, point_size, size, shape, polygons):
+        if polygons == None:
+            polygons = {}
+        polygon_key = tuple(sorted((pin, tuple(map(tuple, v))) for pin, v in polygons.items()))
+        return (tuple(map(tuple, points)), point_size, tuple(size), shape, polygon_key)
+
+    '''
+    The (x0, y0, x1, y1) box around every region, x1 and y1 exclusive.
+    '''
+    def bounds(self):
+        return (int(self.xs.min()), int(self.ys.min()), int(self.xs.max()) + 1, int(self.ys.max()) + 1)
+
+    '''
+    The region pixels mapped onto a frame of another size (eg. the raw camera
+    frame), picking the same source pixel pygame.transform.scale would.
+    Returns the (xs, ys) index arrays; the last mapping is cached.
+    '''
+    def sampleCoordinates(self, frame_size):
+        frame_size = tuple(frame_size)
+        if frame_size != self.sample_size:
+            self.sample_xs = self.xs * frame_size[0] // self.size[0]
+            self.sample_ys = self.ys * frame_size[1] // self.size[1]
+            self.sample_size = frame_size
+        return self.sample_xs, self.sample_ys
+
+    '''
+    Sum per-pixel values into per-pin totals.
+
+    values - (num_frames, num_pixels) array, one value per region pixel per frame
+
+    Returns a (num_frames, num_pins) array.
+    '''
+    def sumRegions(self, values):
+        return numpy.dot(values, self.membership)
+
+    '''
+    Count the pixels equal to value inside each region.
+
+    pixels - A 2d (x, y) array the size this calibration was compiled for
+    value - The (mapped) pixel value that counts as a hit
+
+    Returns a numpy array with one hit count per pin.
+    '''
+    def countHits(self, pixels, value):
+        matches = pixels[self.xs, self.ys] == value
+        return numpy.bincount(self.roi_index, weights=matches, minlength=len(self.points)).astype(numpy.intp)
@@ -0,0 +1,276 @@
+'''
+Background camera capture.
+
+A CaptureWorker thread pulls frames from the camera as fast as the camera
+hands them out and copies each one into a preallocated FrameBuffer. Anything
+that needs a frame (scoring, the calibration screen, the debug view) takes the
+newest frame already in the buffer instead of waiting on a fresh capture.
+'''
+
+import threading
+import time
+import numpy
+import pygame
+import pygame.surfarray
+from log import *
+
+'''
+A preallocated ring of camera frames.
+
+Frames are stored as (width, height, 3) uint8 arrays in surfarray order. The
+writer always fills the oldest slot while readers copy out of the newest one,
+so with two or more slots this is a classic double buffer; the extra slots give
+slow readers some slack before a frame they are looking at gets reused.
+
+The buffer also keeps the counters used to check the capture keeps up:
+frames_captured - Number of frames written
+frames_dropped - Estimated number of camera frames missed, from gaps between frames
+capture_errors - Number of failed captures reported by the writer
+'''
+class FrameBuffer(object):
+
+    def __init__(self, size, slots=4, frame_interval=1.0 / 30):
+        self.size = tuple(size)
+        self.slots = max(2, slots)
+        self.frame_interval = frame_interval
+        self.frames = numpy.zeros((self.slots, self.size[0], self.size[1], 3), dtype=numpy.uint8)
+        self.timestamps = numpy.zeros(self.slots)
+        self.lock = threading.Lock()
+        self.frame_ready = threading.Condition(self.lock)
+
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.capture_errors = 0
+
+    '''
+    Copy a frame into the next slot and publish it as the newest frame.
+
+    pixels - A (width, height, 3) array, eg. pygame.surfarray.pixels3d(surface)
+    timestamp - When the frame was captured (time.time())
+    '''
+    def write(self, pixels, timestamp):
+        slot = self.frames_captured % self.slots
+        # The slot being written is never the newest one, so readers are
+        # not blocked while the copy happens
+        self.frames[slot][...] = pixels
+
+        with self.lock:
+            if self.frames_captured > 0:
+                gap = timestamp - self.timestamps[(self.frames_captured - 1) % self.slots]
+                if gap > 1.5 * self.frame_interval:
+                    self.frames_dropped += int(round(gap / self.frame_interval)) - 1
+            self.timestamps[slot] = timestamp
+            self.frames_captured += 1
+            self.frame_ready.notify_all()
+
+    '''
+    Note a failed capture.
+    '''
+    def writeError(self):
+        with self.lock:
+            self.capture_errors += 1
+
+    '''
+    Copy the newest frame out of the buffer.
+
+    out - Optional preallocated (width, height, 3) array to copy into
+
+    Returns (frame, timestamp, sequence) or None if nothing has been captured yet.
+    The sequence is the number of frames captured up to and including this one.
+    '''
+    def latest(self, out=None):
+        with self.lock:
+            if self.frames_captured == 0:
+                return None
+            slot = (self.frames_captured - 1) % self.slots
+            if out is None:
+                out = self.frames[slot].copy()
+            else:
+                out[...] = self.frames[slot]
+            return out, self.timestamps[slot], self.frames_captured
+
+    '''
+    Pick out just the given pixels of the newest frame, without copying the
+    rest of it.
+
+    xs, ys - Index arrays of the pixels wanted
+    channel - Only pick this channel (eg. 0 for the Y plane of a YUV frame)
+
+    Returns (samples, timestamp) with samples shaped (1, len(xs), 3), or
+    (1, len(xs)) for a single channel, or None if nothing has been captured yet.
+    '''
+    def sampleLatest(self, xs, ys, channel=None):
+        with self.lock:
+            if self.frames_captured == 0:
+                return None
+            slot = (self.frames_captured - 1) % self.slots
+            if channel == None:
+                return self.frames[slot][xs, ys][numpy.newaxis], self.timestamps[slot]
+            return self.frames[slot][xs, ys, channel][numpy.newaxis], self.timestamps[slot]
+
+    '''
+    Copy the given pixels of the newest frame into a preallocated array, for
+    callers reading frame after frame who don't want a new array each time.
+
+    flat - Pixel indices into the frame flattened to (width * height), ie.
+           x * height + y
+    out - (len(flat), 3) array, or (len(flat),) with a channel given
+    channel - Only copy this channel
+
+    Returns (timestamp, sequence) of the frame copied, or None if nothing has
+    been captured yet.
+    '''
+    def sampleInto(self, flat, out, channel=None):
+        with self.lock:
+            if self.frames_captured == 0:
+                return None
+            slot = (self.frames_captured - 1) % self.slots
+            pixels = self.frames[slot].reshape(-1, 3)
+            if channel == None:
+                numpy.take(pixels, flat, axis=0, out=out)
+            else:
+                numpy.take(pixels[:, channel], flat, out=out)
+            return self.timestamps[slot], self.frames_captured
+
+    '''
+    Gather up to n recent frames for a multi-frame reading.
+
+    Frames captured within the last budget seconds are used straight away; if
+    there aren't n of them the call waits for new ones, but never longer than
+    budget. At most slots - 1 frames can be gathered since the writer is
+    always busy with one slot.
+
+    out - Optional preallocated (n, width, height, 3) array to copy into
+
+    Returns (frames, timestamps) for the frames gathered, oldest first, or None
+    if there are no recent frames at all.
+    '''
+    def collect(self, n, budget, out=None):
+        n = min(n, self.slots - 1)
+        deadline = time.time() + budget
+        with self.lock:
+            while True:
+                now = time.time()
+                count = 0
+                while count < min(n, self.frames_captured) and \
+                now - self.timestamps[(self.frames_captured - 1 - count) % self.slots] <= budget:
+                    count += 1
+                remaining = deadline - now
+                if count >= n or remaining <= 0:
+                    break
+                self.frame_ready.wait(remaining)
+
+            if count == 0:
+                return None
+            if out is None or len(out) < count:
+                out = numpy.empty((count,) + self.frames.shape[1:], dtype=numpy.uint8)
+            slots = [(self.frames_captured - count + i) % self.slots for i in range(count)]
+            numpy.take(self.frames, slots, axis=0, out=out[:count])
+            return out[:count], self.timestamps[slots]
+
+    '''
+    Block until a frame newer than the given sequence number is captured.
+    Returns True if one arrived before the timeout (in seconds).
+    '''
+    def waitForFrame(self, after_sequence=0, timeout=1.0):
+        deadline = time.time() + timeout
+        with self.lock:
+            while self.frames_captured <= after_sequence:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.frame_ready.wait(remaining)
+            return True
+
+    '''
+    Seconds since the newest frame was captured (None if there isn't one).
+    '''
+    def age(self):
+        with self.lock:
+            if self.frames_captured == 0:
+                return None
+            return time.time() - self.timestamps[(self.frames_captured - 1) % self.slots]
+
+    '''
+    Snapshot of the buffer counters, for logging and the debug display.
+    '''
+    def stats(self):
+        age = self.age()
+        with self.lock:
+            return {
+                "frames_captured": self.frames_captured,
+                "frames_dropped": self.frames_dropped,
+                "capture_errors": self.capture_errors,
+                "frame_age": age,
+            }
+
+'''
+Thread that keeps a FrameBuffer filled from a started pygame camera.
+
+Nothing else should touch the camera while the worker is running; call stop()
+before stopping or restarting the camera.
+
+buffer - Optional FrameBuffer to keep filling, eg. the one a worker on the
+previous camera used; a new one is made if it doesn't fit the camera
+'''
+class CaptureWorker(threading.Thread):
+
+    def __init__(self, camera, fps=30, slots=4, buffer=None):
+        super(CaptureWorker, self).__init__(name="CaptureWorker")
+        self.daemon = True
+        self.camera = camera
+        self.running = False
+        self.started_at = None
+        self.listeners = []
+
+        size = tuple(camera.get_size())
+        self.frame_interval = 1.0 / fps
+        self.surface = pygame.Surface(size, 0, 32)
+        if buffer == None or buffer.size != size or buffer.slots < slots:
+            buffer = FrameBuffer(size, slots, self.frame_interval)
+        self.buffer = buffer
+
+    def start(self):
+        self.running = True
+        self.started_at = time.time()
+        super(CaptureWorker, self).start()
+
+    def run(self):
+        logger.info("Capture worker started")
+        while self.running:
+            try:
+                self.camera.get_image(self.surface)
+            except Exception:
+                self.buffer.writeError()
+                time.sleep(self.frame_interval)
+                continue
+            if not self.running:
+                # Stopped (and maybe replaced) while the camera was hanging
+                break
+
+            pixels = pygame.surfarray.pixels3d(self.surface)
+            timestamp = time.time()
+            self.buffer.write(pixels, timestamp)
+            for listener in self.listeners:
+                try:
+                    listener(pixels, timestamp)
+                except Exception:
+                    logger.exception('')
+            # Release the surface lock before the next get_image
+            del pixels
+        logger.info("Capture worker stopped")
+
+    '''
+    Register a function to be called as listener(pixels, timestamp) with every
+    captured frame. Listeners run on the capture thread, so keep them quick.
+    '''
+    def addFrameListener(self, listener):
+        self.listeners.append(listener)
+
+    '''
+    Stop capturing and wait for the thread to finish its current frame.
+    '''
+    def stop(self, timeout=2.0):
+        self.running = False
+        if self.is_alive():
+            self.join(timeout)
@@ -61,12 +61,29 @@ class Config(object):
         except:
             return None
     
+    def hasvalue(self, section, key):
+        if self.config == None:
+            return False
+        
+        return self.config.has_option(section, key)
+    
     def setvalue(self, section, key, value):
         if self.config == None:
             return
         
+        if not self.config.has_section(section):
+            self.config.add_section(section)
         self.config.set(section, key, value)
         
+    def removevalue(self, section, key):
+        if self.config == None:
+            return
+        
+        try:
+            self.config.remove_option(section, key)
+        except:
+            pass
+        
     def save(self):
         with open('config.cfg', 'wb') as configfile:
             self.config.write(configfile)
@@ -0,0 +1,120 @@
+'''
+Pre-ball deck checks.
+
+A first ball is only worth scoring if all ten pins were standing before it.
+When the pinsetter hasn't finished respotting, or the sweep bar is still down
+in front of the pins, the first ball read would silently count the missing
+pins as knocked down.
+
+The DeckValidator runs on every captured frame, like the BallDetector. It
+reads the pin regions to see whether the rack is full, and once a full rack
+has been seen for a few frames in a row the next first ball may be scored.
+When the rack isn't full it also compares a coarse grid of the deck with the
+last full rack it saw: a large part of the deck changing at once is something
+in front of the camera (the sweep, a mechanic) rather than fallen pins.
+'''
+
+import numpy
+
+DECK_VALID = 0      # Full rack, nothing in the way
+DECK_NOT_FULL = 1   # Some pins aren't standing
+DECK_OCCLUDED = 2   # Something big is covering the deck
+
+'''
+Raised when the deck can't be read because something is in front of the pins.
+'''
+class DeckBlocked(Exception):
+    pass
+
+class DeckValidator(object):
+
+    '''
+    Create a new deck validator.
+
+    pin_reader - Called as pin_reader(pixels) with a captured frame; returns
+                 the 10 pin standing flags for it
+    region - (x0, y0, x1, y1) area of the camera frame covering the deck
+    sample_step - Only every sample_step'th pixel in each direction is compared
+    change_level - Difference (0-255) from the full rack at which a grid cell
+                   counts as changed
+    occluded_fraction - Fraction of changed cells that means the deck is covered
+    full_frames - Frames in a row a full rack has to be seen before a first
+                  ball may be scored
+    '''
+    def __init__(self, pin_reader, region, sample_step=4, change_level=40.0, occluded_fraction=0.3, full_frames=3):
+        self.pin_reader = pin_reader
+        self.sample_step = max(1, sample_step)
+        self.change_level = change_level
+        self.occluded_fraction = occluded_fraction
+        self.full_frames = max(1, full_frames)
+
+        self.state = DECK_NOT_FULL
+        self.full_count = 0
+        self.rack_ready = False
+        self.changed_fraction = 0.0
+        self.setRegion(region)
+
+    '''
+    Change the watched area, eg. after the calibration points move. The full
+    rack seen so far no longer lines up, so it is forgotten.
+    '''
+    def setRegion(self, region):
+        self.region = tuple(int(v) for v in region)
+        self.baseline = None
+        self.diff = None
+
+    '''
+    Check one captured frame.
+
+    pixels - (width, height, channels) frame array
+    timestamp - Capture time of the frame in seconds
+    '''
+    def processFrame(self, pixels, timestamp):
+        x0, y0, x1, y1 = self.region
+        sample = pixels[x0:x1:self.sample_step, y0:y1:self.sample_step, 0]
+
+        if numpy.all(self.pin_reader(pixels)):
+            # Nothing big can be in front of the deck if every pin shows
+            if self.baseline is None or self.baseline.shape != sample.shape:
+                self.baseline = numpy.empty(sample.shape, dtype=numpy.int16)
+                self.diff = numpy.empty(sample.shape, dtype=numpy.int16)
+            self.baseline[...] = sample
+            self.changed_fraction = 0.0
+            self.state = DECK_VALID
+            self.full_count += 1
+            if self.full_count >= self.full_frames:
+                self.rack_ready = True
+            return
+
+        self.full_count = 0
+        if self.baseline is None or self.baseline.shape != sample.shape:
+            self.state = DECK_NOT_FULL
+            return
+
+        numpy.subtract(sample, self.baseline, out=self.diff)
+        numpy.abs(self.diff, out=self.diff)
+        self.changed_fraction = numpy.count_nonzero(self.diff >= self.change_level) / float(self.diff.size)
+        if self.changed_fraction >= self.occluded_fraction:
+            self.state = DECK_OCCLUDED
+        else:
+            self.state = DECK_NOT_FULL
+
+    '''
+    True if a full rack has been seen since the last ball was scored.
+    '''
+    def rackReady(self):
+        return self.rack_ready
+
+    '''
+    Forget the full rack once a ball has been scored; the next first ball
+    needs the pinsetter to respot first.
+    '''
+    def clearRack(self):
+        self.rack_ready = False
+        self.full_count = 0
+
+    '''
+    True if something is covering the deck in the newest frame.
+    '''
+    def occluded(self):
+        return self.state == DECK_OCCLUDED
@@ -0,0 +1,196 @@
+'''
+Array based pin detection.
+
+These routines look at the thresholded deck snapshot through pygame.surfarray
+and count the detect-colored pixels of every calibration region in one go,
+rather than walking a PixelArray pixel by pixel.
+'''
+
+import numpy
+import pygame
+import pygame.surfarray
+from autocalibrate import labelComponents
+
+'''
+Get a 2d (x, y) array of mapped pixel values for the given surface. This
+references the surface pixels directly when the pixel format allows it and
+falls back to a copy for 24 bit surfaces.
+'''
+def surfacePixels(surface):
+    try:
+        return pygame.surfarray.pixels2d(surface)
+    except ValueError:
+        return pygame.surfarray.array2d(surface)
+
+'''
+Count the pixels matching detect_color inside each calibration region.
+
+deck_surface - The thresholded (and resized) deck snapshot
+calibration - The CompiledCalibration describing each pin's region
+detect_color - The color that counts as a "hit" pixel
+
+Returns a numpy array holding the number of hit pixels for each pin.
+'''
+def countRoiHits(deck_surface, calibration, detect_color):
+    pixels = surfacePixels(deck_surface)
+    hits = calibration.countHits(pixels, deck_surface.map_rgb(detect_color))
+
+    # Release the surface lock held by the pixel reference
+    del pixels
+    return hits
+
+'''
+Count the hit pixels in each calibration region straight from raw camera
+frames, without building thresholded surfaces. Only the region pixels are
+looked at, picked from the full size frame the way the resized snapshot would
+have picked them. A pixel is a hit when every channel is within threshold of
+detect_color, a difference equal to the threshold included: the same test
+pygame.transform.threshold applies, so both process modes agree.
+
+frames - A (width, height, 3) frame or a (num_frames, width, height, 3) stack
+calibration - The CompiledCalibration describing each pin's region
+detect_color - Color the pins show up as
+threshold - Per channel distance from detect_color that still counts
+
+Returns a (num_frames, num_pins) array of hit counts.
+'''
+def countFrameHits(frames, calibration, detect_color, threshold):
+    if frames.ndim == 3:
+        frames = frames[numpy.newaxis]
+    xs, ys = calibration.sampleCoordinates(frames.shape[1:3])
+    return countSampleHits(frames[:, xs, ys], calibration, detect_color, threshold)
+
+'''
+Threshold already gathered region pixels and count the hits per pin.
+
+samples - (num_frames, num_region_pixels, 3) array, in calibration pixel order
+min_blob - If set, only hits in a connected blob of at least this many
+           pixels count (see countBlobMatches)
+
+Returns a (num_frames, num_pins) array of hit counts.
+'''
+def countSampleHits(samples, calibration, detect_color, threshold, min_blob=0):
+    samples = samples.astype(numpy.int16)
+    matches = (numpy.abs(samples - numpy.array(detect_color[:3], dtype=numpy.int16)) <= numpy.array(threshold[:3])).all(axis=2)
+    if min_blob > 0:
+        return countBlobMatches(matches, calibration, min_blob)
+    return calibration.sumRegions(matches)
+
+'''
+Count hits on a single channel of the region pixels, eg. the Y (luma) plane
+when the camera runs in YUV mode. Thresholding one byte per pixel through a
+256 entry lookup table touches a third of the memory of the full color test.
+
+samples - (num_frames, num_region_pixels) uint8 array of the chosen channel
+value, threshold - A pixel is a hit when abs(pixel - value) <= threshold
+
+Returns a (num_frames, num_pins) array of hit counts.
+'''
+def countChannelHits(samples, calibration, value, threshold, min_blob=0):
+    table = numpy.abs(numpy.arange(256) - int(value)) <= int(threshold)
+    if min_blob > 0:
+        return countBlobMatches(table[samples], calibration, min_blob)
+    return calibration.sumRegions(table[samples])
+
+'''
+Count only the hit pixels that belong to a connected (4-neighbour) blob of at
+least min_blob pixels, so a sprinkling of noise inside a region no longer
+adds up to a pin. The region pixels of every frame are put back in place on
+one mask, frames side by side with a blank column between them, and labeled
+in a single pass. Blobs are cut at the region edges since only region pixels
+were gathered.
+
+matches - (num_frames, num_region_pixels) boolean hits, in calibration pixel order
+
+Returns a (num_frames, num_pins) array of hit counts.
+'''
+def countBlobMatches(matches, calibration, min_blob):
+    x0, y0, x1, y1 = calibration.bounds()
+    xs = calibration.xs - x0
+    ys = calibration.ys - y0
+    num_frames = len(matches)
+
+    width = x1 - x0 + 1
+    frame_xs = xs + (numpy.arange(num_frames) * width)[:, numpy.newaxis]
+    frame_ys = numpy.repeat(ys[numpy.newaxis], num_frames, axis=0)
+    mask = numpy.zeros((num_frames * width, y1 - y0), dtype=bool)
+    mask[frame_xs[matches], frame_ys[matches]] = True
+
+    labels, count = labelComponents(mask)
+    big = numpy.bincount(labels.ravel(), minlength=count + 1) >= min_blob
+    big[0] = False
+    return calibration.sumRegions(big[labels[frame_xs, frame_ys]])
+
+'''
+Count the pixels matching detect_color inside each calibration region that
+are part of a connected blob of at least min_blob pixels. Unlike the region
+sample version, blobs may run outside the regions: the whole box around the
+regions is labeled.
+
+deck_surface - The thresholded (and resized) deck snapshot
+
+Returns a numpy array holding the number of hit pixels for each pin.
+'''
+def countBlobHits(deck_surface, calibration, detect_color, min_blob):
+    pixels = surfacePixels(deck_surface)
+    x0, y0, x1, y1 = calibration.bounds()
+    mask = pixels[x0:x1, y0:y1] == deck_surface.map_rgb(detect_color)
+    del pixels
+
+    labels, count = labelComponents(mask)
+    big = numpy.bincount(labels.ravel(), minlength=count + 1) >= min_blob
+    big[0] = False
+    hits = big[labels[calibration.xs - x0, calibration.ys - y0]]
+    return numpy.bincount(calibration.roi_index, weights=hits, minlength=len(calibration.points)).astype(numpy.intp)
+
+'''
+How sure each hit count is: the distance from the pin's threshold as a
+fraction of its region, so big and small regions compare. Positive means
+standing, negative down, and values near 0 are readings that a little noise
+could have flipped.
+
+hits - (num_frames, num_pins) hit counts
+thresholds - Hits per pin needed to count as standing
+areas - Pixels in each pin's region
+'''
+def pinConfidence(hits, thresholds, areas):
+    return (numpy.asarray(hits, dtype=numpy.float64) - thresholds) / areas
+
+'''
+Decide which pins are standing from several frames' worth of readings.
+
+standing - (num_frames, num_pins) boolean array of per-frame decisions
+mode - "majority" (standing in more than half the frames) or "hysteresis"
+previous - Pin states before this ball, used by hysteresis mode
+low, high - Hysteresis bounds: a standing pin needs a ratio below low to
+            count as down, a down pin needs at least high to count as standing
+
+Returns (standing, ratios) where ratios is the fraction of frames each pin
+was seen standing in.
+'''
+def votePinStates(standing, mode="majority", previous=None, low=0.3, high=0.7):
+    ratios = standing.mean(axis=0)
+    if mode == "hysteresis" and previous is not None:
+        return numpy.where(previous, ratios >= low, ratios >= high), ratios
+    return ratios > 0.5, ratios
+
+'''
+The original pixel by pixel detection loop. This is kept around as the
+reference implementation for the benchmark and as a fallback engine. It only
+knows about the plain calibration squares.
+'''
+def countRoiHitsPixelArray(deck_surface, points, point_size, detect_color):
+    deck_px_array = pygame.PixelArray(deck_surface)
+    hits = []
+
+    for px,py in points:
+        num_points_triggered = 0
+        for x in range(px, px + point_size + 1):
+            for y in range(py, py + point_size + 1):
+                if (deck_px_array[x][y] == deck_surface.map_rgb(detect_color)):
+                    # This pixel is white, so count that as a triggered pixel
+                    num_points_triggered += 1
+        hits.append(num_points_triggered)
+
+    del deck_px_array
+    return hits
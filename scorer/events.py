@@ -0,0 +1,18 @@
+'''
+Custom pygame event types posted by the scorer's background workers.
+
+Workers never touch the game state directly. They post one of these events and
+the main loop applies the result when the event comes around.
+'''
+
+import pygame
+
+# A pin count requested from the ScoringWorker is ready.
+# Attributes: pin_count, pin_mask (pins left standing, see pinmask), pin_confidence
+# (per pin, see PinCounter.confirmPinStates), first_ball, player, impact_time,
+# recorded_ball, pin_reading (see PinCounter.updatePinStatistics), error, deck_blocked
+SCORE_READY = pygame.USEREVENT + 1
+
+# The BallDetector saw a ball hit the deck and the pins settle.
+# Attributes: lane (of the PinCounter whose detector saw it), impact_time, settle_time
+BALL_DETECTED = pygame.USEREVENT + 2
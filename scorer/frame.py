@@ -3,34 +3,140 @@ Created on Apr 22, 2012
 
 @author: Jimmy
 '''
+from array import array
+
+ROLL_SLOTS = 21     # Two balls for frames 1-9, three for the 10th
+
+'''
+Everything bowled in one game: the pins of every ball in a fixed 21 slot
+layout (frame n's balls start at slot 2 * (n - 1), -1 for balls not bowled)
+and which frames' first balls left a split, as a bitmask.
+
+This is what gets saved, copied and processed in bulk; Frame objects are only
+views into it.
+'''
+class GameRolls(object):
+    __slots__ = ('rolls', 'split_mask')
+
+    def __init__(self, rolls=None, split_mask=0):
+        if rolls == None:
+            rolls = array('b', [-1] * ROLL_SLOTS)
+        self.rolls = rolls
+        self.split_mask = split_mask
+
+    def reset(self):
+        self.rolls[:] = array('b', [-1] * ROLL_SLOTS)
+        self.split_mask = 0
+
+    def copy(self):
+        return GameRolls(array('b', self.rolls), self.split_mask)
+
+    def __getstate__(self):
+        return (self.rolls.tostring(), self.split_mask)
+
+    def __setstate__(self, state):
+        self.rolls = array('b')
+        self.rolls.fromstring(state[0])
+        self.split_mask = state[1]
+
+'''
+A frame's balls as a list-like view of its slots in the GameRolls.
+'''
+class Shots(object):
+    __slots__ = ('rolls', 'start', 'count')
+
+    def __init__(self, rolls, start, count):
+        self.rolls = rolls
+        self.start = start
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if i < 0 or i >= self.count:
+            raise IndexError("shot index out of range")
+        return self.rolls[self.start + i]
+
+    def __setitem__(self, i, pinCount):
+        if i < 0:
+            i += self.count
+        if i < 0 or i >= self.count:
+            raise IndexError("shot index out of range")
+        self.rolls[self.start + i] = pinCount
+
+    def __iter__(self):
+        return iter(self.rolls[self.start:self.start + self.count])
+
+    def __contains__(self, pinCount):
+        return pinCount in self.rolls[self.start:self.start + self.count]
+
+    def index(self, pinCount):
+        return self.rolls[self.start:self.start + self.count].index(pinCount)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return repr(list(self))
 
 class Frame(object):
     '''
-    classdocs
+    A view of one frame of a GameRolls. The displayed score is kept on the
+    view; it is worked out from the rolls (see Player.ShowFrameScores).
     '''
+    __slots__ = ('number', 'game', 'shots', 'score', 'shouldDisplay')
 
-    #hasBowled = False   # Have we bowled this frame yet?
-    #number = 1          # Frame number
-    #shots = []          # List of shots
-
-    def __init__(self, number):
+    '''
+    number - Frame number (1-10)
+    game - The GameRolls this frame is part of; a frame on its own gets its own
+    '''
+    def __init__(self, number, game=None):
         '''
         Constructor
         '''
+        if game == None:
+            game = GameRolls()
         self.number = number
-        self.shots = []
+        self.game = game
+        if (number == 10):
+            self.shots = Shots(game.rolls, 18, 3)
+        else:
+            self.shots = Shots(game.rolls, 2 * (number - 1), 2)
         self.score = 0
         self.shouldDisplay = False
-        self.isSplit = False
         
-        if (number == 10):
-            self.shots.append(-1)
-            self.shots.append(-1)
-            self.shots.append(-1)
+    def getIsSplit(self):
+        return (self.game.split_mask >> (self.number - 1)) & 1 == 1
+    
+    def setIsSplit(self, isSplit):
+        if isSplit:
+            self.game.split_mask |= 1 << (self.number - 1)
         else:
-            self.shots.append(-1)
-            self.shots.append(-1)
-            
+            self.game.split_mask &= ~(1 << (self.number - 1))
+    
+    isSplit = property(getIsSplit, setIsSplit)
+    
+    '''
+    Frames saved before they became views carry their own shots; give them a
+    GameRolls of their own so Player can copy them into its game.
+    '''
+    def __setstate__(self, state):
+        self.__init__(state['number'], state.get('game'))
+        if 'game' not in state:
+            for i in range(len(self.shots)):
+                self.shots[i] = state['shots'][i]
+            self.isSplit = state.get('isSplit', False)
+        self.score = state.get('score', 0)
+        self.shouldDisplay = state.get('shouldDisplay', False)
+    
+    def __getstate__(self):
+        return {'number': self.number, 'game': self.game, 'score': self.score, 'shouldDisplay': self.shouldDisplay}
             
     def hasBowled(self):
         if self.number == 10:
@@ -0,0 +1,292 @@
+'''
+Frame sources.
+
+The capture worker doesn't care where frames come from as long as the source
+behaves like a pygame camera: start(), stop(), get_size() and
+get_image(surface). Besides the real camera there are sources that read still
+images from a directory, generate synthetic racks, follow a frame another
+process keeps writing to shared memory, or play back a recording. That lets
+the whole scoring pipeline run without a camera, and run as fast as detection
+allows instead of at webcam rate.
+
+The [Camera] source setting picks one (see createFrameSource).
+'''
+
+import os, struct, time, platform
+import numpy
+import pygame
+import pygame.camera
+import pygame.surfarray
+
+FRAME_SOURCES = ("camera", "images", "synthetic", "shm", "replay")
+
+'''
+Base class for everything that can stand in for a pygame camera.
+'''
+class FrameSource(object):
+
+    name = None
+
+    def __init__(self, size, fps=0):
+        self.size = tuple(size)
+        self.frame_interval = 1.0 / fps if fps > 0 else 0
+        self.next_frame_time = 0
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def get_size(self):
+        return self.size
+
+    def get_image(self, surface=None):
+        raise NotImplementedError()
+
+    '''
+    Sleep until the next frame is due, if the source is paced to a frame rate.
+    '''
+    def waitForNextFrame(self):
+        if self.frame_interval == 0:
+            return
+        now = time.time()
+        if self.next_frame_time > now:
+            time.sleep(self.next_frame_time - now)
+            now = self.next_frame_time
+        self.next_frame_time = now + self.frame_interval
+
+    '''
+    Copy a (width, height, 3) frame into surface (a new 32 bit surface when
+    none is given) and return it.
+    '''
+    def blitFrame(self, frame, surface=None):
+        if surface == None:
+            surface = pygame.Surface(self.size, 0, 32)
+        pygame.surfarray.blit_array(surface, frame)
+        return surface
+
+'''
+The scoring camera, through pygame.camera.
+
+index - Which of the cameras pygame finds to use
+size - Requested capture size
+'''
+class CameraSource(FrameSource):
+
+    name = "camera"
+
+    def __init__(self, index, size, mode="YUV"):
+        super(CameraSource, self).__init__(size)
+        pygame.camera.init()
+        self.camera_list = pygame.camera.list_cameras()
+
+        # On linux the device is a path like /dev/video0 rather than a number
+        if (platform.system() == "Windows"):
+            self.camera = pygame.camera.Camera(device=self.camera_list[index], size=size, mode=mode)
+        else:
+            self.camera = pygame.camera.Camera(self.camera_list[index], size, mode)
+
+    def start(self):
+        self.camera.start()
+
+    def stop(self):
+        self.camera.stop()
+
+    def get_size(self):
+        return self.camera.get_size()
+
+    def get_image(self, surface=None):
+        if surface == None:
+            return self.camera.get_image()
+        return self.camera.get_image(surface)
+
+'''
+Cycles through the images in a directory (anything pygame.image.load reads),
+in file name order. Every image is scaled to size and converted once up
+front. Video files aren't read directly; split them into stills first.
+'''
+class ImageDirectorySource(FrameSource):
+
+    name = "images"
+    EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tga")
+
+    def __init__(self, directory, size, fps=0, loop=True):
+        super(ImageDirectorySource, self).__init__(size, fps)
+        self.loop = loop
+        self.position = 0
+
+        names = sorted(n for n in os.listdir(directory) if os.path.splitext(n)[1].lower() in self.EXTENSIONS)
+        if len(names) == 0:
+            raise ValueError("No images found in %s" % directory)
+
+        self.frames = numpy.empty((len(names), self.size[0], self.size[1], 3), dtype=numpy.uint8)
+        for i in range(len(names)):
+            image = pygame.image.load(os.path.join(directory, names[i]))
+            if image.get_size() != self.size:
+                image = pygame.transform.scale(image, self.size)
+            self.frames[i] = pygame.surfarray.array3d(image)
+
+    def get_image(self, surface=None):
+        if self.position >= len(self.frames):
+            if not self.loop:
+                raise Exception("No more images")
+            self.position = 0
+        self.waitForNextFrame()
+        frame = self.frames[self.position]
+        self.position += 1
+        return self.blitFrame(frame, surface)
+
+'''
+Generates racks with random pins standing, drawn at the calibration points in
+detect_color over a noisy dark deck. A new random rack is drawn every
+rack_frames frames; standing holds the current one so results can be checked.
+
+points - Calibration points, already scaled to size
+'''
+class SyntheticSource(FrameSource):
+
+    name = "synthetic"
+    NOISE_FRAMES = 8
+
+    def __init__(self, size, points, point_size, detect_color, fps=0, rack_frames=30, seed=None):
+        super(SyntheticSource, self).__init__(size, fps)
+        self.points = list(points)
+        self.point_size = point_size
+        self.detect_color = numpy.array(detect_color, dtype=numpy.uint8)
+        self.rack_frames = max(1, rack_frames)
+        self.random = numpy.random.RandomState(seed)
+
+        # A few noise backgrounds are cheaper than fresh noise on every frame
+        self.backgrounds = self.random.randint(0, 60, (self.NOISE_FRAMES, self.size[0], self.size[1], 3)).astype(numpy.uint8)
+        self.frame = numpy.empty(self.backgrounds.shape[1:], dtype=numpy.uint8)
+        self.frame_count = 0
+        self.standing = [True] * len(self.points)
+
+    def get_image(self, surface=None):
+        self.waitForNextFrame()
+        if self.frame_count % self.rack_frames == 0:
+            self.standing = list(self.random.rand(len(self.points)) < 0.5)
+
+        self.frame[...] = self.backgrounds[self.frame_count % self.NOISE_FRAMES]
+        for i in range(len(self.points)):
+            if self.standing[i]:
+                px, py = self.points[i]
+                self.frame[max(0, px):px + self.point_size + 1, max(0, py):py + self.point_size + 1] = self.detect_color
+        self.frame_count += 1
+        return self.blitFrame(self.frame, surface)
+
+SHM_MAGIC = "OSSHM001"
+SHM_HEADER_FORMAT = "<8sIII"
+SHM_HEADER_SIZE = 32
+
+'''
+Map a shared frame file: returns the raw uint8 map, the uint32 sequence word
+and the (width, height, 3) frame view.
+'''
+def mapSharedFrame(path, size, mode):
+    total_size = SHM_HEADER_SIZE + size[0] * size[1] * 3
+    data = numpy.memmap(path, dtype=numpy.uint8, mode=mode, shape=(total_size,))
+    sequence = data[16:20].view(numpy.uint32)
+    frame = data[SHM_HEADER_SIZE:].reshape((size[0], size[1], 3))
+    return data, sequence, frame
+
+'''
+Producer side of the shared-memory feed, for whatever process owns the
+camera (or a test harness). The file, eg. /dev/shm/openscore, holds a small
+header and one frame. The sequence number in the header is odd while a frame
+is being written and even once it is complete.
+'''
+class SharedFrameWriter(object):
+
+    def __init__(self, path, size):
+        self.size = tuple(size)
+        self.data, self.sequence, self.frame = mapSharedFrame(path, self.size, "w+")
+        header = struct.pack(SHM_HEADER_FORMAT, SHM_MAGIC, self.size[0], self.size[1], 0)
+        self.data[:len(header)] = numpy.frombuffer(header, dtype=numpy.uint8)
+
+    def write(self, frame):
+        self.sequence[0] += 1
+        self.frame[...] = frame
+        self.sequence[0] += 1
+
+'''
+Reads frames another process publishes with a SharedFrameWriter. get_image
+waits (up to timeout seconds) for a frame newer than the last one returned,
+and retries if the writer touched the frame while it was being copied.
+'''
+class SharedMemorySource(FrameSource):
+
+    name = "shm"
+
+    def __init__(self, path, timeout=1.0):
+        with open(path, "rb") as infile:
+            magic, width, height, sequence = struct.unpack(SHM_HEADER_FORMAT, infile.read(struct.calcsize(SHM_HEADER_FORMAT)))
+        if magic != SHM_MAGIC:
+            raise ValueError("%s is not an OpenScore shared frame" % path)
+
+        super(SharedMemorySource, self).__init__((width, height))
+        self.timeout = timeout
+        self.data, self.sequence, self.shared_frame = mapSharedFrame(path, self.size, "r")
+        self.frame = numpy.empty(self.shared_frame.shape, dtype=numpy.uint8)
+        self.last_sequence = 0
+
+    def get_image(self, surface=None):
+        deadline = time.time() + self.timeout
+        while True:
+            before = int(self.sequence[0])
+            if before % 2 == 0 and before != self.last_sequence:
+                self.frame[...] = self.shared_frame
+                if int(self.sequence[0]) == before:
+                    self.last_sequence = before
+                    return self.blitFrame(self.frame, surface)
+            if time.time() > deadline:
+                raise Exception("No new shared frame")
+            time.sleep(0.001)
+
+'''
+Create the frame source selected by the [Camera] source setting:
+
+camera - The pygame camera (camera_number, size)
+images - Still images from the directory in source_path
+synthetic - Generated racks drawn at the calibration points
+shm - Frames another process writes to the file in source_path
+replay - A recording made with [Recording] enabled, from source_path
+
+Sources other than the camera are paced to [Camera] fps unless source_realtime
+is False, in which case they hand out frames as fast as they are asked for.
+
+config - The Config to read from, or a lane's LaneConfig so the synthetic
+         source draws that lane's calibration points
+deck_size - Size of the snapshot the calibration points are placed on
+'''
+def createFrameSource(config, deck_size):
+    source = config.getvalue_default("Camera", "source", "camera")
+    source_path = config.getvalue_default("Camera", "source_path", "")
+    size = config.gettuple("Camera", "size")
+    fps = int(config.getvalue_default("Camera", "fps", 30))
+    # source_realtime defaults to on, and getboolean reads a missing key as off
+    if (config.hasvalue("Camera", "source_realtime") and not config.getboolean("Camera", "source_realtime")):
+        fps = 0
+
+    if (source == "camera"):
+        return CameraSource(int(config.getvalue_default("Camera", "camera_number", 0)), size)
+    elif (source == "images"):
+        return ImageDirectorySource(source_path, size, fps)
+    elif (source == "synthetic"):
+        points = []
+        for i in range(1,11):
+            point = config.gettuple("Calibration", "point_" + str(i))
+            if point == None:
+                point = (-1,-1)
+            points.append((point[0] * size[0] // deck_size[0], point[1] * size[1] // deck_size[1]))
+        point_size = int(config.getvalue("Calibration", "point_size")) * size[0] // deck_size[0]
+        return SyntheticSource(size, points, point_size, config.gettuple("Camera", "detect_color"), fps)
+    elif (source == "shm"):
+        return SharedMemorySource(source_path)
+    elif (source == "replay"):
+        # Imported here since recording builds on this module
+        from recording import Recording, ReplayCamera
+        return ReplayCamera(Recording(source_path), realtime=(fps != 0))
+    else:
+        raise ValueError("Unknown frame source '%s'" % source)
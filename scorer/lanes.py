@@ -0,0 +1,108 @@
+'''
+Several lanes under one camera.
+
+A lane pair usually shares one overhead camera. [Camera] lanes names the
+lanes it covers and [Camera] lane the one a scorer shows and scores; the
+scorer only reads that lane, with that lane's calibration. Each lane has its
+own scorer: the one that opens the camera publishes every frame to
+[Camera] share_path, and the other one reads those frames with source = shm
+and source_path pointing at the same file, so the pair still only captures
+once. Their config.cfg files then only need to differ in [Camera] lane,
+eg. with [Camera.left] share_path = /dev/shm/openscore and [Camera.right]
+source = shm, source_path = /dev/shm/openscore.
+
+Lane settings live in their own config sections named after the base section
+and the lane, eg. [Calibration.left], [Camera.left] or [AutoScore.left].
+Anything a lane section doesn't set comes from the base section, except the
+points, polygons and per pin thresholds, which only make sense for one lane.
+'''
+
+import os
+
+# Sections a lane can override, and keys it never shares with the base section
+LANE_SECTIONS = ("Calibration", "Camera", "AutoScore", "DeckCheck")
+LANE_ONLY_KEYS = ("point_", "polygon_", "min_points_to_trigger_")
+
+'''
+The config section holding a lane's settings for a base section.
+'''
+def laneSection(section, lane):
+    if lane == None or section not in LANE_SECTIONS:
+        return section
+    return section + "." + lane
+
+'''
+A per lane version of a file name, eg. pinstats.npz -> pinstats_left.npz.
+'''
+def laneFileName(path, lane):
+    if lane == None:
+        return path
+    base, extension = os.path.splitext(path)
+    return base + "_" + lane + extension
+
+'''
+The lanes listed in [Camera] lanes, or [None] for a single lane camera.
+'''
+def configuredLanes(config):
+    lanes = [lane.strip() for lane in config.getvalue_default("Camera", "lanes", "").split(",") if lane.strip() != ""]
+    if len(lanes) == 0:
+        return [None]
+    return lanes
+
+'''
+A Config look-alike that reads and writes one lane's sections (see
+laneSection), falling back to the base sections for settings the lane
+doesn't have. With lane None it is a straight pass-through.
+'''
+class LaneConfig(object):
+
+    def __init__(self, config, lane=None):
+        self.config = config
+        self.lane = lane
+
+    '''
+    The section a setting is read from: the lane's if it has the key (or the
+    key is lane only), the base section otherwise.
+    '''
+    def readSection(self, section, key):
+        lane_section = laneSection(section, self.lane)
+        if lane_section == section:
+            return section
+        if self.config.hasvalue(lane_section, key) or key.startswith(LANE_ONLY_KEYS):
+            return lane_section
+        return section
+
+    def getvalue(self, section, key):
+        return self.config.getvalue(self.readSection(section, key), key)
+
+    def getvalue_default(self, section, key, default_value):
+        return self.config.getvalue_default(self.readSection(section, key), key, default_value)
+
+    def getboolean(self, section, key):
+        return self.config.getboolean(self.readSection(section, key), key)
+
+    def gettuple(self, section, key):
+        return self.config.gettuple(self.readSection(section, key), key)
+
+    def hasvalue(self, section, key):
+        return self.config.hasvalue(self.readSection(section, key), key)
+
+    '''
+    A file name setting, made per lane (see laneFileName) when it comes from
+    the base section so lanes don't overwrite each other's files.
+    '''
+    def getfilename(self, section, key, default_value):
+        read_section = self.readSection(section, key)
+        path = self.config.getvalue_default(read_section, key, default_value)
+        if read_section == section:
+            return laneFileName(path, self.lane)
+        return path
+
+    def setvalue(self, section, key, value):
+        self.config.setvalue(laneSection(section, self.lane), key, value)
+
+    def removevalue(self, section, key):
+        self.config.removevalue(laneSection(section, self.lane), key)
+
+    def save(self):
+        self.config.save()
@@ -0,0 +1,120 @@
+'''
+Automatic ball detection.
+
+The BallDetector watches the part of the camera frame covering the pin deck.
+A ball hitting the rack shows up as a big jump in the difference between
+consecutive frames; once the difference has stayed low for a little while the
+pins have stopped moving and the deck can be scored.
+
+The frames are compared on a coarse grid (every sample_step pixels of the first
+channel, which is the luma plane when the camera runs in YUV mode), so the
+check is cheap enough to run on every captured frame.
+'''
+
+import numpy
+
+MOTION_WAITING = 0  # Deck is still, waiting for a ball
+MOTION_MOVING = 1   # Something hit the deck, waiting for it to settle
+MOTION_COOLDOWN = 2 # Just scored, ignoring the pinsetter cycle
+
+class BallDetector(object):
+
+    '''
+    Create a new ball detector.
+
+    region - (x0, y0, x1, y1) area of the camera frame to watch
+    callback - Called as callback(impact_time, settle_time) when a ball has settled
+    sample_step - Only every sample_step'th pixel in each direction is compared
+    impact_level - Mean frame difference (0-255) that counts as a ball hitting
+    still_level - Mean frame difference below which the deck counts as still
+    settle_time - Seconds the deck has to stay still before scoring
+    cooldown - Seconds to ignore motion after scoring (sweep and respot)
+    score_on_impact - Call back as soon as the ball hits instead of waiting for
+                      the deck to settle, for scorers that follow the pins
+                      falling themselves (burst mode)
+    '''
+    def __init__(self, region, callback, sample_step=4, impact_level=12.0, still_level=3.0, settle_time=0.5, cooldown=8.0,
+                 score_on_impact=False):
+        self.callback = callback
+        self.sample_step = max(1, sample_step)
+        self.impact_level = impact_level
+        self.still_level = still_level
+        self.settle_time = settle_time
+        self.cooldown = cooldown
+        self.score_on_impact = score_on_impact
+
+        self.state = MOTION_WAITING
+        self.level = 0.0
+        self.impact_time = None
+        self.still_since = None
+        self.cooldown_until = 0
+        self.setRegion(region)
+
+    '''
+    Change the watched area, eg. after the calibration points move.
+    '''
+    def setRegion(self, region):
+        self.region = tuple(int(v) for v in region)
+        self.previous = None
+        self.diff = None
+
+    '''
+    Feed one captured frame to the detector.
+
+    pixels - (width, height, channels) frame array
+    timestamp - Capture time of the frame in seconds
+    '''
+    def processFrame(self, pixels, timestamp):
+        x0, y0, x1, y1 = self.region
+        sample = pixels[x0:x1:self.sample_step, y0:y1:self.sample_step, 0]
+
+        if self.previous is None or self.previous.shape != sample.shape:
+            self.previous = sample.astype(numpy.int16)
+            self.diff = numpy.empty(sample.shape, dtype=numpy.int16)
+            return
+
+        numpy.subtract(sample, self.previous, out=self.diff)
+        numpy.abs(self.diff, out=self.diff)
+        self.previous[...] = sample
+        self.level = self.diff.mean()
+
+        self.update(self.level, timestamp)
+
+    '''
+    Advance the detector state with the difference level of a new frame.
+    '''
+    def update(self, level, timestamp):
+        if self.state == MOTION_COOLDOWN:
+            if timestamp >= self.cooldown_until:
+                self.state = MOTION_WAITING
+            return
+
+        if self.state == MOTION_WAITING:
+            if level >= self.impact_level:
+                self.state = MOTION_MOVING
+                self.impact_time = timestamp
+                self.still_since = None
+                if self.score_on_impact:
+                    self.state = MOTION_COOLDOWN
+                    self.cooldown_until = timestamp + self.cooldown
+                    self.callback(timestamp, timestamp)
+            return
+
+        # MOTION_MOVING
+        if level > self.still_level:
+            self.still_since = None
+        elif self.still_since == None:
+            self.still_since = timestamp
+        elif timestamp - self.still_since >= self.settle_time:
+            self.state = MOTION_COOLDOWN
+            self.cooldown_until = timestamp + self.cooldown
+            self.callback(self.impact_time, timestamp)
+
+    '''
+    Forget any motion in progress, eg. when the game is reset.
+    '''
+    def reset(self):
+        self.state = MOTION_WAITING
+        self.impact_time = None
+        self.still_since = None
+        self.previous = None
@@ -0,0 +1,71 @@
+'''
+Pin deck states as bitmasks.
+
+A deck is stored as a 10 bit integer with bit i set when pin i + 1 is
+standing, so the full rack is FULL_RACK (0x3FF) and an empty deck is 0. Set
+operations then answer the scoring questions directly: the pins a second ball
+knocked down are leave & ~standing, and a pin "coming back" shows up as
+standing & ~leave.
+'''
+
+FULL_RACK = 0x3FF
+
+# Number of set bits of every possible deck
+PIN_COUNTS = tuple(bin(mask).count("1") for mask in range(FULL_RACK + 1))
+
+'''
+Build a mask from a sequence of 10 standing flags (pin 1 first).
+'''
+def maskFromStates(standing):
+    mask = 0
+    for i in range(len(standing)):
+        if standing[i]:
+            mask |= 1 << i
+    return mask
+
+'''
+The 10 standing flags of a mask, pin 1 first.
+'''
+def statesFromMask(mask):
+    return [(mask >> i) & 1 == 1 for i in range(10)]
+
+'''
+Build a mask from pin numbers (1-10).
+'''
+def maskFromPins(pins):
+    mask = 0
+    for pin in pins:
+        mask |= 1 << (pin - 1)
+    return mask
+
+'''
+The numbers (1-10) of the pins standing in a mask.
+'''
+def pinsFromMask(mask):
+    return tuple(i + 1 for i in range(10) if (mask >> i) & 1)
+
+'''
+Number of pins standing in a mask.
+'''
+def countPins(mask):
+    return PIN_COUNTS[mask & FULL_RACK]
+
+'''
+True if pin (1-10) is standing in the mask.
+'''
+def isStanding(mask, pin):
+    return (mask >> (pin - 1)) & 1 == 1
+
+'''
+The mask standing after a ball whose pin count is known (eg. from a score
+correction), when the count alone settles which pins fell: none of them or
+all of them. Returns None when it doesn't.
+
+previous - Mask standing before the ball
+'''
+def standingAfterCount(previous, count):
+    if count == 0:
+        return previous
+    if count == countPins(previous):
+        return 0
+    return None
@@ -0,0 +1,111 @@
+'''
+Per-pin detection statistics.
+
+Every ball read adds each pin's hit ratio (hit pixels / region pixels) to one
+of two running histograms for that pin: one for readings where the pin was
+standing, one where it was down. Only readings whose label can be trusted (a
+score correction, or a reading well clear of the threshold) should go in,
+otherwise the histograms just repeat the current thresholds. The best
+decision threshold for a pin is the ratio that misclassifies the fewest of
+those readings, which falls out of the cumulative sums of the two histograms
+for all ten pins at once.
+
+Back row pins sit further from the camera and cover fewer pixels, so their
+thresholds usually end up well away from the front pins'.
+'''
+
+import os
+import numpy
+
+class PinStatistics(object):
+
+    BINS = 64
+
+    '''
+    num_pins - Number of pins tracked
+    bins - Histogram resolution over the 0..1 hit ratio range
+    decay - Factor applied to the existing counts on every ball (1 keeps
+            everything, slightly less than 1 lets old readings fade out)
+    '''
+    def __init__(self, num_pins=10, bins=BINS, decay=1.0):
+        self.bins = bins
+        self.decay = decay
+        self.standing = numpy.zeros((num_pins, bins))
+        self.down = numpy.zeros((num_pins, bins))
+
+    '''
+    Add one ball's readings.
+
+    ratios - Hit ratio (0..1) of every pin
+    standing - Whether each pin was standing
+    known - Which pins' standing flags can be trusted, all of them if not
+            given; the other pins' readings are left out
+    '''
+    def add(self, ratios, standing, known=None):
+        standing = numpy.asarray(standing, dtype=bool)
+        bins = numpy.clip((numpy.asarray(ratios) * self.bins).astype(numpy.intp), 0, self.bins - 1)
+        pins = numpy.arange(len(bins))
+        if known is None:
+            known = numpy.ones(len(bins), dtype=bool)
+        else:
+            known = numpy.asarray(known, dtype=bool)
+
+        if self.decay < 1.0:
+            self.standing *= self.decay
+            self.down *= self.decay
+        self.standing[pins[standing & known], bins[standing & known]] += 1
+        self.down[pins[~standing & known], bins[~standing & known]] += 1
+
+    '''
+    Number of standing and down readings per pin, as (standing, down).
+    '''
+    def counts(self):
+        return self.standing.sum(axis=1), self.down.sum(axis=1)
+
+    '''
+    Work out the hit ratio threshold for every pin.
+
+    min_samples - Readings needed of both standing and down before a pin gets a
+                  threshold of its own
+
+    Returns an array with one ratio per pin (a pin counts as standing at or
+    above it), NaN for pins without enough readings yet.
+    '''
+    def thresholds(self, min_samples=20):
+        num_pins = len(self.standing)
+        zeros = numpy.zeros((num_pins, 1))
+
+        # errors[:, k] is the number of readings a threshold at bin edge k gets wrong
+        standing_below = numpy.hstack((zeros, numpy.cumsum(self.standing, axis=1)))
+        down_below = numpy.hstack((zeros, numpy.cumsum(self.down, axis=1)))
+        errors = standing_below + (down_below[:, -1:] - down_below)
+
+        # Pick the middle of the best range, ie. halfway across the gap between the classes
+        lowest = errors.min(axis=1)[:, numpy.newaxis]
+        first = numpy.argmax(errors == lowest, axis=1)
+        last = errors.shape[1] - 1 - numpy.argmax((errors == lowest)[:, ::-1], axis=1)
+        ratios = (first + last) / 2.0 / self.bins
+
+        standing_count, down_count = self.counts()
+        enough = (standing_count >= min_samples) & (down_count >= min_samples)
+        return numpy.where(enough, ratios, numpy.nan)
+
+    def reset(self):
+        self.standing[...] = 0
+        self.down[...] = 0
+
+    def save(self, path):
+        numpy.savez(path, standing=self.standing, down=self.down)
+
+    '''
+    Load histograms written by save(). Returns False if there was no usable file.
+    '''
+    def load(self, path):
+        if not os.path.exists(path):
+            return False
+        data = numpy.load(path)
+        if data["standing"].shape != self.standing.shape:
+            return False
+        self.standing[...] = data["standing"]
+        self.down[...] = data["down"]
+        return True
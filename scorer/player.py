@@ -8,8 +8,10 @@ import sys, re
 from pygame.locals import *
 import math
 import splits
+import progression
 
-from frame import Frame
+from frame import Frame, GameRolls
+from scoring import ScoreSheet
 
 '''
 Handles all player information including name and frame data.
@@ -42,7 +44,6 @@ class Player(object):
         
         self.name = name
         self.number = number
-        self.frames = []
         self.current_frame = 0
         self.current_roll = 0
         self.score_font = pygame.font.SysFont("Arial", 36, True)
@@ -52,126 +53,106 @@ class Player(object):
         self.truScore = 0
         self.frames_completed_this_turn = 0
         
-        self.rolls = [-1] * 21
-        
-        for i in range(10):
-            f = Frame(i + 1)
-            self.frames.append(f)
+        self.game = GameRolls()
+        self.sheet = ScoreSheet()
+        self.state = progression.START
+        self.makeFrames()
     
+    '''
+    The frames are views of self.game and the scores follow from it, so only the
+    game itself is saved.
+    '''
     def __getstate__(self):
         odict = self.__dict__.copy()
         del odict['bowling_scorer']
         del odict['score_font']
+        del odict['frames']
+        del odict['sheet']
         return odict
     
     def __setstate__(self, dict):
         self.__dict__.update(dict)
         self.score_font = pygame.font.SysFont("Arial", 36, True)
+        if 'game' not in dict:
+            # Saved when every frame kept its own shots
+            self.game = GameRolls()
+            for old in dict['frames']:
+                f = Frame(old.number, self.game)
+                for i in range(len(f.shots)):
+                    f.shots[i] = old.shots[i]
+                f.isSplit = old.isSplit
+            self.__dict__.pop('rolls', None)
+        self.sheet = ScoreSheet()
+        self.makeFrames()
+        self.UpdateFrameScores()
+    
+    def makeFrames(self):
+        self.frames = [Frame(i + 1, self.game) for i in range(10)]
     
     '''
     Resets all player data to default settings. This is used to clear
     player data for a new game
     '''
     def reset(self):
-        del self.frames[:]
         self.current_frame = 0
         self.current_roll = 0
         self.current_score = ""
         self.frames_completed_this_turn = 0
-        self.rolls = [-1] * 21
-        self.truScore = 0
+        self.state = progression.START
         # Blank out all frame data
-        for i in range(10):
-            f = Frame(i + 1)
-            self.frames.append(f)
+        self.game.reset()
+        self.sheet.reset()
+        self.ShowFrameScores(0)
         
     '''
     Adds a shot to the current player's game.
     
     The argument 'pinCount' is the number of pins scored to add to the current frame.
+    'deck_state' is the mask of pins left standing (see pinmask), used to mark splits.
     
-    Since the sum of 'shots' in a frame can only equal a max of 10, this function
-    handles the logic of making sure each frame's shots only sum to ten.
+    The progression state machine decides which frame and ball this is, applies
+    no-tap, and makes sure each frame's shots only sum to ten.
     IE: a 9/ shows up here as '9 1'
+    
+    Returns the pins the ball counted for and the progression events it caused
+    (see progression.EVENT_*); BowlingScorer.ball_scored moves the game along.
     '''
     def addShot(self, pinCount, deck_state):
-        self.rolls[self.current_roll] = pinCount
+        machine = progression.getProgression(self.bowling_scorer.frames_per_turn, self.bowling_scorer.min_pincount_strike)
+        first_ball = machine.ball[self.state] == 0
+        self.state, pinCount, slot, events = machine.step(self.state, pinCount)
+        if slot == progression.NO_SLOT:
+            return 0, 0
         
-        if (self.current_frame == 9):
-            if self.frames[self.current_frame].shots[0] == -1:
-                self.frames[self.current_frame].shots[0] = pinCount
-                self.frames[self.current_frame].isSplit = splits.isSplit(deck_state)
-            elif self.frames[self.current_frame].shots[1] == -1:
-                if pinCount == 10 and self.frames[self.current_frame].shots[0] != 10:
-                    self.frames[self.current_frame].shots[1] = 10 - self.frames[self.current_frame].shots[0]
-                else:
-                    self.frames[self.current_frame].shots[1] = pinCount
-            elif self.frames[self.current_frame].shots[2] == -1:
-                if pinCount == 10 and self.frames[self.current_frame].shots[1] != 10 and \
-                self.frames[self.current_frame].shots[0] + self.frames[self.current_frame].shots[1] != 10 and \
-                self.frames[self.current_frame].shots[0] != 0:
-                    self.frames[self.current_frame].shots[2] = 10 - self.frames[self.current_frame].shots[1]
-                else:
-                    self.frames[self.current_frame].shots[2] = pinCount
-        else:
-            if (self.frames[self.current_frame].shots[0] != -1 and \
-                self.frames[self.current_frame].shots[0] != 10 and \
-                pinCount == 10):
-                self.frames[self.current_frame].shots[1] = 10 - self.frames[self.current_frame].shots[0]
-            elif (self.frames[self.current_frame].shots[0] == -1):
-                self.frames[self.current_frame].shots[0] = pinCount
-                self.frames[self.current_frame].isSplit = splits.isSplit(deck_state)
-            elif (self.frames[self.current_frame].shots[1] == -1):
-                self.frames[self.current_frame].shots[1] = pinCount
-            elif (self.current_frame == 9):
-                self.frames[self.current_frame].shots[2] = pinCount
-            
-        if (self.frames[self.current_frame].hasBowled()):
-            self.bowling_scorer.is_first_ball = True
-            self.current_score = str(self.score(self.getGameString()))
-            #self.frames[self.current_frame].score = self.current_score
-            self.UpdateFrameScores()
-            
-            self.frames_completed_this_turn += 1
-            if (self.frames_completed_this_turn == self.bowling_scorer.frames_per_turn or self.current_frame == 9):
-                self.bowling_scorer.next_player()
-                self.frames_completed_this_turn = 0
-                
-            self.bowling_scorer.end_game_if_over()
-        elif self.current_frame == 9 and \
-        self.frames[self.current_frame].shots[0] == 10 and \
-        self.frames[self.current_frame].shots[1] == -1:
-            self.bowling_scorer.is_first_ball = True
-        elif self.current_frame == 9 and \
-        self.frames[self.current_frame].shots[0] == 10 and \
-        self.frames[self.current_frame].shots[1] == 10 and \
-        self.frames[self.current_frame].shots[2] == -1:
-            self.bowling_scorer.is_first_ball = True
-        elif self.current_frame == 9 and \
-        self.frames[self.current_frame].shots[0] + self.frames[self.current_frame].shots[1] == 10 and \
-        self.frames[self.current_frame].shots[2] == -1:
-            self.bowling_scorer.is_first_ball = True
-        else:
-            self.bowling_scorer.is_first_ball = False
-            
-        if (self.current_frame < 9 and self.frames[self.current_frame].hasBowled()):
-            self.current_frame += 1
-            
-        self.current_roll += 1
+        self.game.rolls[slot] = pinCount
+        if first_ball:
+            self.frames[self.current_frame].isSplit = splits.isSplit(deck_state)
         
-        if self.bowling_scorer.current_player != -1:
-            self.bowling_scorer.dump_current_state()
+        frames_final = self.sheet.frames_final
+        if self.sheet.addRoll(pinCount) > 0:
+            self.ShowFrameScores(frames_final)
+        if events & progression.EVENT_FRAME_COMPLETE:
+            self.current_score = str(self.sheet.closed_total)
         
-    '''
-    A half-assed attempt at score calculation 'per-frame'. This needs to be re-written.
+        self.current_frame = machine.frame[self.state]
+        self.frames_completed_this_turn = progression.stateTurn(self.state)
+        self.current_roll += 1
+        return pinCount, events
     
-    Basically calculates the score through a given frame. This screws up on marks
-    but works otherwise.
     '''
-    def calcScoreThruFrame(self, thru_frame):
-        game_str = self.getGameString(thru_frame)
-        return self.score(game_str)
+    Finds where the game has got to from the frames, eg. after they were restored
+    or corrected. The frames already bowled this turn are kept.
+    '''
+    def syncState(self):
+        self.state = progression.replay(self.game.rolls, self.frames_completed_this_turn)
+        self.current_frame = progression.POSITIONS[progression.statePosition(self.state)][0]
     
+    '''
+    True once the player has finished their 10th frame.
+    '''
+    def isFinished(self):
+        return progression.isFinished(self.state)
+        
     '''
     Get the visual representation of the game optionally through the given frame.
     '''
@@ -194,21 +175,32 @@ class Player(object):
     is made.
     '''
     def Refresh(self):
-        self.current_score = str(self.score(self.getGameString()))
+        self.current_score = str(self.sheet.closed_total)
         
     '''
-    Iterates through all frames and sets the score at that particular point in the game
-    for each frame.
-    
-    This needs to be re-written... badly.
+    Rescores the game from the frames and sets the score at that particular point
+    in the game for each frame. Only needed when frames were edited directly (a
+    score correction); addShot keeps the scores up to date ball by ball.
     '''
     def UpdateFrameScores(self):
-        self.calculate()
-        #for f in self.frames:
-        #    if (f.hasBowled()):
-        #        f.score = self.calcScoreThruFrame(f.number)
-        #        if not f.isStrike() and not f.isSpare():
-        #            f.score = self.calcScoreThruFrame(f.number)
+        self.sheet.reset()
+        self.sheet.addFrames(self.frames)
+        self.ShowFrameScores(0)
+        self.syncState()
+        
+    '''
+    Copies the score sheet's cumulative scores onto the frames, starting at the
+    given frame index. Frames whose score isn't final yet show no score.
+    '''
+    def ShowFrameScores(self, first_frame):
+        for i in range(first_frame, 10):
+            f = self.frames[i]
+            f.shouldDisplay = self.sheet.final[i]
+            if f.shouldDisplay:
+                f.score = self.sheet.cumulative[i]
+            else:
+                f.score = 0
+        self.truScore = self.sheet.total
                             
     def GetFrameMarkBonus(self, current_frame_idx, frames):
         if (current_frame_idx < 8):
@@ -270,7 +262,7 @@ class Player(object):
             textpos = text.get_rect(x=136 + (i * 62) + xscew, y=47 + (self.number * 133) + yscew)
             surface.blit(text, textpos)
             
-            # This is broken as crap, so we're not going to enable it
+            # The 10th frame's score is the total, drawn below
             if (f.shouldDisplay and f.number != 10):
                 text = self.score_font.render(str(f.score), 1, (255, 255, 255))
                 textpos = text.get_rect(x=136 + (i * 62) + xscew, y=92 + (self.number * 133) + yscew)
@@ -288,6 +280,9 @@ class Player(object):
             surface.blit(score_text, score_text_pos)
             
     '''
+    The string based scoring below predates the score sheet. It rebuilds the whole
+    game on every call and is only kept to cross check the sheet (see benchmark.py).
+    
     A wicked cool anonymous function to parse each frame's data from a string
     using a regex.
     '''
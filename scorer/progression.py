@@ -0,0 +1,180 @@
+'''
+Ball, frame and turn progression as a precomputed state machine.
+
+Where a player is in their game is one small integer: the frame, the ball of
+the frame, how many pins are standing, whether the 10th frame earned its fill
+ball, and how many frames the player has bowled this turn. Every state and
+every possible pin count (0-10) is worked out once, so scoring a ball is a
+lookup of:
+
+  - the next state,
+  - the pins the ball counts for (no-tap applied, and never more than were
+    standing; a pin counter reading 10 on a second ball means "the rest"),
+  - the GameRolls slot the ball is written to,
+  - and the events it causes (EVENT_*).
+
+Machines are shared between players and cached per frames per turn and no-tap
+setting (see getProgression). State numbers mean the same in every machine,
+so a saved game carries on whatever the settings are now.
+'''
+
+EVENT_FRAME_COMPLETE = 1    # The ball finished a frame
+EVENT_TURN_OVER = 2         # The next ball is the next player's
+EVENT_GAME_OVER = 4         # The ball finished this player's 10th frame
+EVENT_NEW_RACK = 8          # The next ball is thrown at a full rack
+
+PIN_INPUTS = 11             # A ball knocks down 0-10 pins
+
+NO_SLOT = -1
+
+'''
+Every position within a game, as (frame, ball, standing, fill) with fill True
+once the 10th frame has earned its fill ball. The last position is the
+finished game.
+'''
+def enumeratePositions():
+    positions = []
+    for frame in range(10):
+        positions.append((frame, 0, 10, False))
+        for standing in range(1, 11):
+            positions.append((frame, 1, standing, False))
+    positions.append((9, 1, 10, True))
+    for standing in range(1, 11):
+        positions.append((9, 2, standing, True))
+    positions.append((9, 3, 0, False))
+    return positions
+
+POSITIONS = enumeratePositions()
+FINISHED = len(POSITIONS) - 1
+START = 0   # First ball of the game, first frame of the turn
+
+def makeState(position, turn):
+    return turn * len(POSITIONS) + position
+
+def statePosition(state):
+    return state % len(POSITIONS)
+
+def stateTurn(state):
+    return state // len(POSITIONS)
+
+def isFinished(state):
+    return statePosition(state) == FINISHED
+
+'''
+True if the pinsetter puts up a full rack for the ball at a position (a gutter
+ball leaves ten pins standing, but it isn't a new rack).
+'''
+def isNewRack(position):
+    frame, ball, standing, fill = position
+    return ball == 0 or (fill and standing == 10)
+
+class Progression(object):
+
+    '''
+    frames_per_turn - Frames a player bowls before the next player is up
+    no_tap - Pins that count as a strike on a full rack (10 for regular bowling)
+    '''
+    def __init__(self, frames_per_turn=1, no_tap=10):
+        self.frames_per_turn = max(1, frames_per_turn)
+        self.no_tap = no_tap
+
+        index = dict((position, i) for i, position in enumerate(POSITIONS))
+        states = len(POSITIONS) * self.frames_per_turn
+        self.next_state = [0] * (states * PIN_INPUTS)
+        self.pins = [0] * (states * PIN_INPUTS)
+        self.slot = [NO_SLOT] * (states * PIN_INPUTS)
+        self.events = [0] * (states * PIN_INPUTS)
+        self.frame = [0] * states
+        self.ball = [0] * states
+        self.new_rack = [False] * states
+
+        for position in range(len(POSITIONS)):
+            frame, ball, standing, fill = POSITIONS[position]
+            for turn in range(self.frames_per_turn):
+                state = makeState(position, turn)
+                self.frame[state] = frame
+                self.ball[state] = ball
+                self.new_rack[state] = isNewRack(POSITIONS[position]) or position == FINISHED
+                for pins in range(PIN_INPUTS):
+                    i = state * PIN_INPUTS + pins
+                    if position == FINISHED:
+                        self.next_state[i] = state
+                        self.pins[i] = 0
+                        continue
+                    counted, next_position, events = self.advance(POSITIONS[position], pins)
+                    next_turn = turn
+                    if events & EVENT_FRAME_COMPLETE:
+                        next_turn += 1
+                        if next_turn == self.frames_per_turn or frame == 9:
+                            events |= EVENT_TURN_OVER
+                            next_turn = 0
+                    next_position = index[next_position]
+                    if next_position == FINISHED or isNewRack(POSITIONS[next_position]):
+                        events |= EVENT_NEW_RACK
+                    self.next_state[i] = makeState(next_position, next_turn)
+                    self.pins[i] = counted
+                    self.slot[i] = 2 * frame + ball
+                    self.events[i] = events
+
+    '''
+    Where one ball takes a player, ignoring turns. Returns (pins counted,
+    next position, events).
+    '''
+    def advance(self, position, pins):
+        frame, ball, standing, fill = position
+        if isNewRack(position) and pins >= self.no_tap:
+            pins = 10
+        pins = min(pins, standing)
+        left = standing - pins
+
+        if frame < 9:
+            if ball == 0 and left > 0:
+                return pins, (frame, 1, left, False), 0
+            return pins, (frame + 1, 0, 10, False), EVENT_FRAME_COMPLETE
+
+        if ball == 0:
+            if left == 0:
+                return pins, (9, 1, 10, True), 0
+            return pins, (9, 1, left, False), 0
+        if ball == 1 and (fill or left == 0):
+            if left == 0:
+                left = 10
+            return pins, (9, 2, left, True), 0
+        return pins, POSITIONS[FINISHED], EVENT_FRAME_COMPLETE | EVENT_GAME_OVER
+
+    '''
+    Score one ball. Returns (next state, pins counted, GameRolls slot, events);
+    the slot is NO_SLOT once the game is finished.
+    '''
+    def step(self, state, pins):
+        i = state * PIN_INPUTS + pins
+        return self.next_state[i], self.pins[i], self.slot[i], self.events[i]
+
+progressions = {}
+
+'''
+The shared Progression for a frames per turn and no-tap setting.
+'''
+def getProgression(frames_per_turn, no_tap=10):
+    key = (frames_per_turn, no_tap)
+    if key not in progressions:
+        progressions[key] = Progression(frames_per_turn, no_tap)
+    return progressions[key]
+
+'''
+The state a game's rolls (see GameRolls) have got to, eg. after restoring a
+saved game or a score correction. The rolls were counted when they were
+bowled, so no-tap isn't applied again.
+
+turn - Frames the player has already bowled this turn
+'''
+def replay(rolls, turn=0):
+    progression = getProgression(1)
+    state = START
+    while not isFinished(state):
+        i = state * PIN_INPUTS
+        pins = rolls[progression.slot[i]]
+        if pins == -1:
+            break
+        state = progression.next_state[i + pins]
+    return makeState(statePosition(state), turn)
@@ -0,0 +1,241 @@
+'''
+Recording and replay of camera frames.
+
+A recording is two files:
+
+ - name.osr holds the frames. It starts with a fixed 64 byte header (magic,
+   width, height, channels, capacity, frame count), followed by one float64
+   capture timestamp per frame and then the raw frames, each one a
+   (width, height, channels) uint8 block in surfarray order. The file is
+   allocated up front and memory-mapped, so both writing and replaying a frame
+   is a plain array copy.
+
+ - name.events is a text file with one JSON object per line describing what
+   happened: each ball read (which frames it used and the pin states detected),
+   which player/frame/shot the ball was scored to, and any manual score
+   corrections made afterwards.
+
+FrameRecorder writes recordings, Recording opens them again and ReplayCamera
+plays one back as a frame source.
+'''
+
+import os, struct, json, time, threading
+import numpy
+import pygame
+import pygame.surfarray
+from framesource import FrameSource
+
+RECORDING_MAGIC = "OSREC001"
+HEADER_FORMAT = "<8sIIIII"
+HEADER_SIZE = 64
+
+'''
+Work out where the timestamp index and the frames start in a recording file,
+and how big the whole file is.
+'''
+def recordingLayout(size, channels, capacity):
+    index_offset = HEADER_SIZE
+    frames_offset = index_offset + capacity * 8
+    total_size = frames_offset + capacity * size[0] * size[1] * channels
+    return index_offset, frames_offset, total_size
+
+'''
+Derive the events file name from a recording's frame file name.
+'''
+def eventsPath(path):
+    return os.path.splitext(path)[0] + ".events"
+
+'''
+Writes camera frames and ball events to a new recording.
+
+path - File to create (an existing file is overwritten)
+size - (width, height) of the frames
+capacity - Maximum number of frames; once full, further frames are dropped
+'''
+class FrameRecorder(object):
+
+    def __init__(self, path, size, capacity=2000, channels=3):
+        self.path = path
+        self.size = tuple(size)
+        self.channels = channels
+        self.capacity = capacity
+        self.frame_count = 0
+        self.ball_count = 0
+        self.lock = threading.Lock()
+
+        index_offset, frames_offset, total_size = recordingLayout(self.size, channels, capacity)
+        self.data = numpy.memmap(path, dtype=numpy.uint8, mode="w+", shape=(total_size,))
+        self.timestamps = self.data[index_offset:frames_offset].view(numpy.float64)
+        self.frames = self.data[frames_offset:].reshape((capacity, self.size[0], self.size[1], channels))
+        self.writeHeader()
+
+        self.events = open(eventsPath(path), "w")
+
+    def writeHeader(self):
+        header = struct.pack(HEADER_FORMAT, RECORDING_MAGIC, self.size[0], self.size[1], self.channels, self.capacity, self.frame_count)
+        self.data[:len(header)] = numpy.frombuffer(header, dtype=numpy.uint8)
+
+    '''
+    Append frames to the recording.
+
+    frames - (num_frames, width, height, channels) array
+    timestamps - Capture time of each frame
+
+    Returns the index of the first frame written, or None if the recording is full.
+    '''
+    def recordFrames(self, frames, timestamps):
+        with self.lock:
+            if self.frame_count + len(frames) > self.capacity:
+                return None
+            first = self.frame_count
+            self.frames[first:first + len(frames)] = frames
+            self.timestamps[first:first + len(frames)] = timestamps
+            self.frame_count += len(frames)
+            self.writeHeader()
+            return first
+
+    '''
+    Write one line to the events file.
+    '''
+    def recordEvent(self, event):
+        with self.lock:
+            self.events.write(json.dumps(event) + "\n")
+            self.events.flush()
+
+    '''
+    Record the frames a ball was read from along with what was detected.
+    Returns the ball's number in this recording, or None if the recording is full.
+    '''
+    def recordBall(self, frames, timestamps, standing, pin_count, first_ball, blacklight):
+        first = self.recordFrames(frames, timestamps)
+        if first == None:
+            return None
+
+        with self.lock:
+            ball = self.ball_count
+            self.ball_count += 1
+        self.recordEvent({"type": "ball", "ball": ball, "frame": first, "frames": len(frames),
+                          "time": float(timestamps[-1]), "standing": [bool(p) for p in standing],
+                          "pin_count": int(pin_count), "first_ball": bool(first_ball),
+                          "blacklight": bool(blacklight)})
+        return ball
+
+    def close(self):
+        with self.lock:
+            self.data.flush()
+            self.events.close()
+
+'''
+An existing recording, opened read-only.
+
+frames - (frame_count, width, height, channels) memory-mapped array
+timestamps - Capture time of each frame
+events - List of event dicts from the events file
+'''
+class Recording(object):
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as infile:
+            header = infile.read(struct.calcsize(HEADER_FORMAT))
+        magic, width, height, channels, capacity, frame_count = struct.unpack(HEADER_FORMAT, header)
+        if magic != RECORDING_MAGIC:
+            raise ValueError("%s is not an OpenScore recording" % path)
+
+        self.size = (width, height)
+        self.channels = channels
+        self.frame_count = frame_count
+
+        index_offset, frames_offset, total_size = recordingLayout(self.size, channels, capacity)
+        data = numpy.memmap(path, dtype=numpy.uint8, mode="r", shape=(total_size,))
+        self.timestamps = data[index_offset:frames_offset].view(numpy.float64)[:frame_count]
+        self.frames = data[frames_offset:].reshape((capacity, width, height, channels))[:frame_count]
+
+        self.events = []
+        if os.path.exists(eventsPath(path)):
+            with open(eventsPath(path), "r") as infile:
+                for line in infile:
+                    if line.strip() != "":
+                        self.events.append(json.loads(line))
+
+    '''
+    All events of the given type, in recording order.
+    '''
+    def getEvents(self, event_type):
+        return [e for e in self.events if e["type"] == event_type]
+
+'''
+Plays a Recording back as a frame source.
+
+In loop mode the recording plays continuously, paced by its timestamps when
+realtime is set. Otherwise nothing plays until play() is called with a range of
+frames; once the range has been handed out get_image waits for the next play()
+call. That lets a test harness step through a recording ball by ball.
+'''
+class ReplayCamera(FrameSource):
+
+    name = "replay"
+
+    def __init__(self, recording, loop=True, realtime=True):
+        super(ReplayCamera, self).__init__(recording.size)
+        self.recording = recording
+        self.loop = loop
+        self.realtime = realtime
+        self.position = 0
+        self.stop_position = recording.frame_count if loop else 0
+        self.last_time = None
+        self.paused = False
+        self.range_ready = threading.Condition()
+
+    def stop(self):
+        with self.range_ready:
+            self.range_ready.notify_all()
+
+    '''
+    Queue up count frames starting at frame first to be handed out next.
+    '''
+    def play(self, first, count):
+        with self.range_ready:
+            self.position = first
+            self.stop_position = min(first + count, self.recording.frame_count)
+            self.paused = False
+            self.range_ready.notify_all()
+
+    '''
+    Block until every frame queued by play() has been handed out and the
+    caller has come back for another one (so the last frame has been stored).
+    Returns False on timeout.
+    '''
+    def waitUntilPaused(self, timeout=2.0):
+        deadline = time.time() + timeout
+        with self.range_ready:
+            while not self.paused:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.range_ready.wait(remaining)
+            return True
+
+    def get_image(self, surface=None):
+        with self.range_ready:
+            if self.position >= self.stop_position:
+                if self.loop and self.recording.frame_count > 0:
+                    self.position = 0
+                else:
+                    self.paused = True
+                    self.range_ready.notify_all()
+                    self.range_ready.wait(0.1)
+                    if self.position >= self.stop_position:
+                        raise Exception("Replay paused")
+            index = self.position
+            self.position += 1
+
+        if self.realtime and index > 0 and self.last_time != None:
+            delay = self.recording.timestamps[index] - self.recording.timestamps[index - 1]
+            wait = self.last_time + min(max(delay, 0), 1.0) - time.time()
+            if wait > 0:
+                time.sleep(wait)
+        self.last_time = time.time()
+
+        return self.blitFrame(self.recording.frames[index][:, :, :3], surface)
@@ -0,0 +1,160 @@
+'''
+Reference-frame detection.
+
+Instead of comparing every pixel with one fixed detect color, this engine
+keeps two reference pictures of the calibration regions for each lighting
+mode: one of a full rack and one of an empty deck. A pin's region in a new
+frame is compared with both, and the pin counts as standing when the region
+looks more like the full rack than the empty deck:
+
+    score = d_empty / (d_empty + d_full)
+
+where d_full and d_empty are the mean per-pixel differences from the two
+references. A score of 1 is exactly the full rack, 0 exactly the empty deck.
+
+Lighting drifts over an evening, so every confidently classified pin is
+blended back into the matching reference (a running average), and the
+references follow the lane without anyone re-tuning thresholds.
+
+Only the region pixels are stored, sampled at the camera resolution, so the
+references have to be captured again when the calibration points move.
+'''
+
+import os
+import numpy
+
+REFERENCE_FULL = "full"
+REFERENCE_EMPTY = "empty"
+
+'''
+Score each pin of each frame against a full rack and an empty deck reference
+(see ReferenceModel.scores).
+
+samples - (num_frames, num_pixels, 3) array of region pixels
+full, empty - (num_pixels, 3) reference pixels
+calibration - The CompiledCalibration the pixels were sampled for
+areas - Pixels in each pin's region
+
+Returns a (num_frames, num_pins) float array, 1 for full rack, 0 for empty deck.
+'''
+def scoreSamples(samples, full, empty, calibration, areas):
+    samples = numpy.asarray(samples, dtype=numpy.float32)
+    d_full = calibration.sumRegions(numpy.abs(samples - full).sum(axis=2)) / areas
+    d_empty = calibration.sumRegions(numpy.abs(samples - empty).sum(axis=2)) / areas
+    return d_empty / numpy.maximum(d_empty + d_full, 1e-6)
+
+'''
+Per lighting mode references for one set of calibration regions.
+
+calibration - The CompiledCalibration whose regions are compared
+frame_size - Size of the camera frames the regions are sampled from
+alpha - Weight of a new frame in the running average (0 disables updates)
+level - Score at or above which a pin counts as standing
+update_margin - Only pins scoring at least this far from level update the references
+'''
+class ReferenceModel(object):
+
+    def __init__(self, calibration, frame_size, alpha=0.05, level=0.5, update_margin=0.2):
+        self.alpha = alpha
+        self.level = level
+        self.update_margin = update_margin
+        self.references = {}
+        self.calibration = None
+        self.setCalibration(calibration, frame_size)
+
+    '''
+    Switch to another set of regions. References taken for different regions
+    are useless, so they are dropped if anything changed.
+    '''
+    def setCalibration(self, calibration, frame_size):
+        xs, ys = calibration.sampleCoordinates(frame_size)
+        if self.calibration != None and (len(xs) != len(self.xs) or (xs != self.xs).any() or (ys != self.ys).any()):
+            self.references = {}
+        self.calibration = calibration
+        self.xs = xs.copy()
+        self.ys = ys.copy()
+        self.areas = calibration.areas.astype(numpy.float32)
+
+    '''
+    True once both references exist for the lighting mode.
+    '''
+    def hasReferences(self, mode):
+        return (mode, REFERENCE_FULL) in self.references and (mode, REFERENCE_EMPTY) in self.references
+
+    '''
+    Store a reference from one or more frames' region samples.
+
+    mode - Lighting mode, eg. "normal" or "blacklight"
+    kind - REFERENCE_FULL or REFERENCE_EMPTY
+    samples - (num_frames, num_pixels, 3) array; the frames are averaged
+    '''
+    def setReference(self, mode, kind, samples):
+        self.references[(mode, kind)] = numpy.asarray(samples, dtype=numpy.float32).mean(axis=0)
+
+    '''
+    Score each pin of each frame against the mode's references.
+
+    samples - (num_frames, num_pixels, 3) array of region pixels
+
+    Returns a (num_frames, num_pins) float array, 1 for full rack, 0 for empty deck.
+    '''
+    def scores(self, samples, mode):
+        return scoreSamples(samples, self.references[(mode, REFERENCE_FULL)], self.references[(mode, REFERENCE_EMPTY)],
+                            self.calibration, self.areas)
+
+    '''
+    Decide which pins are standing.
+
+    Returns (standing, scores), both (num_frames, num_pins).
+    '''
+    def classify(self, samples, mode):
+        scores = self.scores(samples, mode)
+        return scores >= self.level, scores
+
+    '''
+    Blend the newest frame into the references for every pin that was
+    clearly standing (into the full rack reference) or clearly down (into the
+    empty deck reference).
+
+    samples - (num_frames, num_pixels, 3) region pixels, as passed to classify
+    scores - The scores classify returned for them
+    '''
+    def update(self, samples, scores, mode):
+        if self.alpha <= 0:
+            return
+        newest = numpy.asarray(samples[-1], dtype=numpy.float32)
+        pin_scores = scores[-1]
+        pixel_scores = pin_scores[self.calibration.roi_index]
+
+        for kind, confident in ((REFERENCE_FULL, pixel_scores >= self.level + self.update_margin),
+                                (REFERENCE_EMPTY, pixel_scores < self.level - self.update_margin)):
+            if not confident.any():
+                continue
+            reference = self.references[(mode, kind)]
+            reference[confident] += self.alpha * (newest[confident] - reference[confident])
+
+    '''
+    Write the references to a .npz file along with the regions they belong to.
+    '''
+    def save(self, path):
+        arrays = {"xs": self.xs, "ys": self.ys}
+        for (mode, kind), reference in self.references.items():
+            arrays[mode + "_" + kind] = reference
+        numpy.savez(path, **arrays)
+
+    '''
+    Read references saved by save(). Files taken for other regions are ignored.
+    Returns True if references were loaded.
+    '''
+    def load(self, path):
+        if not os.path.exists(path):
+            return False
+        data = numpy.load(path)
+        if len(data["xs"]) != len(self.xs) or (data["xs"] != self.xs).any() or (data["ys"] != self.ys).any():
+            return False
+        for name in data.files:
+            if name in ("xs", "ys"):
+                continue
+            mode, kind = name.rsplit("_", 1)
+            self.references[(mode, kind)] = data[name].astype(numpy.float32)
+        return True
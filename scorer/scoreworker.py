@@ -0,0 +1,81 @@
+'''
+Background pin scoring.
+
+Reading the deck can take a while when the camera needs to be recovered, so
+the score screen hands requests to a ScoringWorker instead of calling
+PinCounter.getPinCount from its event handler. The result comes back to the
+main loop as an events.SCORE_READY event.
+'''
+
+import threading
+import Queue
+import pygame
+from events import SCORE_READY
+from deckcheck import DeckBlocked
+from log import *
+
+class ScoringWorker(threading.Thread):
+
+    '''
+    Create a worker that scores balls with the given PinCounter
+    '''
+    def __init__(self, pin_counter):
+        super(ScoringWorker, self).__init__(name="ScoringWorker")
+        self.daemon = True
+        self.pin_counter = pin_counter
+        self.requests = Queue.Queue()
+        self.busy = False
+
+    '''
+    Queue a pin count for the given player.
+
+    first_ball - True to score a first ball, False to score against the last ball
+    player - Index of the player the ball belongs to; this is handed back with the result
+    impact_time - When the ball hit the deck, if known (handed back for latency reporting)
+    '''
+    def requestScore(self, first_ball, player, impact_time=None):
+        self.busy = True
+        self.requests.put((first_ball, player, impact_time))
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request == None:
+                break
+
+            first_ball, player, impact_time = request
+            pin_count = None
+            pin_mask = None
+            pin_confidence = None
+            recorded_ball = None
+            pin_reading = None
+            error = None
+            deck_blocked = False
+            try:
+                pin_count = self.pin_counter.getPinCount(not first_ball)
+                pin_mask = self.pin_counter.pin_mask
+                if self.pin_counter.pin_confidence is not None:
+                    pin_confidence = list(self.pin_counter.pin_confidence)
+                recorded_ball = self.pin_counter.last_recorded_ball
+                pin_reading = self.pin_counter.last_reading
+            except DeckBlocked, e:
+                logger.warning("Scoring request failed: %s" % str(e))
+                error = str(e)
+                deck_blocked = True
+            except Exception, e:
+                logger.error("Scoring request failed")
+                logger.exception('')
+                error = str(e)
+
+            self.busy = not self.requests.empty()
+            pygame.event.post(pygame.event.Event(SCORE_READY, pin_count=pin_count, pin_mask=pin_mask, pin_confidence=pin_confidence,
+                                                 first_ball=first_ball, player=player, impact_time=impact_time,
+                                                 recorded_ball=recorded_ball, pin_reading=pin_reading, error=error, deck_blocked=deck_blocked))
+
+    '''
+    Ask the worker to finish once the queued requests are done.
+    '''
+    def stop(self, timeout=2.0):
+        self.requests.put(None)
+        if self.is_alive():
+            self.join(timeout)
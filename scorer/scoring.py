@@ -0,0 +1,190 @@
+'''
+Incremental game scoring.
+
+A ScoreSheet is fed one ball at a time and keeps the running score up to date
+as it goes, instead of rebuilding the whole game after every ball. Each ball:
+
+  - pays any strike or spare still waiting on bonus balls (at most two marks
+    can be waiting: a double),
+  - is added to its own frame,
+  - and, if it ends a frame with a mark, leaves that frame waiting for one or
+    two more balls.
+
+A frame's score is final once its own balls and any bonus balls are in.
+Frames always become final in order, so the cumulative score through each
+frame can be filled in the moment it is known.
+
+scoreGames does the same for a whole archive of games at once with numpy.
+'''
+
+import numpy
+
+STRIKE_BONUS_BALLS = 2
+SPARE_BONUS_BALLS = 1
+
+class ScoreSheet(object):
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.frame_points = [0] * 10    # Pins plus bonuses counted for each frame so far
+        self.cumulative = [0] * 10      # Score through each final frame
+        self.final = [False] * 10       # Whether a frame's score can't change any more
+        self.frames_final = 0
+        self.pending = []               # [frame, bonus balls still owed] for open marks, oldest first
+        self.total = 0                  # Every pin and bonus counted so far
+        self.closed_total = 0           # total as of the last completed frame
+        self.frame = 0                  # Frame the next ball belongs to
+        self.ball = 0                   # Ball of that frame (0-2)
+        self.frame_pins = 0             # Pins knocked down so far in that frame
+        self.complete = False
+
+    '''
+    Add the pins knocked down by the next ball.
+
+    pins - Pins knocked down by this ball alone (a spare's second ball is the
+           pins left after the first, not 10)
+
+    Returns the number of frames whose score became final with this ball.
+    '''
+    def addRoll(self, pins):
+        if self.complete:
+            return 0
+        finalized = self.frames_final
+
+        # Pay the marks waiting on this ball
+        for waiting in self.pending:
+            self.frame_points[waiting[0]] += pins
+            waiting[1] -= 1
+        self.total += pins * (len(self.pending) + 1)
+        while len(self.pending) > 0 and self.pending[0][1] == 0:
+            self.finishFrame(self.pending.pop(0)[0])
+
+        frame = self.frame
+        self.frame_points[frame] += pins
+
+        if frame < 9:
+            if self.ball == 0 and pins == 10:
+                self.pending.append([frame, STRIKE_BONUS_BALLS])
+                self.nextFrame()
+            elif self.ball == 1:
+                if self.frame_pins + pins == 10:
+                    self.pending.append([frame, SPARE_BONUS_BALLS])
+                else:
+                    self.finishFrame(frame)
+                self.nextFrame()
+            else:
+                self.ball = 1
+                self.frame_pins = pins
+        else:
+            # The 10th frame scores its own fill balls, so nothing ever waits on it
+            self.ball += 1
+            if self.ball == 2 and self.frame_pins + pins < 10:
+                self.complete = True
+            elif self.ball == 3:
+                self.complete = True
+            self.frame_pins += pins
+            if self.complete:
+                self.closed_total = self.total
+                self.finishFrame(frame)
+
+        return self.frames_final - finalized
+
+    '''
+    Mark a frame's score final. Bonus balls are the very next ones, so by the
+    time a frame is final every frame before it is too.
+    '''
+    def finishFrame(self, frame):
+        previous = 0
+        if frame > 0:
+            previous = self.cumulative[frame - 1]
+        self.cumulative[frame] = previous + self.frame_points[frame]
+        self.final[frame] = True
+        self.frames_final += 1
+
+    def nextFrame(self):
+        self.closed_total = self.total
+        self.frame += 1
+        self.ball = 0
+        self.frame_pins = 0
+
+    '''
+    Score a whole game from its balls (as given to addRoll).
+    '''
+    def addRolls(self, rolls):
+        for pins in rolls:
+            if pins == -1:
+                break
+            self.addRoll(pins)
+
+    '''
+    Score a game from its Frame objects, eg. after a score correction changed
+    some shots. Balls a frame can't have (a second ball after a strike, a fill
+    ball after an open 10th) are ignored.
+    '''
+    def addFrames(self, frames):
+        for f in frames:
+            if f.shots[0] == -1:
+                break
+            if f.number != 10 and f.shots[0] == 10:
+                self.addRoll(10)
+                continue
+            for s in f.shots:
+                if s == -1 or self.frame != f.number - 1:
+                    break
+                self.addRoll(s)
+            if self.frame == f.number - 1 and not self.complete:
+                break
+
+'''
+Score many games at once, eg. a season of games for a league report.
+
+rolls - (N, 21) array of games laid out like GameRolls.rolls (frame n's balls
+        start at slot 2 * (n - 1), -1 for balls not bowled). Unfinished games
+        are fine.
+
+Returns (cumulative, final, totals), the same a ScoreSheet fed each game
+ends up with:
+cumulative - (N, 10) score through each frame, 0 for frames not final yet
+final - (N, 10) whether each frame's score is final
+totals - (N,) every pin and bonus counted so far
+'''
+def scoreGames(rolls):
+    rolls = numpy.asarray(rolls)
+    games = len(rolls)
+    bowled = rolls >= 0
+    pins = numpy.where(bowled, rolls, 0).astype(numpy.int32)
+    points = numpy.empty((games, 10), dtype=numpy.int32)
+    final = numpy.empty((games, 10), dtype=bool)
+
+    # Frames 1-9
+    first = pins[:, 0:18:2]
+    second = pins[:, 1:18:2]
+    strike = first == 10
+    spare = ~strike & bowled[:, 1:18:2] & (first + second == 10)
+
+    # The two balls after each frame: the next frame's first ball, then its
+    # second, or the first of the frame after that if the next frame is a
+    # strike (the 10th frame's balls always follow on)
+    frames = numpy.arange(9)
+    following_strike = numpy.zeros((games, 9), dtype=bool)
+    following_strike[:, :8] = strike[:, 1:]
+    second_slot = numpy.where(following_strike, 2 * frames + 4, 2 * frames + 3)
+    game_index = numpy.arange(games)[:, numpy.newaxis]
+    next_pins = pins[:, 2:19:2]
+    next_bowled = bowled[:, 2:19:2]
+    after_pins = pins[game_index, second_slot]
+    after_bowled = bowled[game_index, second_slot]
+
+    points[:, :9] = numpy.where(strike, 10 + next_pins + after_pins, first + second + numpy.where(spare, next_pins, 0))
+    final[:, :9] = numpy.where(strike, next_bowled & after_bowled,
+                               numpy.where(spare, next_bowled, bowled[:, 0:18:2] & bowled[:, 1:18:2]))
+
+    # The 10th frame counts its own fill ball
+    points[:, 9] = pins[:, 18:21].sum(axis=1)
+    open_tenth = (pins[:, 18] + pins[:, 19] < 10)
+    final[:, 9] = bowled[:, 18] & bowled[:, 19] & (bowled[:, 20] | open_tenth)
+
+    cumulative = numpy.where(final, numpy.cumsum(points, axis=1), 0)
+    return cumulative, final, points.sum(axis=1)
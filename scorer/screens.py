@@ -4,7 +4,7 @@ Created on May 1, 2012
 @author: Compy
 '''
 
-import os, sys, platform, math
+import os, sys, platform, math, time
 import pygame
 import pygame.camera
 import pygame.time
@@ -13,6 +13,10 @@ from pygame.locals import *
 from ui_components import *
 from functools import partial
 from scorer import ui_components
+from log import *
+from supervisor import CameraUnavailable
+from reference import REFERENCE_FULL, REFERENCE_EMPTY
+from pinmask import FULL_RACK, isStanding
 
 SCREEN_MODE_FADEIN = 0
 SCREEN_MODE_FADEOUT = 1
@@ -262,6 +266,13 @@ class ScoreScreen(Screen):
         self.show_marquee = False
         self.show_pindicator = False
         
+        # True while a ball is being read by the scoring worker
+        self.score_pending = False
+        # Time from the ball hitting the deck to its score being applied (auto scoring only)
+        self.last_score_latency = None
+        # True after a first ball was held because the rack wasn't full, until 'S' scores it
+        self.rack_confirm_pending = False
+        
         # The start position of the scrolling marquee seen at the end of each game
         self.marquee_x = 800
         self.marquee_y = 565
@@ -318,9 +329,29 @@ class ScoreScreen(Screen):
             textpos = self.marquee_text.get_rect(x=self.marquee_x,y=self.marquee_y)
             screen_surface.blit(self.marquee_text, textpos)
             
+        if self.score_pending:
+            text = self.text_font.render("Reading pins...", 1, (255, 255, 0))
+            textpos = text.get_rect(right=790, y=565)
+            screen_surface.blit(text, textpos)
+        elif self.bowling_scorer.current_player != -1 and self.bowling_scorer.is_first_ball and not self.bowling_scorer.pinCounter.rackReady():
+            text = self.text_font.render("Waiting for a full rack...", 1, (255, 255, 0))
+            textpos = text.get_rect(right=790, y=565)
+            screen_surface.blit(text, textpos)
+            
         if (self.do_debug == True):
             surface = self.bowling_scorer.pinCounter.getDeckSnapshot()
             screen_surface.blit(surface, (480,360))
+            
+            stats = self.bowling_scorer.pinCounter.getCaptureStats()
+            if (stats != None and stats["frame_age"] != None):
+                text = self.text_font.render("Frame age: %d ms   Dropped: %d" % (stats["frame_age"] * 1000, stats["frames_dropped"]), 1, (255, 255, 0))
+                textpos = text.get_rect(x=480, y=330)
+                screen_surface.blit(text, textpos)
+            
+            if (self.last_score_latency != None):
+                text = self.text_font.render("Impact to score: %d ms" % (self.last_score_latency * 1000), 1, (255, 255, 0))
+                textpos = text.get_rect(x=480, y=300)
+                screen_surface.blit(text, textpos)
     
     def Update(self, game_time):
         super(ScoreScreen,self).Update(game_time)
@@ -338,35 +369,84 @@ class ScoreScreen(Screen):
     def HandleEvent(self, e):
         if e.type == pygame.KEYDOWN:
             if e.key == pygame.K_s and self.bowling_scorer.current_player != -1:
-                self.ScoreFromCamera()
+                self.ScoreFromCamera(confirm_rack=self.rack_confirm_pending)
             if (e.key == K_SPACE):
                 self.screen_manager.RemoveScreen(self)
                 self.screen_manager.AddScreen(self.screen_manager.mainmenu)
             if (e.key == K_d):
                 self.do_debug = not self.do_debug
                 
-    def ScoreFromCamera(self):
-        player = self.bowling_scorer.players[self.bowling_scorer.current_player]
-        if self.bowling_scorer.is_first_ball == True:
-            pinCount = self.bowling_scorer.pinCounter.getPinCount(False)
-            
-            '''
-            If this is the first ball, AND we're doing no-tap, check things out here
-            and adjust the count as needed.
-            '''
-            if (pinCount >= self.bowling_scorer.min_pincount_strike):
-                pinCount = 10
-            
-            if (pinCount < 10):
+    '''
+    Ask the scoring worker to read the deck for the current player. The result
+    is applied in ScoreReady once the worker posts it back to the main loop.
+    '''
+    def ScoreFromCamera(self, impact_time=None, confirm_rack=False):
+        if self.score_pending:
+            return
+        
+        # A first ball needs a full rack before it; if there wasn't one, hold
+        # the score until the operator presses 'S' to confirm
+        if self.bowling_scorer.is_first_ball and not self.bowling_scorer.pinCounter.rackReady() and not confirm_rack:
+            logger.warning("Rack was not full before the first ball, waiting for confirmation")
+            self.rack_confirm_pending = True
+            self.screen_manager.ShowMessageBox("The rack was not full. Press S to score this ball anyway.", 4000)
+            return
+        self.rack_confirm_pending = False
+        
+        self.score_pending = True
+        self.bowling_scorer.scoringWorker.requestScore(self.bowling_scorer.is_first_ball, self.bowling_scorer.current_player, impact_time)
+    
+    '''
+    The ball detector saw a ball hit and the deck settle (a BALL_DETECTED event).
+    Score it as if 'S' had been pressed, unless it was on another lane, nobody
+    is bowling or a menu is up.
+    '''
+    def BallDetected(self, e):
+        if e.lane != self.bowling_scorer.lane:
+            return
+        if self.bowling_scorer.current_player == -1:
+            return
+        if self not in self.screen_manager.screens and self.screen_manager.pindication not in self.screen_manager.screens:
+            return
+        logger.info("Ball detected, deck settled %d ms after impact" % ((e.settle_time - e.impact_time) * 1000))
+        self.ScoreFromCamera(e.impact_time)
+    
+    '''
+    Apply a pin count delivered by the scoring worker (a SCORE_READY event)
+    '''
+    def ScoreReady(self, e):
+        self.score_pending = False
+        if e.impact_time != None:
+            self.last_score_latency = time.time() - e.impact_time
+            logger.info("Impact to score latency: %d ms" % (self.last_score_latency * 1000))
+        if e.error != None:
+            if self.bowling_scorer.pinCounter.getCameraStatus() != None:
+                self.screen_manager.ShowMessageBox("Camera disconnected. Score this ball again once it is back.")
+            elif e.deck_blocked:
+                self.screen_manager.ShowMessageBox("Something is in front of the pins. Score this ball again once it's clear.")
+            else:
+                self.screen_manager.ShowMessageBox("Could not read the pins. Please score this ball again.")
+            return
+        if e.player != self.bowling_scorer.current_player or e.first_ball != self.bowling_scorer.is_first_ball:
+            # The game moved on (skip bowler, new game, score correction) while we were reading
+            logger.warning("Discarding stale pin count for player %d" % e.player)
+            return
+        
+        player = self.bowling_scorer.players[e.player]
+        pinCount = e.pin_count
+        frame = player.frames[player.current_frame]
+        self.bowling_scorer.pinCounter.recordScored(e.recorded_ball, e.player, player.current_frame, frame.shots.index(-1) if -1 in frame.shots else len(frame.shots), e.pin_reading)
+        # No-tap is applied by the player's progression state machine
+        pinCount, events = player.addShot(pinCount,e.pin_mask)
+        if e.first_ball == True:
+            if (pinCount < 10 and self in self.screen_manager.screens):
                 
-                self.screen_manager.pindication.show_pins = self.bowling_scorer.pinCounter.pin_display
+                self.screen_manager.pindication.show_mask = e.pin_mask
                 self.screen_manager.pindication.FadeIn()
                 self.screen_manager.AddScreen(self.screen_manager.pindication)
                 self.screen_manager.RemoveScreen(self)
-        else:
-            pinCount = self.bowling_scorer.pinCounter.getPinCount(True)
             
-        player.addShot(pinCount,self.bowling_scorer.pinCounter.pin_display)
+        self.bowling_scorer.ball_scored(events)
         
     def RefreshPlayerInfo(self):
         for p in self.bowling_scorer.players:
@@ -663,13 +743,14 @@ class ScoreCorrectionScreen(Screen):
                 shot = 0
             
         #self.bowling_scorer.players[self.selected_player].DrawFrames(surface=screen_surface,yscew=50,showTotal=False,current_box=self.current_box_pos)
+        self.bowling_scorer.pinCounter.recordCorrection(self.selected_player, frame, shot, key)
         if (key == "X" or key == "x"):
             if (self.current_box_pos >= 19):
                 self.bowling_scorer.players[self.selected_player].frames[frame].shots[shot] = 10
             else:
                 self.bowling_scorer.players[self.selected_player].frames[frame].makeStrike()
             
-            self.bowling_scorer.pinCounter.last_ball_score = 10
+            self.bowling_scorer.pinCounter.setLastBallScore(10)
         elif (key == "/"):
             if (self.current_box_pos >= 19):
                 self.bowling_scorer.players[self.selected_player].frames[frame].shots[shot] = 10 - self.bowling_scorer.players[self.selected_player].frames[frame].shots[shot - 1]
@@ -677,7 +758,7 @@ class ScoreCorrectionScreen(Screen):
                 self.bowling_scorer.players[self.selected_player].frames[frame].makeSpare()
         else:
             self.bowling_scorer.players[self.selected_player].frames[frame].shots[shot] = int(key)
-            self.bowling_scorer.pinCounter.last_ball_score = int(key)
+            self.bowling_scorer.pinCounter.setLastBallScore(int(key))
         
 class SkipBowlerScreen(Screen):
     def __init__(self, screen_manager):
@@ -969,8 +1050,8 @@ class CalibrateCameraScreen(Screen):
         self.draw_text_color = (255,255,255)
         
         for i in range(1,11):
-            if self.bowling_scorer.config.gettuple("Calibration", "point_"+str(i)) != None:
-                self.points.append(self.bowling_scorer.config.gettuple("Calibration", "point_"+str(i)))
+            if self.bowling_scorer.lane_config.gettuple("Calibration", "point_"+str(i)) != None:
+                self.points.append(self.bowling_scorer.lane_config.gettuple("Calibration", "point_"+str(i)))
             else:
                 self.points.append((-1,-1))
                 
@@ -987,6 +1068,12 @@ class CalibrateCameraScreen(Screen):
         snapshot = self.bowling_scorer.pinCounter.getDeckSnapshot()
         screen_surface.blit(snapshot, (0,0))
         
+        # Make it obvious when the deck shown isn't the live camera
+        source = self.bowling_scorer.pinCounter.camera.name
+        if (source != "camera"):
+            text = self.small_font.render("Frame source: " + source, 1, (255,255,0))
+            screen_surface.blit(text, (10, 245))
+        
         for px,py in self.points:
             if (px == -1 or py == -1): continue
             pygame.draw.rect(screen_surface, pygame.color.Color("red"), (px,py,5,5),1)
@@ -996,10 +1083,14 @@ class CalibrateCameraScreen(Screen):
         textpos = text.get_rect(centerx=400, y=570)
         screen_surface.blit(text, textpos)
         
-        text = self.small_font.render("D - Edit Detect Color   T - Edit Threshold   N - Edit Blackout Color", 1, self.draw_text_color)
+        text = self.small_font.render("D - Edit Detect Color   T - Edit Threshold   N - Edit Blackout Color   A - Auto Calibrate", 1, self.draw_text_color)
         textpos = text.get_rect(centerx=400, y=540)
         screen_surface.blit(text, textpos)
         
+        text = self.small_font.render("F - Take Full Rack Reference   E - Take Empty Deck Reference", 1, self.draw_text_color)
+        textpos = text.get_rect(centerx=400, y=490)
+        screen_surface.blit(text, textpos)
+        
         text = self.font.render("Hit 'S' to score the current deck", 1, self.draw_text_color)
         textpos = text.get_rect(centerx=400, y=510)
         screen_surface.blit(text, textpos)
@@ -1129,7 +1220,16 @@ class CalibrateCameraScreen(Screen):
                 self.Close()
                 return False
             elif event.key == K_s:
-                self.detected_pin_count = self.bowling_scorer.pinCounter.getPinCount()
+                try:
+                    self.detected_pin_count = self.bowling_scorer.pinCounter.getPinCount()
+                except CameraUnavailable:
+                    self.screen_manager.ShowMessageBox("No picture from the camera right now.")
+            elif event.key == K_a:
+                self.AutoCalibrate()
+            elif event.key == K_f:
+                self.CaptureReference(REFERENCE_FULL, "full rack")
+            elif event.key == K_e:
+                self.CaptureReference(REFERENCE_EMPTY, "empty deck")
             elif event.key == K_0:
                 self.current_add_pin = 10
             elif event.key == K_1:
@@ -1152,8 +1252,8 @@ class CalibrateCameraScreen(Screen):
                 self.current_add_pin = 9
             elif event.key == K_d:
                 self.current_edit = 1
-                b_d_c = self.bowling_scorer.config.gettuple("Camera", "bl_detect_color")
-                d_c = self.bowling_scorer.config.gettuple("Camera", "detect_color")
+                b_d_c = self.bowling_scorer.lane_config.gettuple("Camera", "bl_detect_color")
+                d_c = self.bowling_scorer.lane_config.gettuple("Camera", "detect_color")
                 if (self.edit_bl):
                     self.sr.setvalue(b_d_c[0])
                     self.sg.setvalue(b_d_c[1])
@@ -1164,8 +1264,8 @@ class CalibrateCameraScreen(Screen):
                     self.sb.setvalue(d_c[2])
             elif event.key == K_t:
                 self.current_edit = 2
-                b_t_d = self.bowling_scorer.config.gettuple("Camera", "bl_threshold_detect")
-                t_d = self.bowling_scorer.config.gettuple("Camera", "threshold_detect")
+                b_t_d = self.bowling_scorer.lane_config.gettuple("Camera", "bl_threshold_detect")
+                t_d = self.bowling_scorer.lane_config.gettuple("Camera", "threshold_detect")
                 if (self.edit_bl):
                     self.sr.setvalue(b_t_d[0])
                     self.sg.setvalue(b_t_d[1])
@@ -1176,8 +1276,8 @@ class CalibrateCameraScreen(Screen):
                     self.sb.setvalue(t_d[2])
             elif event.key == K_n:
                 self.current_edit = 3
-                o_c_n = self.bowling_scorer.config.gettuple("Camera", "other_colors_nondetect")
-                b_o_c_n = self.bowling_scorer.config.gettuple("Camera", "bl_other_colors_nondetect")
+                o_c_n = self.bowling_scorer.lane_config.gettuple("Camera", "other_colors_nondetect")
+                b_o_c_n = self.bowling_scorer.lane_config.gettuple("Camera", "bl_other_colors_nondetect")
                 if self.edit_bl:
                     self.sr.setvalue(b_o_c_n[0])
                     self.sg.setvalue(b_o_c_n[1])
@@ -1188,13 +1288,13 @@ class CalibrateCameraScreen(Screen):
                     self.sb.setvalue(o_c_n[2])
             elif event.key == K_RETURN:
                 if (self.edit_bl):
-                    self.bowling_scorer.config.setvalue("Camera", "bl_detect_color", self.bowling_scorer.pinCounter.bl_detect_color)
-                    self.bowling_scorer.config.setvalue("Camera", "bl_threshold_detect", self.bowling_scorer.pinCounter.bl_threshold_detect)
-                    self.bowling_scorer.config.setvalue("Camera", "bl_other_colors_nondetect", self.bowling_scorer.pinCounter.bl_other_colors_nondetect)
+                    self.bowling_scorer.lane_config.setvalue("Camera", "bl_detect_color", self.bowling_scorer.pinCounter.bl_detect_color)
+                    self.bowling_scorer.lane_config.setvalue("Camera", "bl_threshold_detect", self.bowling_scorer.pinCounter.bl_threshold_detect)
+                    self.bowling_scorer.lane_config.setvalue("Camera", "bl_other_colors_nondetect", self.bowling_scorer.pinCounter.bl_other_colors_nondetect)
                 else:
-                    self.bowling_scorer.config.setvalue("Camera", "detect_color", self.bowling_scorer.pinCounter.detect_color)
-                    self.bowling_scorer.config.setvalue("Camera", "threshold_detect", self.bowling_scorer.pinCounter.threshold_detect)
-                    self.bowling_scorer.config.setvalue("Camera", "other_colors_nondetect", self.bowling_scorer.pinCounter.other_colors_nondetect)
+                    self.bowling_scorer.lane_config.setvalue("Camera", "detect_color", self.bowling_scorer.pinCounter.detect_color)
+                    self.bowling_scorer.lane_config.setvalue("Camera", "threshold_detect", self.bowling_scorer.pinCounter.threshold_detect)
+                    self.bowling_scorer.lane_config.setvalue("Camera", "other_colors_nondetect", self.bowling_scorer.pinCounter.other_colors_nondetect)
                     
                 self.bowling_scorer.config.save()
                 self.screen_manager.ShowMessageBox("Changes Saved")
@@ -1215,6 +1315,34 @@ class CalibrateCameraScreen(Screen):
             else:
                 self.current_edit = 0
             
+    '''
+    Place all ten points from the current (full rack) snapshot
+    '''
+    def AutoCalibrate(self):
+        try:
+            result = self.bowling_scorer.pinCounter.autoCalibrate()
+        except CameraUnavailable:
+            self.screen_manager.ShowMessageBox("No picture from the camera right now.")
+            return
+        except ValueError, e:
+            self.screen_manager.ShowMessageBox(str(e))
+            return
+        
+        self.points = list(result["points"])
+        self.screen_manager.ShowMessageBox("Calibrated, point size %d, %d points to trigger" % (result["point_size"], result["min_points_to_trigger"]))
+    
+    '''
+    Store the current deck as one of the reference frames for the current
+    lighting mode
+    '''
+    def CaptureReference(self, kind, description):
+        try:
+            self.bowling_scorer.pinCounter.captureReference(kind)
+        except CameraUnavailable:
+            self.screen_manager.ShowMessageBox("No picture from the camera right now.")
+            return
+        self.screen_manager.ShowMessageBox("Saved " + description + " reference for " + self.bowling_scorer.pinCounter.getLightingMode() + " lighting")
+    
     def writePointsToConfig(self):
         for i in range(1,11):
             if (i > len(self.points)):
@@ -1222,7 +1350,7 @@ class CalibrateCameraScreen(Screen):
             else:
                 point = self.points[i-1]
                 
-            self.bowling_scorer.config.setvalue("Calibration", "point_"+str(i), point)
+            self.bowling_scorer.lane_config.setvalue("Calibration", "point_"+str(i), point)
             
         self.bowling_scorer.config.save()
         self.bowling_scorer.pinCounter.reloadCalibration()
@@ -1243,9 +1371,7 @@ class CalibrateCameraScreen(Screen):
 class PindicationScreen(Screen):
     def __init__(self, screen_manager):
         super(PindicationScreen, self).__init__(screen_manager,6)
-        self.show_pins = []
-        for i in range(10):
-            self.show_pins.append(True)
+        self.show_mask = FULL_RACK
         
         self.pos_1 = (390, 480)
         
@@ -1262,6 +1388,8 @@ class PindicationScreen(Screen):
         self.pos_10 = (630, 60)
         
         self.font = pygame.font.SysFont("Arial", 48, True)
+        self.leave_font = pygame.font.SysFont("Arial", 36, True)
+        self.leave_pos = (390, 565)
             
         self.pin_radius = 40
         self.pin_color = (255,255,255,255)
@@ -1279,39 +1407,46 @@ class PindicationScreen(Screen):
             self.number_color = (0,0,255,self.alpha)
             self.pin_surface.set_alpha(self.alpha)
             
-        if (self.show_pins[6] == True):
+        if (isStanding(self.show_mask, 7)):
             pygame.draw.circle(self.pin_surface, self.pin_color, self.pos_7, self.pin_radius)
             self.RenderText(self.pin_surface, self.pos_7, "7", self.number_color)
-        if (self.show_pins[7] == True):
+        if (isStanding(self.show_mask, 8)):
             pygame.draw.circle(self.pin_surface, self.pin_color, self.pos_8, self.pin_radius)
             self.RenderText(self.pin_surface, self.pos_8, "8", self.number_color)
-        if (self.show_pins[8] == True):
+        if (isStanding(self.show_mask, 9)):
             pygame.draw.circle(self.pin_surface, self.pin_color, self.pos_9, self.pin_radius)
             self.RenderText(self.pin_surface, self.pos_9, "9", self.number_color)
-        if (self.show_pins[9] == True):
+        if (isStanding(self.show_mask, 10)):
             pygame.draw.circle(self.pin_surface, self.pin_color, self.pos_10, self.pin_radius)
             self.RenderText(self.pin_surface, self.pos_10, "10", self.number_color)
         
-        if (self.show_pins[3] == True):
+        if (isStanding(self.show_mask, 4)):
             pygame.draw.circle(self.pin_surface, self.pin_color, self.pos_4, self.pin_radius)
             self.RenderText(self.pin_surface, self.pos_4, "4", self.number_color)
-        if (self.show_pins[4] == True):
+        if (isStanding(self.show_mask, 5)):
             pygame.draw.circle(self.pin_surface, self.pin_color, self.pos_5, self.pin_radius)
             self.RenderText(self.pin_surface, self.pos_5, "5", self.number_color)
-        if (self.show_pins[5] == True):
+        if (isStanding(self.show_mask, 6)):
             pygame.draw.circle(self.pin_surface, self.pin_color, self.pos_6, self.pin_radius)
             self.RenderText(self.pin_surface, self.pos_6, "6", self.number_color)
         
-        if (self.show_pins[1] == True):
+        if (isStanding(self.show_mask, 2)):
             pygame.draw.circle(self.pin_surface, self.pin_color, self.pos_2, self.pin_radius)
             self.RenderText(self.pin_surface, self.pos_2, "2", self.number_color)
-        if (self.show_pins[2] == True):
+        if (isStanding(self.show_mask, 3)):
             pygame.draw.circle(self.pin_surface, self.pin_color, self.pos_3, self.pin_radius)
             self.RenderText(self.pin_surface, self.pos_3, "3", self.number_color)
             
-        if (self.show_pins[0] == True):
+        if (isStanding(self.show_mask, 1)):
             pygame.draw.circle(self.pin_surface, self.pin_color, self.pos_1, self.pin_radius)
             self.RenderText(self.pin_surface, self.pos_1, "1", self.number_color)
+        
+        # Name the leave (split, washout, bedposts...) under the pins
+        leave_name = splits.leaveName(self.show_mask)
+        if leave_name != "":
+            text = self.leave_font.render(leave_name, 1, self.pin_color)
+            text.set_alpha(self.alpha)
+            self.pin_surface.blit(text, text.get_rect(centerx=self.leave_pos[0], centery=self.leave_pos[1]))
             
         screen_surface.blit(self.pin_surface, (0,0))
             
@@ -1331,7 +1466,10 @@ class PindicationScreen(Screen):
         surface.blit(text, textpos)
         
     def show_pin(self, pin_number, show=True):
-        self.show_pins[pin_number] = show
+        if show:
+            self.show_mask |= 1 << pin_number
+        else:
+            self.show_mask &= ~(1 << pin_number)
         
     def ScreenShown(self):
         self.time_shown = self.screen_manager.game_time
@@ -1375,10 +1513,24 @@ class ScreenManager(object):
     def Draw(self):
         for screen in self.screens:
             screen.Draw(self.screen_surface)
+        
+        if (self.bowling_scorer.pinCounter != None):
+            status = self.bowling_scorer.pinCounter.getCameraStatus()
+            if (status != None):
+                self.DrawStatusBanner(status)
             
         if (self.display_modal):
             self.DrawModal()
     
+    '''
+    Draw a warning strip across the top of the screen, eg. while the camera
+    is reconnecting
+    '''
+    def DrawStatusBanner(self, message):
+        text = self.modal_font.render(message, 1, (255, 255, 255))
+        pygame.draw.rect(self.screen_surface, (180,0,0), (0, 0, self.screen_surface.get_width(), text.get_height() + 10))
+        self.screen_surface.blit(text, text.get_rect(centerx=self.screen_surface.get_width() / 2, y=5))
+    
     def DrawModal(self):
         text = self.modal_font.render(self.modal_message, 1, (255, 255, 255))
         textpos = text.get_rect(centerx=400,centery=300)
@@ -3,55 +3,133 @@ Created on Jun 11, 2012
 
 @author: Jimmy
 '''
-splits = []
-splits.append((7,10))
-splits.append((6,7))
-splits.append((4,6))
-splits.append((2,10))
-splits.append((2,4,10))
-splits.append((4,9))
-splits.append((3,8))
-splits.append((2,9))
-splits.append((6,8))
-splits.append((4,10))
-splits.append((7,9))
-splits.append((8,10))
-splits.append((5,7))
-splits.append((5,10))
-splits.append((5,7,10))
-splits.append((3,7))
-splits.append((2,7))
-splits.append((3,10))
-splits.append((2,7,10))
-splits.append((3,7,10))
-splits.append((4,6,7,10))
-splits.append((2,3))
-splits.append((4,5))
-splits.append((5,6))
-splits.append((7,8))
-splits.append((8,9))
-splits.append((9,10))
-splits.append((4,6,9))
-splits.append((4,6,8))
-splits.append((4,6,7,8,10))
-splits.append((4,6,7,9,10))
-splits.append((3,4,6,7,10))
-splits.append((2,4,6,7,10))
-splits.append((2,4,6,7,8,10))
-splits.append((3,4,6,7,9,10))
-splits.append((4,7,10))
-splits.append((6,7,10))
+from pinmask import FULL_RACK, maskFromStates, maskFromPins, pinsFromMask
 
+'''
+Leaves are classified by rule once for every possible standing mask (see
+pinmask), so a first ball's leave is looked up with a single index.
+
+Two standing pins "touch" when one can take out the other: diagonal
+neighbours (eg. 2-4, 5-9) and pins directly behind one another (1-5, 2-8,
+3-9). Pins next to each other in a row (eg. 5-6) don't touch; only the pin in
+front of and between them joins them. A leave whose standing pins fall into
+more than one group is a split if the headpin is down and a washout if it is
+standing.
+'''
+
+LEAVE_NONE = 0          # Nothing standing
+LEAVE_SPARE = 1         # An ordinary spare leave
+LEAVE_SPLIT = 2
+LEAVE_BABY_SPLIT = 3    # Two pins down one side of the deck with only the pin between them down (2-7, 3-10)
+LEAVE_WASHOUT = 4       # Split apart like a split, but with the headpin standing
+
+LEAVE_KIND_NAMES = {
+    LEAVE_NONE: "",
+    LEAVE_SPARE: "",
+    LEAVE_SPLIT: "Split",
+    LEAVE_BABY_SPLIT: "Baby split",
+    LEAVE_WASHOUT: "Washout",
+}
+
+# (column, row) of each pin, headpin first; columns are half a pin spacing apart
+PIN_POSITIONS = ((0, 0), (-1, 1), (1, 1), (-2, 2), (0, 2), (2, 2), (-3, 3), (-1, 3), (1, 3), (3, 3))
+
+'''
+The pins touching each pin, as one mask per pin (pin 1 first).
+'''
+def touchingPins():
+    touching = []
+    for column, row in PIN_POSITIONS:
+        mask = 0
+        for i in range(10):
+            other_column, other_row = PIN_POSITIONS[i]
+            rows = abs(other_row - row)
+            columns = abs(other_column - column)
+            if (rows == 1 and columns == 1) or (rows == 2 and columns == 0):
+                mask |= 1 << i
+        touching.append(mask)
+    return touching
+
+TOUCHING = touchingPins()
+
+'''
+Number of separate groups the standing pins of a mask fall into.
+'''
+def countGroups(mask):
+    groups = 0
+    remaining = mask
+    while remaining:
+        group = remaining & -remaining
+        while True:
+            grown = group
+            for pin in pinsFromMask(group):
+                grown |= TOUCHING[pin - 1] & mask
+            if grown == group:
+                break
+            group = grown
+        remaining &= ~group
+        groups += 1
+    return groups
+
+def classifyLeave(mask):
+    if mask == 0:
+        return LEAVE_NONE
+    if countGroups(mask) < 2:
+        return LEAVE_SPARE
+    if mask & 1:
+        return LEAVE_WASHOUT
+    pins = pinsFromMask(mask)
+    if len(pins) == 2:
+        first, second = PIN_POSITIONS[pins[0] - 1], PIN_POSITIONS[pins[1] - 1]
+        if abs(first[0] - second[0]) == 2 and abs(first[1] - second[1]) == 2 and first[0] * second[0] > 0:
+            return LEAVE_BABY_SPLIT
+    return LEAVE_SPLIT
+
+# Kind of every leave, and whether it is marked as a split on the score sheet
+LEAVE_KINDS = tuple(classifyLeave(mask) for mask in range(FULL_RACK + 1))
+SPLITS = tuple(kind in (LEAVE_SPLIT, LEAVE_BABY_SPLIT) for kind in LEAVE_KINDS)
+
+# Leaves with names of their own
+LEAVE_NAMES = {}
+for name, leaves in (("Bedposts", ((7, 10),)),
+                     ("Cincinnati", ((8, 10),)),
+                     ("Woolworth", ((5, 10),)),
+                     ("Kresge", ((5, 7),)),
+                     ("Lily", ((5, 7, 10),)),
+                     ("Christmas tree", ((2, 7, 10), (3, 7, 10))),
+                     ("Big four", ((4, 6, 7, 10),)),
+                     ("Greek church", ((4, 6, 7, 8, 10), (4, 6, 7, 9, 10))),
+                     ("Bucket", ((2, 4, 5, 8), (3, 5, 6, 9))),
+                     ("Picket fence", ((1, 2, 4, 7), (1, 3, 6, 10))),
+                     ("Sleeper", ((1, 5), (2, 8), (3, 9)))):
+    for pins in leaves:
+        LEAVE_NAMES[maskFromPins(pins)] = name
+
+def toMask(pindeck_state):
+    if not isinstance(pindeck_state, (int, long)):
+        return maskFromStates(pindeck_state)
+    return pindeck_state & FULL_RACK
+
+'''
+True if the pins left standing are a split.
+
+pindeck_state - Standing mask (see pinmask), or a list of 10 standing flags
+'''
 def isSplit(pindeck_state):
-    pins_standing = []
-    counter = 1
-    for p in pindeck_state:
-        if p == True:
-            pins_standing.append(counter)
-        counter += 1
-        
-    pins_standing = tuple(pins_standing)
-        
-    match = [item for item in splits if pins_standing == item]
-    return len(match) > 0
-            
\ No newline at end of file
+    return SPLITS[toMask(pindeck_state)]
+
+'''
+The LEAVE_* kind of the pins left standing.
+'''
+def leaveKind(pindeck_state):
+    return LEAVE_KINDS[toMask(pindeck_state)]
+
+'''
+What to call a leave: its own name if it has one (eg. "Bedposts"), else its
+kind ("Split", "Washout", ...), or "" for an ordinary leave.
+'''
+def leaveName(pindeck_state):
+    mask = toMask(pindeck_state)
+    if mask in LEAVE_NAMES:
+        return LEAVE_NAMES[mask]
+    return LEAVE_KIND_NAMES[LEAVE_KINDS[mask]]
@@ -0,0 +1,96 @@
+'''
+Camera fault supervision.
+
+USB cameras drop out: a cable gets knocked, the driver hangs, the device
+resets. The CameraSupervisor thread notices when the capture worker stops
+delivering fresh frames and reopens the frame source in the background,
+waiting longer after each failed attempt. Scoring never waits on the
+recovery; while the camera is down a read fails straight away with
+CameraUnavailable and the screens show a status banner instead.
+'''
+
+import threading
+import time
+from log import *
+
+CAMERA_OK = 0
+CAMERA_RECONNECTING = 1
+
+'''
+Raised when the pins can't be read because there is no fresh camera frame.
+'''
+class CameraUnavailable(Exception):
+    pass
+
+'''
+Watches the capture of a PinCounter and reopens its camera when it fails.
+
+pin_counter - Provides captureHealthy(), openCamera() and closeCamera()
+check_interval - Seconds between health checks
+min_backoff, max_backoff - Range of the wait between reconnect attempts, in
+seconds; the wait doubles after every failed attempt
+'''
+class CameraSupervisor(threading.Thread):
+
+    def __init__(self, pin_counter, check_interval=0.5, min_backoff=1.0, max_backoff=30.0):
+        super(CameraSupervisor, self).__init__(name="CameraSupervisor")
+        self.daemon = True
+        self.pin_counter = pin_counter
+        self.check_interval = check_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self.state = CAMERA_OK
+        self.status = None
+        self.attempts = 0
+        self.outages = 0
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.wait(self.check_interval) and not self.stopping.is_set():
+            if self.pin_counter.captureHealthy():
+                continue
+
+            logger.warning("Camera stopped delivering frames, reconnecting")
+            self.state = CAMERA_RECONNECTING
+            self.outages += 1
+            self.reconnect()
+
+    '''
+    Reopen the camera until it delivers frames again (or the supervisor is
+    stopped), backing off between attempts.
+    '''
+    def reconnect(self):
+        self.attempts = 0
+        backoff = self.min_backoff
+        self.status = "Camera disconnected, reconnecting..."
+
+        while not self.stopping.is_set():
+            self.attempts += 1
+            try:
+                self.pin_counter.closeCamera()
+                self.pin_counter.openCamera()
+                if self.pin_counter.waitForFirstFrame():
+                    logger.info("Camera reconnected after %d attempt(s)" % self.attempts)
+                    self.state = CAMERA_OK
+                    self.status = None
+                    return
+                logger.warning("Reopened camera is not delivering frames")
+            except Exception:
+                logger.warning("Camera reconnect attempt %d failed" % self.attempts)
+                logger.exception('')
+
+            self.status = "Camera disconnected, retrying in %d seconds..." % int(round(backoff))
+            self.stopping.wait(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    '''
+    True if the camera is currently believed to be working.
+    '''
+    def healthy(self):
+        return self.state == CAMERA_OK
+
+    def stop(self, timeout=5.0):
+        self.stopping.set()
+        if self.is_alive() and threading.current_thread() != self:
+            self.join(timeout)